@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+音声モードのアップロード前処理
+ffmpeg でモノラル・音声向けの低ビットレートに変換して長い無音を詰め、
+長い録音は区切り位置付近の無音でチャンクに分割する（チャンクごとに並列解析し、結果を統合する）
+チャンクは重ねないため、統合した結果に同じ発話が二重に入ることはない
+変換結果は元ファイルの内容ハッシュ単位でキャッシュする。ffmpeg がない場合は元ファイルをそのまま使う
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.config import config_manager
+from utils.file_hash import file_content_hash
+from .ffmpeg_tools import detect_silences, find_ffmpeg, probe_duration, prune_cache_dir, run_ffmpeg
+from .video_segmenter import merge_segment_outputs
+
+logger = logging.getLogger(__name__)
+
+AUDIO_CACHE_DIR_NAME = 'audio_cache'
+
+# 音声前処理設定のデフォルト値（config.json の audio_preprocess で上書き可能）
+DEFAULT_AUDIO_PREPROCESS_CONFIG = {
+    "enabled": True,
+    "ffmpeg_path": "",             # 空の場合は PATH から ffmpeg を探す
+    "sample_rate": 16000,          # 変換後のサンプリングレート（Hz）
+    "bitrate": "32k",              # 変換後のビットレート（モノラル）
+    "trim_silence": True,          # 長い無音を詰めるか
+    "silence_threshold_db": -45,   # これより小さい音量を無音とみなす（dB）
+    "min_silence_seconds": 2.0,    # これより長い無音を詰める（秒）
+    "keep_silence_seconds": 0.5,   # 詰めた箇所に残す無音の長さ（秒）
+    "split_above_seconds": 900,    # 変換後の長さがこれを超える録音をチャンクに分割する
+    "chunk_seconds": 600,          # 1チャンクの長さ（秒）
+    "boundary_search_seconds": 30, # 区切り位置の前後この範囲で無音を探し、その中央で区切る（発話の途中で切らない）
+    "boundary_silence_seconds": 0.3,  # 区切りに使う無音の最短長（秒）
+    "reducer": "concat",           # チャンクごとの出力の統合方法（concat / first / last / longest）
+    "field_reducers": {},          # 出力項目ごとの統合方法
+    "separator": "\n",             # concat で値をつなぐ区切り文字
+    "max_age_days": 7,             # 変換済みファイルの保持日数
+}
+
+
+class AudioPreprocessor:
+    """音声をモノラル・低ビットレートに変換し、無音を詰めて、必要ならチャンクに分割する"""
+
+    def __init__(self, ffmpeg: str, cache_dir: str, config: Dict[str, Any]):
+        """
+        Args:
+            ffmpeg: ffmpeg 実行ファイルのパス
+            cache_dir: 変換済みファイルの保存先
+            config: audio_preprocess 設定（デフォルト値とマージ済み）
+        """
+        self.ffmpeg = ffmpeg
+        self.cache_dir = cache_dir
+        self.sample_rate = int(config["sample_rate"])
+        self.bitrate = str(config["bitrate"])
+        self.trim_silence = bool(config["trim_silence"])
+        self.silence_threshold_db = float(config["silence_threshold_db"])
+        self.min_silence_seconds = float(config["min_silence_seconds"])
+        self.keep_silence_seconds = float(config["keep_silence_seconds"])
+        self.split_above_seconds = float(config["split_above_seconds"])
+        self.chunk_seconds = max(1.0, float(config["chunk_seconds"]))
+        self.boundary_search_seconds = min(max(0.0, float(config["boundary_search_seconds"])), self.chunk_seconds / 2)
+        self.boundary_silence_seconds = max(0.01, float(config["boundary_silence_seconds"]))
+        self.reducer = config["reducer"]
+        self.field_reducers = dict(config.get("field_reducers") or {})
+        self.separator = config["separator"]
+        self.max_age_days = float(config["max_age_days"])
+        # 同じ録音の変換を同時に複数実行しないための実行中タスク
+        self._inflight: Dict[str, asyncio.Future] = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        removed = prune_cache_dir(cache_dir, self.max_age_days)
+        if removed:
+            logger.info(f"AudioPreprocessor: 古い変換済みファイルを{removed}件削除しました")
+
+    @classmethod
+    def from_config(cls, cache_dir: str) -> Optional['AudioPreprocessor']:
+        """config.json の audio_preprocess 設定から生成する（無効・ffmpeg未検出時はNone）"""
+        cfg = load_audio_preprocess_config()
+        if not cfg.get('enabled'):
+            logger.info("Audio preprocessing is disabled by config.")
+            return None
+        ffmpeg = find_ffmpeg(cfg.get('ffmpeg_path'))
+        if not ffmpeg:
+            logger.warning("ffmpeg が見つからないため音声の前処理を行いません")
+            return None
+        logger.info(f"Audio preprocessing enabled: ffmpeg={ffmpeg}")
+        return cls(ffmpeg, cache_dir, cfg)
+
+    def merge(self, outputs: List[Dict[str, Any]], keys: List[str]) -> Dict[str, str]:
+        """チャンクごとの出力を設定された統合方法でまとめる"""
+        return merge_segment_outputs(outputs, keys, self.reducer, self.field_reducers, self.separator)
+
+    def _variant(self) -> str:
+        """変換設定をキャッシュのファイル名に含めるための識別子"""
+        variant = f"mono{self.sample_rate}_{self.bitrate}"
+        if self.trim_silence:
+            variant += f"_s{self.silence_threshold_db:g}_{self.min_silence_seconds:g}_{self.keep_silence_seconds:g}"
+        chunk = (f"c{self.chunk_seconds:g}_b{self.boundary_search_seconds:g}_{self.boundary_silence_seconds:g}"
+                 f"_above{self.split_above_seconds:g}")
+        return f"{variant}_{chunk}"
+
+    async def split(self, file_path: str) -> List[str]:
+        """
+        前処理済みの音声チャンクのパスを時間順に返す（分割しない場合は変換後のファイル1件）
+        変換に失敗した場合は元のパスだけを返す
+        Raises:
+            FileNotFoundError: ファイルが存在しない場合
+        """
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"ファイルが見つかりません: {file_path}")
+        content_hash = await asyncio.to_thread(file_content_hash, file_path)
+        if not content_hash:
+            return [file_path]
+        key = f"{content_hash}_{self._variant()}"
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._prepare_to_cache(file_path, key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        try:
+            # 待機側がキャンセルされても、同じ録音を待つ他の呼び出しのために変換は続ける
+            return list(await asyncio.shield(task))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"AudioPreprocessor: 前処理に失敗したため元の音声を使用します {file_path}: {e}")
+            return [file_path]
+
+    async def _prepare_to_cache(self, file_path: str, key: str) -> List[str]:
+        """変換・無音除去・チャンク分割を行う（作成済みならそれを返す）"""
+        out_dir = os.path.join(self.cache_dir, key)
+        if os.path.isdir(out_dir):
+            chunks = self._list_chunks(out_dir)
+            if chunks:
+                logger.debug(f"AudioPreprocessor: キャッシュ済みの変換ファイルを使用 {os.path.basename(file_path)}")
+                return chunks
+
+        tmp_dir = f"{out_dir}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        start_time = time.time()
+        try:
+            converted = os.path.join(tmp_dir, "converted.mp3")
+            await run_ffmpeg(self.ffmpeg, ["-loglevel", "error", "-y", "-i", file_path, "-vn",
+                                           *self._filter_args(),
+                                           "-ac", "1", "-ar", str(self.sample_rate),
+                                           "-c:a", "libmp3lame", "-b:a", self.bitrate, converted])
+            duration = await probe_duration(self.ffmpeg, converted)
+            if duration is not None and duration > self.split_above_seconds:
+                silences = []
+                if self.boundary_search_seconds > 0:
+                    silences = await detect_silences(self.ffmpeg, converted, self.silence_threshold_db,
+                                                     self.boundary_silence_seconds)
+                bounds = self._chunk_bounds(duration, silences)
+                await asyncio.gather(*(self._cut_chunk(converted, tmp_dir, n, start, end)
+                                       for n, (start, end) in enumerate(bounds)))
+                os.remove(converted)
+            else:
+                os.replace(converted, os.path.join(tmp_dir, "chunk_000.mp3"))
+            shutil.rmtree(out_dir, ignore_errors=True)
+            os.replace(tmp_dir, out_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        chunks = self._list_chunks(out_dir)
+        total_size = sum(os.path.getsize(chunk) for chunk in chunks)
+        logger.info(f"🎧 音声を前処理: {os.path.basename(file_path)} "
+                    f"{os.path.getsize(file_path) / 1024 / 1024:.1f}MB → {total_size / 1024 / 1024:.1f}MB "
+                    f"{len(chunks)}チャンク ({time.time() - start_time:.1f}秒)")
+        return chunks
+
+    def _filter_args(self) -> List[str]:
+        """無音除去フィルターの引数（無効時は空）"""
+        if not self.trim_silence:
+            return []
+        return ["-af", (
+            "silenceremove=stop_periods=-1"
+            f":stop_duration={self.min_silence_seconds:g}"
+            f":stop_threshold={self.silence_threshold_db:g}dB"
+            f":stop_silence={self.keep_silence_seconds:g}"
+        )]
+
+    def _chunk_bounds(self, duration: float,
+                      silences: List[Tuple[float, float]]) -> List[Tuple[float, Optional[float]]]:
+        """
+        チャンクの (開始秒, 終了秒) のリスト（最後のチャンクの終了はNone = 末尾まで）
+        チャンクは重ならず、区切りは chunk_seconds ごとの位置に最も近い無音の中央
+        （前後 boundary_search_seconds 以内に無音がなければその位置）とする
+        """
+        bounds: List[Tuple[float, Optional[float]]] = []
+        start = 0.0
+        while start + self.chunk_seconds < duration:
+            target = start + self.chunk_seconds
+            cut = target
+            candidates = [(begin + end) / 2 for begin, end in silences
+                          if abs((begin + end) / 2 - target) <= self.boundary_search_seconds]
+            if candidates:
+                cut = min(candidates, key=lambda mid: abs(mid - target))
+            bounds.append((start, cut))
+            start = cut
+        bounds.append((start, None))
+        return bounds
+
+    async def _cut_chunk(self, source: str, out_dir: str, index: int, start: float, end: Optional[float]) -> None:
+        """変換済みの音声から1チャンクを切り出す（再エンコードしない）"""
+        length = ["-t", f"{end - start:.3f}"] if end is not None else []
+        await run_ffmpeg(self.ffmpeg, ["-loglevel", "error", "-y",
+                                       "-ss", f"{start:.3f}", *length,
+                                       "-i", source, "-c", "copy",
+                                       os.path.join(out_dir, f"chunk_{index:03d}.mp3")])
+
+    @staticmethod
+    def _list_chunks(directory: str) -> List[str]:
+        return sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.startswith("chunk_") and name.endswith(".mp3")
+        )
+
+
+def load_audio_preprocess_config() -> Dict[str, Any]:
+    """audio_preprocess 設定をデフォルト値とマージして返す"""
+    return {**DEFAULT_AUDIO_PREPROCESS_CONFIG, **config_manager.get_config().get('audio_preprocess', {})}
+
+
+def audio_preprocessing_available() -> bool:
+    """音声の前処理が使える（有効設定かつ ffmpeg がある）かどうか"""
+    cfg = load_audio_preprocess_config()
+    return bool(cfg.get('enabled')) and find_ffmpeg(cfg.get('ffmpeg_path')) is not None
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+apply_rule のルールプレフィックス（ルールのプロンプト・項目説明・JSON例）のコンテキストキャッシュ
+行ごとのリクエストで毎回同じ長いプレフィックスを送らないよう、サーバー側の cached content を作成して再利用する
+ハンドルは TTL で管理し、ルールの更新・削除時に破棄する
+キャッシュAPIはバックエンドとして差し替えられる（LocalContextCacheBackend はサーバーを使わない代替実装）
+"""
+
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from google.genai import types
+from utils.config import config_manager
+
+logger = logging.getLogger(__name__)
+
+# コンテキストキャッシュ設定のデフォルト値（config.json の context_cache で上書き可能）
+DEFAULT_CONTEXT_CACHE_CONFIG = {
+    "enabled": True,
+    "backend": "gemini",          # gemini: サーバー側にキャッシュを作成 / local: プレフィックスをそのまま送る代替実装
+    "ttl_seconds": 3600,          # 作成したキャッシュの有効期間（秒）
+    "refresh_margin_seconds": 60, # 期限までの残りがこれ未満のハンドルは使わず作り直す
+    "min_tokens": 4096,           # プレフィックスの推定トークン数がこれ未満ならキャッシュしない
+    "model_min_tokens": {},       # モデル別の最小トークン数（{"gemini-2.5-flash": 1024} など）
+    "retry_after_seconds": 300,   # 作成に失敗したプレフィックスを再び試すまでの時間（秒）
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算（ASCIIは約4文字/トークン、それ以外は1文字/トークン）"""
+    ascii_count = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_count + 3) // 4 + (len(text) - ascii_count)
+
+
+class CachePrefix:
+    """リクエスト先頭のキャッシュ対象テキストと、その所有者（ルールID）"""
+
+    def __init__(self, owner: Any, text: str):
+        self.owner = owner
+        self.text = text
+
+
+class ContextHandle:
+    """作成済みのキャッシュ1件"""
+
+    def __init__(self, key: str, owner: Any, name: str, expires_at: float, inline: bool = False):
+        self.key = key
+        self.owner = owner
+        self.name = name              # generate_content の cached_content に渡す名前
+        self.expires_at = expires_at
+        self.inline = inline          # True ならサーバー側にキャッシュがなく、プレフィックスをそのまま送る
+
+
+class GeminiContextCacheBackend:
+    """Gemini の caches API でプレフィックスをシステム指示としてキャッシュする"""
+
+    inline = False
+
+    def __init__(self, gemini: Any):
+        self.gemini = gemini
+
+    async def create(self, model: str, text: str, ttl_seconds: int, display_name: str) -> str:
+        cached = await self.gemini._call_async(
+            lambda: self.gemini.client.aio.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=text,
+                    ttl=f"{int(ttl_seconds)}s",
+                    display_name=display_name
+                )
+            ),
+            model=model,
+            description=f"caches.create({model})"
+        )
+        return cached.name
+
+    async def delete(self, name: str) -> None:
+        await self.gemini._call_async(
+            lambda: self.gemini.client.aio.caches.delete(name=name),
+            description="caches.delete"
+        )
+
+
+class LocalContextCacheBackend:
+    """サーバー側のキャッシュを作らずにハンドルだけを管理する代替実装
+    作成・削除はメモリ上で記録し、リクエストにはプレフィックスをそのまま含める
+    """
+
+    inline = True
+
+    def __init__(self):
+        self.entries: Dict[str, str] = {}
+        self.created = 0
+        self.deleted = 0
+
+    async def create(self, model: str, text: str, ttl_seconds: int, display_name: str) -> str:
+        self.created += 1
+        name = f"cachedContents/local-{self.created}"
+        self.entries[name] = text
+        return name
+
+    async def delete(self, name: str) -> None:
+        if self.entries.pop(name, None) is not None:
+            self.deleted += 1
+
+
+class ContextCacheManager:
+    """プレフィックス（所有者・モデル・内容）単位でキャッシュのハンドルを作成・再利用・破棄する"""
+
+    def __init__(self, backend: Any, config: Dict[str, Any]):
+        """
+        Args:
+            backend: create / delete を持つキャッシュAPIの実装
+            config: context_cache 設定（デフォルト値とマージ済み）
+        """
+        self.backend = backend
+        self.ttl_seconds = max(60, int(config["ttl_seconds"]))
+        self.refresh_margin_seconds = max(0.0, float(config["refresh_margin_seconds"]))
+        self.min_tokens = int(config["min_tokens"])
+        self.model_min_tokens = dict(config.get("model_min_tokens") or {})
+        self.retry_after_seconds = float(config["retry_after_seconds"])
+        # ルールの更新はUIスレッドから呼ばれるため、ハンドルの表はロックで保護する
+        self._lock = threading.Lock()
+        self._handles: Dict[str, ContextHandle] = {}
+        self._failed: Dict[str, float] = {}
+        self._pending_deletes: List[str] = []
+        self._creating: Dict[str, asyncio.Future] = {}
+        # 所有者ごとの世代（作成中に破棄されたハンドルを登録しないため）
+        self._generations: Dict[Any, int] = {}
+        self.stats = {"created": 0, "hits": 0, "skipped": 0, "failed": 0}
+
+    @classmethod
+    def from_config(cls, gemini: Any) -> Optional['ContextCacheManager']:
+        """config.json の context_cache 設定から生成する（無効時はNone）"""
+        cfg = load_context_cache_config()
+        if not cfg.get('enabled'):
+            logger.info("Context cache is disabled by config.")
+            return None
+        backend = LocalContextCacheBackend() if cfg.get('backend') == "local" else GeminiContextCacheBackend(gemini)
+        return cls(backend, cfg)
+
+    def threshold(self, model: str) -> int:
+        """キャッシュを作る最小の推定トークン数"""
+        return int(self.model_min_tokens.get(model, self.min_tokens))
+
+    @staticmethod
+    def make_key(owner: Any, model: str, text: str) -> str:
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return f"{owner}:{model}:{digest}"
+
+    async def acquire(self, model: str, prefix: CachePrefix) -> Optional[ContextHandle]:
+        """プレフィックスのハンドルを返す（しきい値未満・作成失敗時はNone）
+        期限切れ間近のハンドルは作り直し、同じプレフィックスの同時作成は1回にまとめる
+        """
+        await self._flush_deletes()
+        if estimate_tokens(prefix.text) < self.threshold(model):
+            self.stats["skipped"] += 1
+            return None
+        key = self.make_key(prefix.owner, model, prefix.text)
+        now = time.time()
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is not None and handle.expires_at - now > self.refresh_margin_seconds:
+                self.stats["hits"] += 1
+                return handle
+            failed_at = self._failed.get(key)
+            if failed_at is not None and now - failed_at < self.retry_after_seconds:
+                return None
+        task = self._creating.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._create(key, model, prefix))
+            self._creating[key] = task
+            task.add_done_callback(lambda _t: self._creating.pop(key, None))
+        # 待機側がキャンセルされても、同じプレフィックスを待つ他の行のために作成は続ける
+        return await asyncio.shield(task)
+
+    async def _create(self, key: str, model: str, prefix: CachePrefix) -> Optional[ContextHandle]:
+        start_time = time.time()
+        generation = self._generations.get(prefix.owner, 0)
+        try:
+            name = await self.backend.create(model, prefix.text, self.ttl_seconds, f"rule-{prefix.owner}")
+        except Exception as e:
+            self.stats["failed"] += 1
+            with self._lock:
+                self._failed[key] = time.time()
+            logger.warning(f"⚠️ コンテキストキャッシュを作成できなかったため、プレフィックスをそのまま送ります (rule={prefix.owner}): {e}")
+            return None
+        handle = ContextHandle(key, prefix.owner, name, start_time + self.ttl_seconds,
+                               inline=bool(getattr(self.backend, 'inline', False)))
+        with self._lock:
+            if self._generations.get(prefix.owner, 0) != generation:
+                # 作成中にルールが更新された場合は今回のリクエストだけで使い、次の行からは使わない
+                self._pending_deletes.append(name)
+                return handle
+            old = self._handles.get(key)
+            if old is not None:
+                self._pending_deletes.append(old.name)
+            self._handles[key] = handle
+            self._failed.pop(key, None)
+        self.stats["created"] += 1
+        logger.info(f"🗄️ コンテキストキャッシュを作成: rule={prefix.owner} model={model} "
+                    f"約{estimate_tokens(prefix.text)}トークン ttl={self.ttl_seconds}秒")
+        return handle
+
+    def discard(self, handle: ContextHandle) -> None:
+        """サーバー側で失効していたハンドルを破棄する（次の行で作り直す）"""
+        with self._lock:
+            if self._handles.get(handle.key) is handle:
+                del self._handles[handle.key]
+                self._pending_deletes.append(handle.name)
+
+    def invalidate(self, owner: Any) -> None:
+        """所有者（ルール）のハンドルをすべて破棄する。サーバー側の削除は次の acquire で行う"""
+        with self._lock:
+            self._generations[owner] = self._generations.get(owner, 0) + 1
+            keys = [key for key, handle in self._handles.items() if handle.owner == owner]
+            for key in keys:
+                self._pending_deletes.append(self._handles.pop(key).name)
+            for key in [key for key in self._failed if key.startswith(f"{owner}:")]:
+                del self._failed[key]
+        if keys:
+            logger.debug(f"Invalidated {len(keys)} context cache handle(s) for rule id={owner}")
+
+    async def _flush_deletes(self) -> None:
+        """破棄したハンドルのサーバー側キャッシュを削除する（失敗しても TTL で消える）"""
+        with self._lock:
+            names, self._pending_deletes = self._pending_deletes, []
+        for name in names:
+            try:
+                await self.backend.delete(name)
+            except Exception as e:
+                logger.debug(f"Failed to delete context cache {name}: {e}")
+
+
+def load_context_cache_config() -> Dict[str, Any]:
+    """context_cache 設定をデフォルト値とマージして返す"""
+    return {**DEFAULT_CONTEXT_CACHE_CONFIG, **config_manager.get_config().get('context_cache', {})}
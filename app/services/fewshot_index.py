@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+ルールのサンプル行から、入力に似た例を選ぶための類似度インデックス
+サンプル入力の文字 n-gram TF-IDF（L2正規化）を転置インデックスとして持ち、コサイン類似度の上位 k 件を返す
+選んだサンプルを few-shot 例としてプロンプトに入れることで、サンプルが多くても1行あたりのプロンプトは一定に保てる
+NumPy がある場合はスコア計算に使い、未インストールの場合は純Pythonで計算する（結果は同じ）
+"""
+
+import logging
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, List, Sequence, Tuple
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+from utils.config import config_manager
+
+logger = logging.getLogger(__name__)
+
+# few-shot 例の設定のデフォルト値（config.json の fewshot で上書き可能）
+DEFAULT_FEWSHOT_CONFIG = {
+    "enabled": True,
+    "k": 3,                     # 1行あたりに入れる例の数
+    "batch_max_examples": 8,    # バッチ処理で1リクエストに入れる例の上限
+    "min_similarity": 0.1,      # これ未満の類似度のサンプルは例にしない
+    "ngram_min": 1,             # 文字 n-gram の最小長
+    "ngram_max": 3,             # 文字 n-gram の最大長
+    "max_example_chars": 300,   # 例に含める入力・出力値の最大文字数（超える分は省略）
+}
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize(text: str) -> str:
+    """全角・半角と大文字・小文字の違い、連続する空白を揃える"""
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def char_ngrams(text: str, ngram_min: int, ngram_max: int) -> Counter:
+    """文字 n-gram の出現回数（前後に空白を補って語頭・語末も区別する）"""
+    text = f" {_normalize(text)} "
+    grams: Counter = Counter()
+    for n in range(ngram_min, ngram_max + 1):
+        for i in range(len(text) - n + 1):
+            gram = text[i:i + n]
+            if gram.strip():
+                grams[gram] += 1
+    return grams
+
+
+class FewShotIndex:
+    """サンプル入力の文字 n-gram TF-IDF による近傍検索"""
+
+    def __init__(self, texts: Sequence[str], ngram_min: int = 1, ngram_max: int = 3):
+        """
+        Args:
+            texts: サンプル入力のリスト（返す番号はこのリストの位置）
+            ngram_min: 文字 n-gram の最小長
+            ngram_max: 文字 n-gram の最大長
+        """
+        self.size = len(texts)
+        self.ngram_min = max(1, int(ngram_min))
+        self.ngram_max = max(self.ngram_min, int(ngram_max))
+        doc_grams = [char_ngrams(text, self.ngram_min, self.ngram_max) for text in texts]
+        doc_freq: Counter = Counter()
+        for grams in doc_grams:
+            doc_freq.update(grams.keys())
+        # 平滑化した IDF（全サンプルに出る n-gram も重み0にはしない）
+        self.idf: Dict[str, float] = {
+            gram: math.log((1 + self.size) / (1 + df)) + 1.0 for gram, df in doc_freq.items()
+        }
+        # どのサンプルにもない n-gram の IDF（クエリの正規化にだけ使う）
+        self.unseen_idf = math.log(1 + self.size) + 1.0
+        # n-gram → [(サンプル番号, 正規化済みの重み)] の転置インデックス
+        postings: Dict[str, List[Tuple[int, float]]] = {}
+        for doc, grams in enumerate(doc_grams):
+            for gram, weight in self._weights(grams).items():
+                postings.setdefault(gram, []).append((doc, weight))
+        if NUMPY_AVAILABLE:
+            self._postings = {
+                gram: (np.fromiter((d for d, _ in items), dtype=np.int32, count=len(items)),
+                       np.fromiter((w for _, w in items), dtype=np.float32, count=len(items)))
+                for gram, items in postings.items()
+            }
+        else:
+            self._postings = postings
+
+    def _weights(self, grams: Counter) -> Dict[str, float]:
+        """出現回数から L2 正規化した TF-IDF 重みを求め、語彙にある n-gram の分を返す
+        語彙にない n-gram も正規化には含める（除いてから正規化すると類似度が高く出すぎる）
+        """
+        weights = {
+            gram: (1.0 + math.log(count)) * self.idf.get(gram, self.unseen_idf)
+            for gram, count in grams.items()
+        }
+        norm = math.sqrt(sum(w * w for w in weights.values()))
+        if norm == 0:
+            return {}
+        return {gram: w / norm for gram, w in weights.items() if gram in self.idf}
+
+    def query(self, text: str, k: int, min_similarity: float = 0.0) -> List[Tuple[int, float]]:
+        """text に似たサンプルの (番号, コサイン類似度) を類似度の高い順に最大 k 件返す"""
+        if k <= 0 or self.size == 0:
+            return []
+        weights = self._weights(char_ngrams(text, self.ngram_min, self.ngram_max))
+        if not weights:
+            return []
+        if NUMPY_AVAILABLE:
+            docs = [self._postings[gram][0] for gram in weights]
+            values = [self._postings[gram][1] * weight for gram, weight in weights.items()]
+            scores = np.bincount(np.concatenate(docs), weights=np.concatenate(values), minlength=self.size)
+            top = np.argsort(-scores, kind="stable")[:k]
+            return [(int(i), float(scores[i])) for i in top if scores[i] >= min_similarity and scores[i] > 0]
+        totals: Dict[int, float] = {}
+        for gram, weight in weights.items():
+            for doc, doc_weight in self._postings[gram]:
+                totals[doc] = totals.get(doc, 0.0) + doc_weight * weight
+        ranked = sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [(doc, score) for doc, score in ranked if score >= min_similarity]
+
+
+def load_fewshot_config() -> Dict[str, Any]:
+    """fewshot 設定をデフォルト値とマージして返す"""
+    return {**DEFAULT_FEWSHOT_CONFIG, **config_manager.get_config().get('fewshot', {})}
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+ローカルの ffmpeg を使うメディア前処理の共通部品
+実行ファイルの検出・非同期実行・再生時間と無音区間の取得を提供する（ffmpeg がない環境では使わない）
+"""
+
+import asyncio
+import logging
+import os
+import re
+import shutil
+import subprocess
+import time
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_DURATION_PATTERN = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+_SILENCE_PATTERN = re.compile(r"silence_(start|end):\s*(-?\d+(?:\.\d+)?)")
+
+
+class FFmpegError(Exception):
+    """ffmpeg の実行に失敗した場合のエラー"""
+    pass
+
+
+def find_ffmpeg(configured_path: Optional[str] = None) -> Optional[str]:
+    """
+    ffmpeg 実行ファイルのパスを返す（見つからない場合はNone）
+    設定でパスが指定されていればそれを優先し、なければ PATH から探す
+    """
+    if configured_path:
+        if os.path.isfile(configured_path):
+            return configured_path
+        found = shutil.which(configured_path)
+        if found:
+            return found
+        logger.warning(f"設定された ffmpeg が見つかりません: {configured_path}")
+    return shutil.which("ffmpeg")
+
+
+async def run_ffmpeg(ffmpeg: str, args: List[str], check: bool = True) -> Tuple[int, str]:
+    """
+    ffmpeg を非同期に実行し (終了コード, 標準エラー出力) を返す
+    呼び出し側がキャンセルされた場合はプロセスを終了させる
+    """
+    # Windows のGUI実行時にコンソールウィンドウを出さない
+    creationflags = getattr(subprocess, 'CREATE_NO_WINDOW', 0) if os.name == 'nt' else 0
+    process = await asyncio.create_subprocess_exec(
+        ffmpeg, "-hide_banner", "-nostdin", *args,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+        creationflags=creationflags
+    )
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    message = stderr.decode('utf-8', errors='replace')
+    if check and process.returncode != 0:
+        raise FFmpegError(f"ffmpeg の実行に失敗しました (code={process.returncode}): {message.strip()[-500:]}")
+    return process.returncode, message
+
+
+async def probe_duration(ffmpeg: str, file_path: str) -> Optional[float]:
+    """メディアの再生時間（秒）を返す（取得できない場合はNone）"""
+    # 出力先を指定しない実行は終了コード1になるが、入力情報は標準エラーに出力される
+    _, message = await run_ffmpeg(ffmpeg, ["-i", file_path], check=False)
+    match = _DURATION_PATTERN.search(message)
+    if not match:
+        logger.warning(f"再生時間を取得できませんでした: {file_path}")
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+async def detect_silences(ffmpeg: str, file_path: str, threshold_db: float,
+                          min_seconds: float) -> List[Tuple[float, float]]:
+    """無音区間の (開始秒, 終了秒) のリストを時間順に返す（末尾まで続く無音は終了を再生時間とする）"""
+    _, message = await run_ffmpeg(ffmpeg, ["-i", file_path, "-vn",
+                                           "-af", f"silencedetect=noise={threshold_db:g}dB:d={min_seconds:g}",
+                                           "-f", "null", "-"])
+    silences: List[Tuple[float, float]] = []
+    start: Optional[float] = None
+    for kind, value in _SILENCE_PATTERN.findall(message):
+        if kind == "start":
+            start = max(0.0, float(value))
+        elif start is not None:
+            silences.append((start, float(value)))
+            start = None
+    if start is not None:
+        match = _DURATION_PATTERN.search(message)
+        if match:
+            hours, minutes, seconds = match.groups()
+            silences.append((start, int(hours) * 3600 + int(minutes) * 60 + float(seconds)))
+    return silences
+
+
+def prune_cache_dir(cache_dir: str, max_age_days: float) -> int:
+    """保持日数を過ぎた前処理済みファイル・ディレクトリを削除し、削除した件数を返す"""
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+アップロード済みファイルの処理状態（PROCESSING → ACTIVE）を監視する非同期ウォッチャー
+待機中の全ファイルを1つのループでまとめてポーリングし、間隔は短く始めて指数的に伸ばす
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# ポーリング設定のデフォルト値（config.json の file_polling で上書き可能）
+DEFAULT_FILE_POLLING_CONFIG = {
+    "initial_delay": 0.25,  # 最初の状態確認までの待機（秒）
+    "max_delay": 5.0,       # 確認間隔の上限（秒）
+    "backoff": 2.0,         # 確認ごとに間隔を何倍にするか
+    "timeout": 300.0,       # 1ファイルあたりの待機上限（秒）
+    "max_errors": 5,        # 状態取得の連続失敗をこの回数まで許容する
+}
+
+
+class _Watch:
+    """1ファイル分の監視状態"""
+
+    def __init__(self, next_at: float, delay: float, deadline: float):
+        self.next_at = next_at
+        self.delay = delay
+        self.deadline = deadline
+        self.errors = 0
+        self.futures: List[asyncio.Future] = []
+
+
+class FileStateWatcher:
+    """複数ファイルの処理完了待ちを1つのポーリングループで扱う"""
+
+    def __init__(self, get_file: Callable[[str], Awaitable[Any]],
+                 initial_delay: float = DEFAULT_FILE_POLLING_CONFIG["initial_delay"],
+                 max_delay: float = DEFAULT_FILE_POLLING_CONFIG["max_delay"],
+                 backoff: float = DEFAULT_FILE_POLLING_CONFIG["backoff"],
+                 timeout: float = DEFAULT_FILE_POLLING_CONFIG["timeout"],
+                 max_errors: int = DEFAULT_FILE_POLLING_CONFIG["max_errors"]):
+        """
+        Args:
+            get_file: ファイル名からファイル情報（state属性を持つ）を取得するコルーチン関数
+            initial_delay: 最初の状態確認までの待機（秒）
+            max_delay: 確認間隔の上限（秒）
+            backoff: 確認ごとの間隔の倍率
+            timeout: 1ファイルあたりの待機上限（秒）
+            max_errors: 状態取得の連続失敗の許容回数
+        """
+        self._get_file = get_file
+        self.initial_delay = max(0.0, float(initial_delay))
+        self.max_delay = max(self.initial_delay, float(max_delay))
+        self.backoff = max(1.0, float(backoff))
+        self.timeout = float(timeout)
+        self.max_errors = max(1, int(max_errors))
+        self._pending: Dict[str, _Watch] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    async def wait(self, name: str) -> bool:
+        """
+        ファイルが ACTIVE になるまで待つ。失敗・タイムアウト時はFalseを返す
+        呼び出し側がキャンセルされた場合は、そのファイルの監視も（他に待機者がいなければ）止める
+        """
+        loop = asyncio.get_running_loop()
+        watch = self._pending.get(name)
+        if watch is None:
+            now = loop.time()
+            watch = _Watch(now + self.initial_delay, self.initial_delay, now + self.timeout)
+            self._pending[name] = watch
+        future = loop.create_future()
+        watch.futures.append(future)
+        self._ensure_running(loop)
+        try:
+            return await future
+        finally:
+            if not future.done() or future.cancelled():
+                if future in watch.futures:
+                    watch.futures.remove(future)
+                if not watch.futures and self._pending.get(name) is watch:
+                    del self._pending[name]
+                    logger.debug(f"FileStateWatcher: {name} の監視を取り消しました")
+
+    def _ensure_running(self, loop: asyncio.AbstractEventLoop) -> None:
+        """監視ループが止まっていれば起動し、動いていれば再計算させる"""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        else:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        """待機中のファイルがなくなるまで、期限の来たものをまとめて確認する"""
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            now = loop.time()
+            due = [name for name, watch in self._pending.items() if watch.next_at <= now]
+            if due:
+                results = await asyncio.gather(*(self._get_file(name) for name in due), return_exceptions=True)
+                for name, result in zip(due, results):
+                    self._update(name, result, loop.time())
+            if not self._pending:
+                break
+            sleep_for = max(0.0, min(w.next_at for w in self._pending.values()) - loop.time())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=sleep_for)
+            except asyncio.TimeoutError:
+                pass
+
+    def _update(self, name: str, result: Any, now: float) -> None:
+        """状態確認の結果を反映し、決着したファイルの待機者に結果を返す"""
+        watch = self._pending.get(name)
+        if watch is None:
+            return
+        if isinstance(result, BaseException):
+            watch.errors += 1
+            logger.warning(f"Failed to get file status for {name} ({watch.errors}/{self.max_errors}): {result}")
+            if watch.errors >= self.max_errors:
+                # アップロード済みなら使える可能性があるため処理を続行する
+                logger.info("Attempting to proceed with uploaded file despite status check failure")
+                self._resolve(name, True)
+                return
+        else:
+            watch.errors = 0
+            state_str = str(getattr(result, 'state', '')).upper()
+            logger.debug(f"File {name} state: {state_str} (next delay {watch.delay:.2f}s)")
+            if "ACTIVE" in state_str:
+                logger.info(f"File processing completed: {name}")
+                self._resolve(name, True)
+                return
+            if "FAILED" in state_str or "ERROR" in state_str:
+                logger.error(f"File processing failed with state: {state_str}")
+                self._resolve(name, False)
+                return
+        if now >= watch.deadline:
+            logger.error(f"File processing timed out after {self.timeout:.0f}s: {name}")
+            self._resolve(name, False)
+            return
+        watch.delay = min(self.max_delay, max(watch.delay, 0.05) * self.backoff)
+        watch.next_at = now + watch.delay
+
+    def _resolve(self, name: str, value: bool) -> None:
+        watch = self._pending.pop(name, None)
+        if watch is None:
+            return
+        for future in watch.futures:
+            if not future.done():
+                future.set_result(value)
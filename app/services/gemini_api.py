@@ -1,7 +1,8 @@
 import os
 import logging
+import mimetypes
 from pathlib import Path
-from typing import Dict, Any, Optional, List, Union, Iterator
+from typing import Dict, Any, Optional, List, Tuple, Union, Iterator, Callable, Awaitable
 import json
 import time
 import httplib2
@@ -10,6 +11,12 @@ import asyncio
 from google import genai
 from google.genai import types
 from utils.config import config_manager
+from utils.file_hash import file_content_hash
+from .rate_limiter import get_rate_limiter, is_rate_limit_error
+from .retry_policy import RetryPolicy, RetryBudget, current_budget, is_retryable_error
+from .file_state_watcher import FileStateWatcher, DEFAULT_FILE_POLLING_CONFIG
+from .video_segmenter import segment_prompt
+from .context_cache import CachePrefix
 
 logger = logging.getLogger(__name__)
 
@@ -18,11 +25,15 @@ DEFAULT_TRANSCRIPTION_MODEL = config_manager.get_model("gemini_transcription") o
 DEFAULT_MINUTES_MODEL = config_manager.get_model("gemini_minutes") or "gemini-2.0-flash-001"
 DEFAULT_TITLE_MODEL = config_manager.get_model("gemini_title") or "gemini-2.0-flash-001"
 
-MAX_RETRIES = 3
-RETRY_DELAY = 5  # 秒
+# リトライ回数・待機時間は retry_policy.DEFAULT_RETRY_CONFIG / config.json の retry で設定
 MAX_FILE_SIZE_MB = 100  # デフォルトの最大ファイルサイズ（MB）
-MAX_FILE_WAIT_RETRIES = 30  # ファイル処理待機の最大リトライ回数
-FILE_WAIT_RETRY_DELAY = 5  # ファイル処理待機の間隔（秒）
+# アップロード済みファイル再利用の設定（Files API の保持期間48時間より少し短くする）
+DEFAULT_UPLOAD_CACHE_CONFIG = {
+    "enabled": True,
+    "ttl_hours": 47,
+    "max_entries": 10000,
+}
+INLINE_MEDIA_MAX_MB = 4  # この大きさ以下のファイルはアップロードせずリクエストに直接埋め込む（MB、0で無効）
 
 class MediaType:
     """サポートされるメディアタイプの定数"""
@@ -41,6 +52,29 @@ class VideoFileTooLargeError(GeminiAPIError):
     """動画ファイルサイズが大きすぎる場合のエラー"""
     pass
 
+def is_missing_file_error(error: Exception) -> bool:
+    """アップロード済みファイルが存在しない（期限切れ・削除済み）ことを示すエラーかどうかを判定"""
+    code = getattr(error, 'code', None)
+    status = str(getattr(error, 'status', '') or '').upper()
+    if code in (403, 404) or status in ("NOT_FOUND", "PERMISSION_DENIED"):
+        return True
+    text = str(error).upper()
+    return "NOT_FOUND" in text or "PERMISSION_DENIED" in text or "NOT EXIST" in text
+
+def is_missing_context_cache_error(error: Exception) -> bool:
+    """コンテキストキャッシュ（cached_content）が存在しない（期限切れ・削除済み）ことを示すエラーかどうかを判定"""
+    if not is_missing_file_error(error):
+        return False
+    text = f"{error} {getattr(error, 'message', '') or ''}".upper()
+    return "CACHE" in text
+
+def is_schema_rejected_error(error: Exception) -> bool:
+    """response_schema（構造化出力）がモデルに受け付けられなかったことを示すエラーかどうかを判定"""
+    if getattr(error, 'code', None) != 400:
+        return False
+    text = f"{error} {getattr(error, 'message', '') or ''}".upper()
+    return "SCHEMA" in text or "MIME" in text
+
 class GeminiAPI:
     """Gemini APIクライアント"""
     
@@ -85,6 +119,7 @@ class GeminiAPI:
         
         # 最大ファイルサイズの設定
         self.max_file_size_mb = max_file_size_mb or config.get('max_file_size_mb', MAX_FILE_SIZE_MB)
+        self.inline_media_max_mb = float(config.get('inline_media_max_mb', INLINE_MEDIA_MAX_MB))
         
         # クライアントの初期化 - Gemini API 新しいスタイル
         # APIバージョンをv1alphaに設定
@@ -93,6 +128,26 @@ class GeminiAPI:
             http_options={'api_version': 'v1alpha'}
         )
         
+        # アップロード後の処理完了待ち（全ファイルを1つの非同期ループでポーリング）
+        polling_config = {**DEFAULT_FILE_POLLING_CONFIG, **config.get('file_polling', {})}
+        self.file_state_watcher = FileStateWatcher(
+            lambda name: self.client.aio.files.get(name=name),
+            **polling_config
+        )
+        
+        # アップロード済みファイルの再利用キャッシュ（RuleService が設定。Noneなら毎回アップロードして削除）
+        self.upload_cache = None
+        # 画像の縮小・再圧縮（RuleService が設定。Noneなら元画像をそのまま送る）
+        self.image_preprocessor = None
+        # 長い動画の区間分割（RuleService が設定。Noneなら動画を1ファイルのまま送る）
+        self.video_segmenter = None
+        # 音声の変換・無音除去・チャンク分割（RuleService が設定。Noneなら音声をそのまま送る）
+        self.audio_preprocessor = None
+        # ルールプレフィックスのコンテキストキャッシュ（RuleService が設定。Noneなら毎回プレフィックスを送る）
+        self.context_cache = None
+        # response_schema による構造化出力が使えるか（モデルに拒否された場合は以降スキーマなしで送る）
+        self.structured_output_supported = True
+        
         # 互換性のための設定
         self.generation_config = {
             "temperature": 0.1,
@@ -194,82 +249,45 @@ class GeminiAPI:
                 "ファイルを小さく分割するか、設定の'max_file_size_mb'を増やしてください。"
             )
 
-    def upload_file(self, file_path: str, mime_type: Optional[str] = None) -> Any:
-        """ファイルをGemini APIにアップロード
-        
+    async def upload_file_async(self, file_path: str) -> Any:
+        """ファイルをGemini APIにアップロードする（非同期版・SDKの非同期クライアントを使用）
+
         Args:
             file_path (str): アップロードするファイルのパス
-            mime_type (str, optional): ファイルのMIMEタイプ (非推奨、新APIでは自動検出)
-            
+
         Returns:
             Any: アップロードされたファイルオブジェクト
-            
-        Raises:
-            GeminiAPIError: アップロードに失敗した場合
         """
-        try:
-            # ファイルサイズのチェック
-            self._check_file_size(file_path)
-            
-            # ファイルをアップロード
-            logger.info(f"Uploading file: {file_path}")
-            uploaded_file = self.client.files.upload(file=file_path)
-            logger.info(f"File uploaded successfully: {uploaded_file.uri}")
-            
-            # ファイル処理の完了を待機（ACTIVE状態になるまで）
-            if not self.wait_for_processing(uploaded_file):
-                raise GeminiAPIError("ファイルの処理が完了しませんでした")
-            
-            return uploaded_file
-        except VideoFileTooLargeError:
-            raise
-        except Exception as e:
-            error_msg = f"ファイルのアップロードに失敗しました: {str(e)}"
-            logger.error(error_msg)
-            raise GeminiAPIError(error_msg)
+        return await self._call_async(
+            lambda: self.client.aio.files.upload(file=file_path),
+            description=f"files.upload({os.path.basename(file_path)})"
+        )
 
-    def wait_for_processing(self, file) -> bool:
-        """ファイルの処理完了を待機"""
-        # 画像ファイルの場合は待機時間を短縮
-        max_retries = 10  # 30回から10回に短縮
-        retry_delay = 2   # 5秒から2秒に短縮
-        
-        for attempt in range(max_retries):
-            try:
-                # ファイルの状態を取得
-                file_status = self.client.files.get(name=file.name)
-                state_value = file_status.state
-                
-                # 状態を詳細にログ出力
-                logger.debug(f"File processing attempt {attempt + 1}/{max_retries}: {state_value} (type: {type(state_value)})")
-                
-                # 様々な形式での状態確認
-                state_str = str(state_value).upper()
-                if "ACTIVE" in state_str:
-                    logger.info(f"File processing completed: {state_value}")
-                    return True
-                    
-                # 失敗状態もチェック
-                if "FAILED" in state_str or "ERROR" in state_str:
-                    logger.error(f"File processing failed with state: {state_value}")
-                    return False
-                
-                # 処理中状態のログ
-                if "PROCESSING" in state_str or "PENDING" in state_str:
-                    logger.debug(f"File still processing: {state_value}")
-                    
-                time.sleep(retry_delay)
-                
-            except Exception as e:
-                logger.warning(f"Failed to get file status (attempt {attempt + 1}): {e}")
-                if attempt == max_retries - 1:
-                    logger.error(f"Failed to get file status after {max_retries} attempts")
-                    # 最後の試行では処理を続行する（画像がアップロード済みなら使える可能性）
-                    logger.info("Attempting to proceed with uploaded file despite status check failure")
-                    return True
-                time.sleep(retry_delay)
-        
-        return False
+    async def get_file_async(self, name: str) -> Any:
+        """アップロード済みファイルの情報を取得する（非同期版）"""
+        return await self._call_async(
+            lambda: self.client.aio.files.get(name=name),
+            description=f"files.get({name})"
+        )
+
+    async def delete_file_async(self, name: str) -> None:
+        """アップロード済みファイルを削除する（非同期版）"""
+        await self._call_async(
+            lambda: self.client.aio.files.delete(name=name),
+            description=f"files.delete({name})"
+        )
+
+    async def wait_for_processing_async(self, file) -> bool:
+        """ファイルの処理完了を待機（非同期版）
+        アップロード直後に ACTIVE ならポーリングせずに返し、それ以外は共有ウォッチャーで待つ
+        """
+        state_str = str(getattr(file, 'state', '') or '').upper()
+        if "ACTIVE" in state_str:
+            return True
+        if "FAILED" in state_str:
+            logger.error(f"File processing failed with state: {file.state}")
+            return False
+        return await self.file_state_watcher.wait(file.name)
 
     def transcribe(
         self,
@@ -278,8 +296,6 @@ class GeminiAPI:
         stream: bool = False
     ) -> Union[str, Iterator[str]]:
         """音声/動画の書き起こしを行う"""
-        # ファイルアップロード
-        uploaded = self.upload_file(file_path)
         contents = []
         # ストリーミング or ノーマル
         if stream:
@@ -295,31 +311,170 @@ class GeminiAPI:
         """ノーマル書き起こし (未実装)"""
         raise NotImplementedError("Normal transcription is not implemented")
 
+    async def _call_async(self, make_call: Callable[[], Awaitable[Any]], model: Optional[str] = None,
+                          description: str = "API call") -> Any:
+        """API呼び出しを共通リトライポリシーで実行する（非同期版）
+
+        Args:
+            make_call (Callable): 呼び出しごとに新しい awaitable を返す関数
+            model (str, optional): 指定時はモデル別のレートリミッタを通す
+            description (str): ログ用の呼び出し名
+
+        Returns:
+            Any: 呼び出し結果
+        """
+        policy = RetryPolicy.from_config()
+        budget = current_budget()
+        limiter = get_rate_limiter(model) if model else None
+        attempt = 0
+        while True:
+            attempt += 1
+            if limiter:
+                await limiter.acquire()
+            if budget:
+                budget.record_attempt()
+            try:
+                result = await make_call()
+            except Exception as e:
+                throttled = is_rate_limit_error(e)
+                delay = policy.compute_delay(attempt, e)
+                if limiter:
+                    limiter.release(throttled=throttled, retry_after=delay if throttled else None)
+                if not self._should_retry(e, attempt, policy, budget, description):
+                    raise
+                logger.warning(f"{description} failed (attempt {attempt}/{policy.max_attempts}), retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # 中止（CancelledError）などで中断された場合も送信枠を返す
+                if limiter:
+                    limiter.cancel()
+                raise
+            if limiter:
+                limiter.release()
+            return result
+
+    def _call_sync(self, make_call: Callable[[], Any], model: Optional[str] = None,
+                   description: str = "API call") -> Any:
+        """API呼び出しを共通リトライポリシーで実行する（同期版）"""
+        policy = RetryPolicy.from_config()
+        budget = current_budget()
+        limiter = get_rate_limiter(model) if model else None
+        attempt = 0
+        while True:
+            attempt += 1
+            if limiter:
+                limiter.acquire_sync()
+            if budget:
+                budget.record_attempt()
+            try:
+                result = make_call()
+            except Exception as e:
+                throttled = is_rate_limit_error(e)
+                delay = policy.compute_delay(attempt, e)
+                if limiter:
+                    limiter.release(throttled=throttled, retry_after=delay if throttled else None)
+                if not self._should_retry(e, attempt, policy, budget, description):
+                    raise
+                logger.warning(f"{description} failed (attempt {attempt}/{policy.max_attempts}), retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                continue
+            except BaseException:
+                if limiter:
+                    limiter.cancel()
+                raise
+            if limiter:
+                limiter.release()
+            return result
+
+    def _should_retry(self, error: Exception, attempt: int, policy: RetryPolicy,
+                      budget: Optional[RetryBudget], description: str) -> bool:
+        """再試行するかどうかを判定（致命的エラー・試行回数上限・行の予算切れでは再試行しない）"""
+        if not is_retryable_error(error):
+            logger.debug(f"{description} failed with non-retryable error: {type(error).__name__}: {error}")
+            return False
+        if attempt >= policy.max_attempts:
+            logger.error(f"{description} failed after {attempt} attempts: {error}")
+            return False
+        if budget is not None and not budget.try_consume():
+            logger.error(f"{description}: retry budget exhausted ({budget.retries}/{budget.max_retries})")
+            return False
+        return True
+
+    async def generate_content_async(self, model: str, contents: Any, config: Any = None) -> Any:
+        """generate_content をSDKの非同期クライアントで実行する（イベントループをブロックしない）
+        モデルごとの共有レートリミッタと共通リトライポリシーを適用する
+
+        Args:
+            model (str): 使用するモデル名
+            contents (Any): 送信するコンテンツ
+            config (Any, optional): GenerateContentConfig
+
+        Returns:
+            Any: generate_content のレスポンス
+        """
+        return await self._call_async(
+            lambda: self.client.aio.models.generate_content(
+                model=model,
+                contents=contents,
+                config=config
+            ),
+            model=model,
+            description=f"generate_content({model})"
+        )
+
+    def generate_content(self, model: str, contents: Any, config: Any = None) -> Any:
+        """generate_content の同期版（レートリミッタ・リトライは非同期版と同じ）"""
+        return self._call_sync(
+            lambda: self.client.models.generate_content(
+                model=model,
+                contents=contents,
+                config=config
+            ),
+            model=model,
+            description=f"generate_content({model})"
+        )
+
     def generate_title(self, transcription_text: str) -> str:
         """タイトルを生成する"""
         # 新しいAPIを使用してタイトルを生成
         try:
-            response = self.client.models.generate_content(
+            response = self.generate_content(
                 model=self.title_model,
                 contents=transcription_text
             )
-            text = response.text
-            try:
-                data = json.loads(text)
-                return data.get("title", text)
-            except json.JSONDecodeError:
-                logger.warning("タイトル生成レスポンスのJSON解析に失敗、元テキストを返します")
-                return text
+            return self._parse_title(response.text)
         except Exception as e:
             logger.error(f"タイトル生成エラー: {e}")
             return ""
 
+    async def generate_title_async(self, transcription_text: str) -> str:
+        """タイトルを生成する（非同期版）"""
+        try:
+            response = await self.generate_content_async(
+                model=self.title_model,
+                contents=transcription_text
+            )
+            return self._parse_title(response.text)
+        except Exception as e:
+            logger.error(f"タイトル生成エラー: {e}")
+            return ""
+
+    def _parse_title(self, text: str) -> str:
+        """タイトル生成レスポンスからタイトルを取り出す"""
+        try:
+            data = json.loads(text)
+            return data.get("title", text)
+        except json.JSONDecodeError:
+            logger.warning("タイトル生成レスポンスのJSON解析に失敗、元テキストを返します")
+            return text
+
     def summarize_minutes(self, text: str, system_prompt: str = None) -> str:
         """議事録を要約する"""
         # 新しいAPIを使用して議事録要約を生成
         prompt_text = system_prompt or self.system_prompt
         try:
-            response = self.client.models.generate_content(
+            response = self.generate_content(
                 model=self.minutes_model,
                 contents=prompt_text
             )
@@ -328,12 +483,262 @@ class GeminiAPI:
             logger.error(f"議事録要約エラー: {e}")
             return ""
 
-    async def analyze_image(self, file_path: str, prompt: str) -> str:
+    async def summarize_minutes_async(self, text: str, system_prompt: str = None) -> str:
+        """議事録を要約する（非同期版）"""
+        prompt_text = system_prompt or self.system_prompt
+        try:
+            response = await self.generate_content_async(
+                model=self.minutes_model,
+                contents=prompt_text
+            )
+            return response.text
+        except Exception as e:
+            logger.error(f"議事録要約エラー: {e}")
+            return ""
+
+    def media_analysis_settings(self, media_type: str) -> Tuple[str, Dict[str, Any]]:
+        """メディアタイプに対応する (ログ・エラー用の種別名, 生成パラメータ) を返す"""
+        if media_type == MediaType.IMAGE:
+            return "画像", self.image_analysis_config
+        if media_type == MediaType.VIDEO:
+            return "動画", self.video_analysis_config
+        if media_type == MediaType.AUDIO:
+            return "音声", self.audio_analysis_config
+        raise ValueError(f"サポートされていないメディアタイプです: {media_type}")
+
+    async def prepare_media_file(self, file_path: str, media_type: str) -> str:
+        """送信前の前処理を行い、実際に送るファイルのパスを返す（画像は縮小・再圧縮）"""
+        if media_type == MediaType.IMAGE and self.image_preprocessor is not None:
+            return await self.image_preprocessor.prepare(file_path)
+        return file_path
+
+    async def split_media_file(self, file_path: str, media_type: str) -> List[str]:
+        """解析単位に分割したファイルのパスを時間順に返す（動画は区間分割、音声は前処理とチャンク分割）"""
+        splitter = self._media_splitter(media_type)
+        if splitter is not None:
+            return await splitter.split(file_path)
+        return [file_path]
+
+    def merge_split_outputs(self, media_type: str, outputs: List[Dict[str, Any]], keys: List[str]) -> Dict[str, str]:
+        """split_media_file で分割した各ファイルの出力を、メディアタイプごとの統合方法で1つにまとめる"""
+        if len(outputs) == 1:
+            return outputs[0]
+        return self._media_splitter(media_type).merge(outputs, keys)
+
+    def _media_splitter(self, media_type: str) -> Optional[Any]:
+        if media_type == MediaType.VIDEO:
+            return self.video_segmenter
+        if media_type == MediaType.AUDIO:
+            return self.audio_preprocessor
+        return None
+
+    async def inline_media_part(self, file_path: str) -> Optional[Any]:
+        """inline_media_max_mb 以下のファイルをバイト列のパートとして返す（対象外ならNone）"""
+        if self.inline_media_max_mb <= 0:
+            return None
+        size = os.path.getsize(file_path)
+        if size > self.inline_media_max_mb * 1024 * 1024:
+            return None
+        mime_type, _ = mimetypes.guess_type(file_path)
+        if not mime_type:
+            return None
+        data = await asyncio.to_thread(Path(file_path).read_bytes)
+        logger.info(f"📦 [非同期] Sending {os.path.basename(file_path)} inline ({size / 1024:.0f}KB, {mime_type})")
+        return types.Part.from_bytes(data=data, mime_type=mime_type)
+
+    async def lookup_uploaded_file(self, file_path: str) -> Tuple[Optional[str], Optional[Any]]:
+        """
+        アップロード済みで期限内のファイルを探す
+        Returns:
+            Tuple[Optional[str], Optional[Any]]: (キャッシュキー, 再利用できるファイルのパート)
+            キャッシュ無効時は (None, None)
+        """
+        if self.upload_cache is None:
+            return None, None
+        content_hash = await asyncio.to_thread(file_content_hash, file_path)
+        if not content_hash:
+            return None, None
+        # ファイルはAPIキー（プロジェクト）ごとに管理されるためキーに含める
+        cache_key = self.upload_cache.make_key(self.api_key, content_hash)
+        entry = await self.upload_cache.aget(cache_key)
+        if not entry:
+            return cache_key, None
+        logger.info(f"♻️ [非同期] Reusing uploaded file for {os.path.basename(file_path)}: {entry['name']}")
+        return cache_key, types.Part.from_uri(file_uri=entry['uri'], mime_type=entry['mime_type'])
+
+    async def remember_uploaded_file(self, cache_key: Optional[str], uploaded_file: Any) -> None:
+        """ACTIVE になったアップロード済みファイルを再利用キャッシュに登録する"""
+        if cache_key and self.upload_cache is not None:
+            await self.upload_cache.aput(cache_key, {
+                "name": uploaded_file.name,
+                "uri": uploaded_file.uri,
+                "mime_type": uploaded_file.mime_type,
+            })
+
+    async def forget_uploaded_file(self, cache_key: Optional[str]) -> None:
+        """リモートで消えていたファイルを再利用キャッシュから外す"""
+        if cache_key and self.upload_cache is not None:
+            await self.upload_cache.adelete(cache_key)
+
+    async def upload_and_wait_async(self, file_path: str, label: str) -> Any:
+        """ファイルをアップロードし、ACTIVE になるまで待ってファイルオブジェクトを返す"""
+        logger.info(f"⬆️ [非同期] Uploading {label} for analysis: {file_path}")
+        uploaded_file = await self.upload_file_async(file_path)
+        logger.info(f"✅ [非同期] Uploaded successfully: {uploaded_file.uri}")
+        if not await self.wait_for_processing_async(uploaded_file):
+            # 処理に失敗したファイルは使えないため、保持期間まで残さずに削除する
+            try:
+                await self.delete_file_async(uploaded_file.name)
+            except Exception as e:
+                logger.warning(f"⚠️ [非同期] Failed to delete unprocessed file {uploaded_file.name}: {e}")
+            raise GeminiAPIError(f"{label}ファイルの処理が完了しませんでした")
+        return uploaded_file
+
+    async def generate_json_async(self, model: str, contents: Any, response_schema: Optional[Dict[str, Any]],
+                                  config_params: Optional[Dict[str, Any]] = None,
+                                  cache_prefix: Optional[CachePrefix] = None) -> Any:
+        """response_schema で出力を制約してJSONを生成する
+        スキーマがモデルに受け付けられなかった場合は、以降スキーマなしで送る（プロンプト内のJSON例で形式を指示）
+        cache_prefix を指定し、先頭のテキストがそのプレフィックスで始まる場合は、
+        コンテキストキャッシュ（cached_content）を使ってプレフィックスを送らずに済ませる
+
+        Args:
+            model (str): 使用するモデル名
+            contents (Any): 送信するコンテンツ（文字列、または先頭が文字列のリスト）
+            response_schema (Optional[Dict[str, Any]]): 出力のスキーマ（Noneなら制約しない）
+            config_params (Optional[Dict[str, Any]]): その他の生成パラメータ
+            cache_prefix (Optional[CachePrefix]): キャッシュ対象の共通プレフィックス
+
+        Returns:
+            Any: generate_content のレスポンス
+        """
+        handle, cached_contents = await self._acquire_context_cache(model, contents, cache_prefix)
+        if handle is not None:
+            try:
+                return await self._generate_json(model, cached_contents, response_schema,
+                                                 {**(config_params or {}), "cached_content": handle.name})
+            except Exception as e:
+                if not is_missing_context_cache_error(e):
+                    raise
+                # 期限切れなどでサーバー側のキャッシュが消えていた場合はプレフィックスを含めて送り直す
+                logger.warning(f"Context cache {handle.name} is no longer available, sending the prompt inline: {e}")
+                self.context_cache.discard(handle)
+        return await self._generate_json(model, contents, response_schema, config_params)
+
+    async def _acquire_context_cache(self, model: str, contents: Any,
+                                     cache_prefix: Optional[CachePrefix]) -> Tuple[Optional[Any], Any]:
+        """コンテキストキャッシュのハンドルと、プレフィックスを除いたコンテンツを返す（使わない場合は (None, None)）"""
+        if cache_prefix is None or self.context_cache is None:
+            return None, None
+        parts = [contents] if isinstance(contents, str) else list(contents)
+        if not parts or not isinstance(parts[0], str) or not parts[0].startswith(cache_prefix.text):
+            return None, None
+        rest = parts[0][len(cache_prefix.text):].strip()
+        cached_contents = ([rest] if rest else []) + parts[1:]
+        if not cached_contents:
+            return None, None
+        handle = await self.context_cache.acquire(model, cache_prefix)
+        if handle is None or handle.inline:
+            return None, None
+        return handle, cached_contents
+
+    async def _generate_json(self, model: str, contents: Any, response_schema: Optional[Dict[str, Any]],
+                             config_params: Optional[Dict[str, Any]] = None) -> Any:
+        """generate_json_async の本体（構造化出力が拒否された場合はスキーマなしで再実行）"""
+        params = dict(config_params or {})
+        if response_schema is not None and self.structured_output_supported:
+            try:
+                return await self.generate_content_async(
+                    model=model,
+                    contents=contents,
+                    config=types.GenerateContentConfig(
+                        **params,
+                        response_mime_type="application/json",
+                        response_schema=response_schema
+                    )
+                )
+            except Exception as e:
+                if not is_schema_rejected_error(e):
+                    raise
+                logger.warning(f"⚠️ 構造化出力が受け付けられなかったため、スキーマなしで再実行します: {e}")
+                self.structured_output_supported = False
+        return await self.generate_content_async(
+            model=model,
+            contents=contents,
+            config=types.GenerateContentConfig(**params) if params else None
+        )
+
+    async def generate_from_media_async(self, prompt: str, media: Any, analysis_config: Dict[str, Any],
+                                        response_schema: Optional[Dict[str, Any]] = None,
+                                        cache_prefix: Optional[CachePrefix] = None) -> Any:
+        """プロンプトとメディア（アップロード済みファイルまたはパート）をモデルに渡して生成する
+        response_schema を指定した場合は出力をそのスキーマのJSONに制約する
+        cache_prefix を指定した場合はプロンプトの共通部分をコンテキストキャッシュから参照する"""
+        return await self.generate_json_async(
+            model=self.transcription_model,
+            contents=[prompt, media],
+            response_schema=response_schema,
+            config_params={
+                "temperature": analysis_config["temperature"],
+                "top_p": analysis_config["top_p"],
+                "top_k": analysis_config["top_k"],
+                "max_output_tokens": analysis_config["max_output_tokens"],
+            },
+            cache_prefix=cache_prefix
+        )
+
+    async def _generate_from_file(self, file_path: str, prompt: str, analysis_config: Dict[str, Any],
+                                  label: str, response_schema: Optional[Dict[str, Any]] = None,
+                                  cache_prefix: Optional[CachePrefix] = None) -> Any:
+        """メディアファイルとプロンプトをモデルに渡し、generate_content のレスポンスを返す
+        小さいファイルはインラインで送り、それ以外はアップロード済みファイルを再利用する
+
+        Args:
+            file_path (str): 解析するファイルのパス
+            prompt (str): 解析の指示プロンプト
+            analysis_config (Dict[str, Any]): 生成パラメータ（*_analysis_config）
+            label (str): ログ・エラーメッセージ用の種別名
+            response_schema (Optional[Dict[str, Any]]): 出力を制約するスキーマ
+            cache_prefix (Optional[CachePrefix]): コンテキストキャッシュの対象にするプロンプトの共通部分
+        """
+        inline_part = await self.inline_media_part(file_path)
+        if inline_part is not None:
+            # 小さいファイルは Files API を使わず1回のリクエストで完結させる
+            return await self.generate_from_media_async(prompt, inline_part, analysis_config, response_schema, cache_prefix)
+        
+        cache_key, media = await self.lookup_uploaded_file(file_path)
+        if media is not None:
+            try:
+                return await self.generate_from_media_async(prompt, media, analysis_config, response_schema, cache_prefix)
+            except Exception as e:
+                if not is_missing_file_error(e):
+                    raise
+                # 保持期間切れなどでリモートのファイルが消えていた場合は再アップロードする
+                logger.warning(f"Cached upload is no longer available, re-uploading {file_path}: {e}")
+                await self.forget_uploaded_file(cache_key)
+        
+        uploaded_file = await self.upload_and_wait_async(file_path, label)
+        await self.remember_uploaded_file(cache_key, uploaded_file)
+        response = await self.generate_from_media_async(prompt, uploaded_file, analysis_config, response_schema, cache_prefix)
+        
+        # 再利用しない設定の場合はアップロードしたファイルを削除（リソース節約のため）
+        if self.upload_cache is None:
+            try:
+                await self.delete_file_async(uploaded_file.name)
+                logger.info(f"✅ [非同期] Temporary {label} file deleted: {uploaded_file.name}")
+            except Exception as e:
+                logger.warning(f"⚠️ [非同期] Failed to delete temporary file: {e}")
+        return response
+
+    async def analyze_image(self, file_path: str, prompt: str, response_schema: Optional[Dict[str, Any]] = None,
+                            cache_prefix: Optional[CachePrefix] = None) -> str:
         """画像を解析してテキストを生成する（非同期版）
         
         Args:
             file_path (str): 解析する画像ファイルのパス
             prompt (str): 解析の指示プロンプト
+            response_schema (Optional[Dict[str, Any]]): 出力を制約するスキーマ（JSONで返す場合）
+            cache_prefix (Optional[CachePrefix]): コンテキストキャッシュの対象にするプロンプトの共通部分
             
         Returns:
             str: 解析結果のテキスト
@@ -351,44 +756,15 @@ class GeminiAPI:
             await asyncio.to_thread(self._check_file_size, file_path)
             logger.debug(f"✅ [非同期] File size check completed")
             
-            # 画像ファイルをアップロード
-            logger.info(f"⬆️ [非同期] Uploading image for analysis: {file_path}")
-            uploaded_file = await asyncio.to_thread(self.client.files.upload, file=file_path)
-            logger.info(f"✅ [非同期] Image uploaded successfully: {uploaded_file.uri}")
-            upload_time = time.time() - start_time
-            logger.debug(f"⏱️ [非同期] Upload completed in {upload_time:.2f} seconds")
-            
-            # ファイル処理の完了を待機
-            logger.debug(f"⏳ [非同期] Waiting for image processing completion...")
-            if not await asyncio.to_thread(self.wait_for_processing, uploaded_file):
-                raise GeminiAPIError("画像ファイルの処理が完了しませんでした")
-            logger.debug(f"✅ [非同期] Image processing completed")
-            
-            # 画像解析の実行 (最新APIでは uploaded_file を直接 contents に渡す)
+            # 画像ファイルを用意して解析を実行（アップロード済みのファイルは再利用）
             analysis_start = time.time()
             logger.info(f"🤖 [非同期] Starting AI image analysis...")
-            response = await asyncio.to_thread(
-                self.client.models.generate_content,
-                model=self.transcription_model,
-                contents=[prompt, uploaded_file],
-                config=types.GenerateContentConfig(
-                    temperature=self.image_analysis_config["temperature"],
-                    top_p=self.image_analysis_config["top_p"],
-                    top_k=self.image_analysis_config["top_k"],
-                    max_output_tokens=self.image_analysis_config["max_output_tokens"],
-                )
-            )
+            send_path = await self.prepare_media_file(file_path, MediaType.IMAGE)
+            response = await self._generate_from_file(send_path, prompt, self.image_analysis_config, "画像", response_schema,
+                                                      cache_prefix)
             analysis_time = time.time() - analysis_start
             logger.debug(f"🎯 [非同期] Image AI analysis completed in {analysis_time:.2f} seconds")
             
-            # ファイルを削除（オプション：リソース節約のため）
-            try:
-                logger.debug(f"🗑️ [非同期] Deleting temporary image file...")
-                await asyncio.to_thread(self.client.files.delete, name=uploaded_file.name)
-                logger.info(f"✅ [非同期] Temporary image file deleted: {uploaded_file.name}")
-            except Exception as e:
-                logger.warning(f"⚠️ [非同期] Failed to delete temporary file: {e}")
-            
             result = response.text
             total_time = time.time() - start_time
             logger.info(f"🎉 [非同期] Image analysis completed successfully in {total_time:.2f} seconds, response length: {len(result)} characters")
@@ -426,52 +802,17 @@ class GeminiAPI:
             logger.debug(f"🔧 [非同期] Video analysis prompt length: {len(prompt)} characters")
             start_time = time.time()
             
-            # ファイルサイズのチェック
-            logger.debug(f"📏 [非同期] Checking file size for: {file_path}")
-            await asyncio.to_thread(self._check_file_size, file_path)
-            logger.debug(f"✅ [非同期] File size check completed")
-            
-            # 動画ファイルをアップロード
-            logger.info(f"⬆️ [非同期] Uploading video for analysis: {file_path}")
-            uploaded_file = await asyncio.to_thread(self.client.files.upload, file=file_path)
-            logger.info(f"✅ [非同期] Video uploaded successfully: {uploaded_file.uri}")
-            upload_time = time.time() - start_time
-            logger.debug(f"⏱️ [非同期] Upload completed in {upload_time:.2f} seconds")
-            
-            # ファイル処理の完了を待機（動画は時間がかかる場合があります）
-            logger.info(f"⏳ [非同期] Waiting for video processing to complete...")
-            if not await asyncio.to_thread(self.wait_for_processing, uploaded_file):
-                raise GeminiAPIError("動画ファイルの処理が完了しませんでした")
-            
-            processing_time = time.time() - start_time
-            logger.debug(f"✅ [非同期] Video processing completed in {processing_time:.2f} seconds")
-            
-            # 動画解析の実行 (最新APIでは uploaded_file を直接 contents に渡す)
+            # 動画ファイルを用意して解析を実行（長い動画は区間ごとに並列解析）
             analysis_start = time.time()
             logger.info(f"🤖 [非同期] Starting AI video analysis...")
-            response = await asyncio.to_thread(
-                self.client.models.generate_content,
-                model=self.transcription_model,
-                contents=[prompt, uploaded_file],
-                config=types.GenerateContentConfig(
-                    temperature=self.video_analysis_config["temperature"],
-                    top_p=self.video_analysis_config["top_p"],
-                    top_k=self.video_analysis_config["top_k"],
-                    max_output_tokens=self.video_analysis_config["max_output_tokens"],
-                )
-            )
+            texts = await self._analyze_media_segments(file_path, prompt, MediaType.VIDEO)
             analysis_time = time.time() - analysis_start
             logger.debug(f"🎬 [非同期] Video AI analysis completed in {analysis_time:.2f} seconds")
             
-            # ファイルを削除（オプション：リソース節約のため）
-            try:
-                logger.debug(f"🗑️ [非同期] Deleting temporary video file...")
-                await asyncio.to_thread(self.client.files.delete, name=uploaded_file.name)
-                logger.info(f"✅ [非同期] Temporary video file deleted: {uploaded_file.name}")
-            except Exception as e:
-                logger.warning(f"⚠️ [非同期] Failed to delete temporary file: {e}")
-            
-            result = response.text
+            if len(texts) == 1:
+                result = texts[0]
+            else:
+                result = "\n\n".join(f"[区間 {i + 1}/{len(texts)}]\n{text}" for i, text in enumerate(texts))
             total_time = time.time() - start_time
             logger.info(f"🎉 [非同期] Video analysis completed successfully in {total_time:.2f} seconds, response length: {len(result)} characters")
             return result
@@ -490,6 +831,54 @@ class GeminiAPI:
             logger.debug(f"🔍 [非同期] Video analysis error details: {type(e).__name__}: {e}")
             raise GeminiAPIError(error_msg)
 
+    async def analyze_media_segments(self, file_path: str, prompt: str, media_type: str,
+                                     response_schema: Optional[Dict[str, Any]] = None,
+                                     cache_prefix: Optional[CachePrefix] = None) -> List[str]:
+        """動画・音声を区間ごとに解析し、区間ごとの応答テキストを時間順に返す（分割しない場合は1件）
+        
+        Args:
+            file_path (str): 解析するファイルのパス
+            prompt (str): 解析の指示プロンプト
+            media_type (str): メディアタイプ ("video", "audio")
+            response_schema (Optional[Dict[str, Any]]): 出力を制約するスキーマ（区間ごとに適用）
+            cache_prefix (Optional[CachePrefix]): コンテキストキャッシュの対象にするプロンプトの共通部分
+            
+        Returns:
+            List[str]: 区間ごとの解析結果のテキスト
+            
+        Raises:
+            GeminiAPIError: 解析に失敗した場合
+        """
+        label, _ = self.media_analysis_settings(media_type)
+        try:
+            return await self._analyze_media_segments(file_path, prompt, media_type, response_schema, cache_prefix)
+        except FileNotFoundError as e:
+            raise GeminiAPIError(f"{label}ファイルが見つかりません: {str(e)}")
+        except VideoFileTooLargeError as e:
+            raise GeminiAPIError(f"{label}ファイルサイズエラー: {str(e)}")
+        except GeminiAPIError:
+            raise
+        except Exception as e:
+            raise GeminiAPIError(f"{label}解析に失敗しました: {str(e)}")
+
+    async def _analyze_media_segments(self, file_path: str, prompt: str, media_type: str,
+                                      response_schema: Optional[Dict[str, Any]] = None,
+                                      cache_prefix: Optional[CachePrefix] = None) -> List[str]:
+        """ファイルを区間に分割し、各区間を並列に解析する（サイズ上限は区間ごとに確認）"""
+        label, analysis_config = self.media_analysis_settings(media_type)
+        segments = await self.split_media_file(file_path, media_type)
+        logger.debug(f"📏 [非同期] Checking file size for {len(segments)} segment(s) of: {file_path}")
+        for segment in segments:
+            await asyncio.to_thread(self._check_file_size, segment)
+        if len(segments) > 1:
+            logger.info(f"🧩 [非同期] Analyzing {len(segments)} {media_type} segments in parallel")
+        responses = await asyncio.gather(*(
+            self._generate_from_file(segment, segment_prompt(prompt, i, len(segments)), analysis_config, label,
+                                     response_schema, cache_prefix)
+            for i, segment in enumerate(segments)
+        ))
+        return [response.text for response in responses]
+
     async def analyze_audio(self, file_path: str, prompt: str) -> str:
         """音声を解析してテキストを生成する（非同期版）
         
@@ -508,52 +897,17 @@ class GeminiAPI:
             logger.debug(f"🔧 [非同期] Audio analysis prompt length: {len(prompt)} characters")
             start_time = time.time()
             
-            # ファイルサイズのチェック
-            logger.debug(f"📏 [非同期] Checking file size for: {file_path}")
-            await asyncio.to_thread(self._check_file_size, file_path)
-            logger.debug(f"✅ [非同期] File size check completed")
-            
-            # 音声ファイルをアップロード
-            logger.info(f"⬆️ [非同期] Uploading audio for analysis: {file_path}")
-            uploaded_file = await asyncio.to_thread(self.client.files.upload, file=file_path)
-            logger.info(f"✅ [非同期] Audio uploaded successfully: {uploaded_file.uri}")
-            upload_time = time.time() - start_time
-            logger.debug(f"⏱️ [非同期] Upload completed in {upload_time:.2f} seconds")
-            
-            # ファイル処理の完了を待機
-            logger.info(f"⏳ [非同期] Waiting for audio processing to complete...")
-            if not await asyncio.to_thread(self.wait_for_processing, uploaded_file):
-                raise GeminiAPIError("音声ファイルの処理が完了しませんでした")
-            
-            processing_time = time.time() - start_time
-            logger.debug(f"✅ [非同期] Audio processing completed in {processing_time:.2f} seconds")
-            
-            # 音声解析の実行 (最新APIでは uploaded_file を直接 contents に渡す)
+            # 音声ファイルを用意して解析を実行（変換・無音除去後、長い録音はチャンクごとに並列解析）
             analysis_start = time.time()
             logger.info(f"🤖 [非同期] Starting AI audio analysis...")
-            response = await asyncio.to_thread(
-                self.client.models.generate_content,
-                model=self.transcription_model,
-                contents=[prompt, uploaded_file],
-                config=types.GenerateContentConfig(
-                    temperature=self.audio_analysis_config["temperature"],
-                    top_p=self.audio_analysis_config["top_p"],
-                    top_k=self.audio_analysis_config["top_k"],
-                    max_output_tokens=self.audio_analysis_config["max_output_tokens"],
-                )
-            )
+            texts = await self._analyze_media_segments(file_path, prompt, MediaType.AUDIO)
             analysis_time = time.time() - analysis_start
             logger.debug(f"🎵 [非同期] Audio AI analysis completed in {analysis_time:.2f} seconds")
             
-            # ファイルを削除（オプション：リソース節約のため）
-            try:
-                logger.debug(f"🗑️ [非同期] Deleting temporary audio file...")
-                await asyncio.to_thread(self.client.files.delete, name=uploaded_file.name)
-                logger.info(f"✅ [非同期] Temporary audio file deleted: {uploaded_file.name}")
-            except Exception as e:
-                logger.warning(f"⚠️ [非同期] Failed to delete temporary file: {e}")
-            
-            result = response.text
+            if len(texts) == 1:
+                result = texts[0]
+            else:
+                result = "\n\n".join(f"[区間 {i + 1}/{len(texts)}]\n{text}" for i, text in enumerate(texts))
             total_time = time.time() - start_time
             logger.info(f"🎉 [非同期] Audio analysis completed successfully in {total_time:.2f} seconds, response length: {len(result)} characters")
             return result
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+画像モードのアップロード前処理（長辺の縮小とJPEG再圧縮）
+縮小処理はプロセスプールで実行し、生成したファイルは元ファイルの内容ハッシュ単位でキャッシュする
+Pillow が未インストールの場合は前処理を行わず元ファイルをそのまま使う
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from utils.config import config_manager
+from utils.file_hash import file_content_hash
+
+try:
+    import PIL  # noqa: F401  (子プロセス側で使用。ここでは有無の確認のみ)
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_DIR_NAME = 'image_cache'
+
+# 前処理設定のデフォルト値（config.json の image_preprocess で上書き可能）
+DEFAULT_IMAGE_PREPROCESS_CONFIG = {
+    "enabled": True,
+    "max_edge": 1536,       # 長辺の最大ピクセル数
+    "quality": 85,          # JPEG再圧縮の品質
+    "min_size_kb": 300,     # これより小さく、長辺も上限以内の画像はそのまま送る
+    "workers": 2,           # 縮小処理のプロセス数
+    "max_age_days": 30,     # キャッシュした縮小画像の保持日数
+}
+
+
+def _downscale_image(src: str, dst: str, max_edge: int, quality: int, min_size_bytes: int) -> bool:
+    """
+    画像を長辺 max_edge 以下に縮小してJPEGで保存する（プロセスプールで実行）
+    縮小・再圧縮の必要がない、または元より大きくなる場合は保存せずFalseを返す
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as img:
+        if max(img.size) <= max_edge and os.path.getsize(src) <= min_size_bytes:
+            return False
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if img.mode in ("RGBA", "LA", "P"):
+            # 透過部分は白で塗りつぶしてからJPEGにする
+            rgba = img.convert("RGBA")
+            background = Image.new("RGB", rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.split()[-1])
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        tmp_path = f"{dst}.{os.getpid()}.tmp"
+        img.save(tmp_path, "JPEG", quality=quality, optimize=True)
+    if os.path.getsize(tmp_path) >= os.path.getsize(src):
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, dst)
+    return True
+
+
+class ImagePreprocessor:
+    """画像を縮小・再圧縮し、送信に使うファイルのパスを返す"""
+
+    def __init__(self, cache_dir: str, max_edge: int, quality: int, min_size_kb: float,
+                 workers: int, max_age_days: float):
+        """
+        Args:
+            cache_dir: 縮小画像の保存先
+            max_edge: 長辺の最大ピクセル数
+            quality: JPEG品質
+            min_size_kb: 縮小不要とみなすファイルサイズ（KB）
+            workers: プロセスプールのプロセス数
+            max_age_days: 縮小画像の保持日数
+        """
+        self.cache_dir = cache_dir
+        self.max_edge = int(max_edge)
+        self.quality = int(quality)
+        self.min_size_bytes = int(float(min_size_kb) * 1024)
+        self.workers = max(1, int(workers))
+        self.max_age_days = float(max_age_days)
+        self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._prune()
+
+    @classmethod
+    def from_config(cls, cache_dir: str) -> Optional['ImagePreprocessor']:
+        """config.json の image_preprocess 設定から生成する（無効・Pillow未導入時はNone）"""
+        cfg: Dict[str, Any] = {**DEFAULT_IMAGE_PREPROCESS_CONFIG, **config_manager.get_config().get('image_preprocess', {})}
+        if not cfg.get('enabled'):
+            logger.info("Image preprocessing is disabled by config.")
+            return None
+        if not PIL_AVAILABLE:
+            logger.warning("Pillow がインストールされていないため画像の縮小処理を行いません")
+            return None
+        return cls(cache_dir, cfg['max_edge'], cfg['quality'], cfg['min_size_kb'], cfg['workers'], cfg['max_age_days'])
+
+    def _get_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def _prune(self) -> None:
+        """保持日数を過ぎた縮小画像を削除する"""
+        cutoff = time.time() - self.max_age_days * 86400
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+        if removed:
+            logger.info(f"ImagePreprocessor: 古い縮小画像を{removed}件削除しました")
+
+    async def prepare(self, file_path: str) -> str:
+        """送信に使う画像のパスを返す（縮小不要・失敗時は元のパス）"""
+        content_hash = await asyncio.to_thread(file_content_hash, file_path)
+        if not content_hash:
+            return file_path
+        derived = os.path.join(self.cache_dir, f"{content_hash}_{self.max_edge}_q{self.quality}.jpg")
+        skipped = derived + ".skip"
+        if os.path.exists(derived):
+            logger.debug(f"ImagePreprocessor: キャッシュ済みの縮小画像を使用 {os.path.basename(file_path)}")
+            return derived
+        if os.path.exists(skipped):
+            return file_path
+        try:
+            loop = asyncio.get_running_loop()
+            created = await loop.run_in_executor(
+                self._get_pool(), _downscale_image,
+                file_path, derived, self.max_edge, self.quality, self.min_size_bytes
+            )
+        except Exception as e:
+            logger.warning(f"ImagePreprocessor: 縮小処理に失敗したため元画像を使用します {file_path}: {e}")
+            return file_path
+        if not created:
+            # 縮小不要と判定した画像は次回から判定を省略する
+            open(skipped, 'w').close()
+            return file_path
+        logger.info(f"🖼️ 画像を縮小: {os.path.basename(file_path)} "
+                    f"{os.path.getsize(file_path) / 1024:.0f}KB → {os.path.getsize(derived) / 1024:.0f}KB")
+        return derived
+
+    def shutdown(self) -> None:
+        """プロセスプールを終了する"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
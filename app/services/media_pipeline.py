@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+apply_rule のメディア処理用ステージパイプライン
+分割 → 前処理 → アップロード → ACTIVE待ち → 生成 → 後片付け の各段階を上限付きキューでつなぎ、
+段階ごとのワーカー数で並列に動かす（回線・サーバー側処理・モデルを同時に稼働させる）
+長い動画・音声は分割段階で区間ファイルに分け、区間ごとのジョブとして並列に流す
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .context_cache import CachePrefix
+from .gemini_api import GeminiAPI, GeminiAPIError, VideoFileTooLargeError, is_missing_file_error
+from .retry_policy import RetryBudget, new_retry_budget, use_retry_budget
+from .scheduler import RunControl, CONTROL_POLL_INTERVAL
+from .video_segmenter import segment_prompt
+
+logger = logging.getLogger(__name__)
+
+# パイプライン設定のデフォルト値（config.json の media_pipeline で上書き可能）
+DEFAULT_MEDIA_PIPELINE_CONFIG = {
+    "enabled": True,
+    "queue_size": 8,           # 段階間キューの上限
+    "split_workers": 2,        # 動画の区間分割・音声の変換（ffmpeg）
+    "preprocess_workers": 2,   # サイズ確認・ハッシュ計算・インライン読み込み
+    "upload_workers": 3,       # Files API へのアップロード
+    "wait_workers": 16,        # ACTIVE待ち（共有ウォッチャーで待つため多めでよい）
+    "generate_workers": 5,     # モデル呼び出し（モデル別レートリミッタも適用される）
+    "cleanup_workers": 2,      # アップロードしたファイルの削除
+}
+
+STAGES = ("split", "preprocess", "upload", "wait", "generate", "cleanup")
+
+
+class MediaJob:
+    """パイプラインを流れる1ファイル（分割した場合は1区間）分の処理状態"""
+
+    def __init__(self, index: int, file_path: str, segment_path: Optional[str] = None,
+                 segment: int = 0, segment_count: int = 1):
+        self.index = index
+        self.file_path = file_path
+        self.segment = segment          # 区間番号（0始まり）
+        self.segment_count = segment_count
+        self.send_path = segment_path or file_path  # 前処理後に実際に送るファイル
+        self.budget: RetryBudget = new_retry_budget()  # 全段階で共有する再試行予算
+        self.media: Any = None          # generate_content に渡すファイルまたはパート
+        self.cache_key: Optional[str] = None
+        self.reused = False             # 以前のアップロードを再利用しているか
+        self.uploaded: Any = None       # 今回アップロードしたファイル（後片付け対象）
+        self.kept = False               # アップロードしたファイルを再利用キャッシュに登録したか
+        self.cleaned = False            # アップロードしたファイルを削除したか
+        self.text: Optional[str] = None
+        self.error: Optional[Exception] = None
+        self.finished = False
+
+
+class MediaPipeline:
+    """メディアファイル群を段階ごとに並列処理するパイプライン"""
+
+    def __init__(self, gemini: GeminiAPI, media_type: str, prompt: str, config: Optional[Dict[str, Any]] = None,
+                 response_schema: Optional[Dict[str, Any]] = None, cache_prefix: Optional[CachePrefix] = None):
+        """
+        Args:
+            gemini: GeminiAPI のインスタンス
+            media_type: "image" / "video" / "audio"
+            prompt: 全ファイル共通の解析プロンプト
+            config: パイプライン設定（省略時はデフォルト値）
+            response_schema: 応答を制約するスキーマ（省略時は制約しない）
+            cache_prefix: コンテキストキャッシュの対象にするプロンプトの共通部分（省略時は毎回送る）
+        """
+        self.gemini = gemini
+        self.media_type = media_type
+        self.prompt = prompt
+        self.response_schema = response_schema
+        self.cache_prefix = cache_prefix
+        self.config = {**DEFAULT_MEDIA_PIPELINE_CONFIG, **(config or {})}
+        self.label, self.analysis_config = gemini.media_analysis_settings(media_type)
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._remaining = 0
+        self._fed = False
+        self._all_done: Optional[asyncio.Event] = None
+        self._on_done: Optional[Callable[[List[MediaJob]], None]] = None
+        self._row_jobs: Dict[int, List[MediaJob]] = {}
+        self._delivered: set = set()
+
+    async def run(self, items: Sequence[Tuple[int, str]], on_done: Callable[[List[MediaJob]], None],
+                  control: Optional[RunControl] = None,
+                  on_skipped: Optional[Callable[[int, str], None]] = None) -> None:
+        """
+        (index, ファイルパス) の各要素を処理し、完了したものから on_done(jobs) に渡す
+        jobs はその要素の区間ごとのジョブ（分割しない場合は1件）で、
+        各 job.text に応答テキスト、失敗時は job.error に例外が入る
+        control で一時停止中は新しいファイルを投入せず、中止時は処理中のものもキャンセルする
+        中止により完了しなかった要素は on_skipped(index, ファイルパス) に通知する
+        """
+        items = list(items)
+        if not items:
+            return
+        start_time = time.time()
+        self._on_done = on_done
+        self._remaining = 0
+        self._fed = False
+        self._row_jobs = {}
+        self._delivered = set()
+        self._all_done = asyncio.Event()
+        queue_size = max(1, int(self.config["queue_size"]))
+        # 後片付けは最終段のため上限なし（前段を詰まらせない）
+        self._queues = {stage: asyncio.Queue(maxsize=queue_size if stage != "cleanup" else 0) for stage in STAGES}
+
+        tasks: List[asyncio.Task] = []
+        worker_counts = {}
+        for stage in STAGES:
+            count = max(1, int(self.config.get(f"{stage}_workers", 1)))
+            worker_counts[stage] = count
+            tasks.extend(asyncio.create_task(self._stage_worker(stage)) for _ in range(count))
+        tasks.append(asyncio.create_task(self._feed(items, control)))
+        if control is not None:
+            tasks.append(asyncio.create_task(self._watch_cancel(control)))
+        logger.info(f"MediaPipeline 開始: {self.label} {len(items)}件 ワーカー数={worker_counts}")
+
+        try:
+            await self._all_done.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._cleanup_abandoned()
+
+        unfinished = [(index, path) for index, path in items if index not in self._delivered]
+        if unfinished:
+            logger.info(f"MediaPipeline 中止: 完了={len(items) - len(unfinished)}件 未完了={len(unfinished)}件")
+            if on_skipped is not None:
+                for index, path in unfinished:
+                    on_skipped(index, path)
+        logger.info(f"MediaPipeline 完了: {len(items)}件 所要時間={time.time() - start_time:.2f}秒")
+
+    async def _feed(self, items: List[Tuple[int, str]], control: Optional[RunControl]) -> None:
+        """要素を分割キューへ投入する（キューが満杯の間は待つ）"""
+        for index, file_path in items:
+            if control is not None and not await control.wait_if_paused():
+                return
+            job = MediaJob(index, file_path)
+            self._row_jobs[index] = [job]
+            self._remaining += 1
+            await self._queues["split"].put(job)
+        self._fed = True
+        if self._remaining <= 0:
+            self._all_done.set()
+
+    async def _watch_cancel(self, control: RunControl) -> None:
+        """中止指示を受けたらパイプライン全体を終了させる"""
+        while not control.is_cancelled:
+            await asyncio.sleep(CONTROL_POLL_INTERVAL)
+        logger.info("MediaPipeline: 中止指示を受けたため処理中のファイルをキャンセルします")
+        self._all_done.set()
+
+    async def _stage_worker(self, stage: str) -> None:
+        """1段階分のワーカー：キューからジョブを取り出して処理し、次の段階へ渡す"""
+        handler = getattr(self, f"_{stage}")
+        queue = self._queues[stage]
+        while True:
+            job = await queue.get()
+            try:
+                with use_retry_budget(job.budget):
+                    next_stage = await handler(job)
+            except Exception as e:
+                if stage == "cleanup":
+                    next_stage = None
+                else:
+                    job.error = self._wrap_error(e)
+                    logger.error(f"❌ [パイプライン] {stage} failed for {job.file_path}: {job.error}")
+                    next_stage = None
+            if stage == "cleanup":
+                self._job_done()
+            elif next_stage is None:
+                self._finish(job)
+            else:
+                await self._queues[next_stage].put(job)
+
+    async def _split(self, job: MediaJob) -> Optional[str]:
+        """長い動画・音声を区間に分け、2区間目以降のジョブを前処理キューへ投入する（先頭の区間はこのジョブで流す）"""
+        segments = await self.gemini.split_media_file(job.file_path, self.media_type)
+        job.send_path = segments[0]
+        job.segment_count = len(segments)
+        extra = [MediaJob(job.index, job.file_path, segment_path, n, len(segments))
+                 for n, segment_path in enumerate(segments) if n > 0]
+        self._row_jobs[job.index] = [job] + extra
+        self._remaining += len(extra)
+        for segment_job in extra:
+            await self._queues["preprocess"].put(segment_job)
+        return "preprocess"
+
+    async def _preprocess(self, job: MediaJob) -> Optional[str]:
+        """サイズ確認・前処理（画像の縮小など）と、インライン送信・アップロード済みファイルの再利用の判定"""
+        await asyncio.to_thread(self.gemini._check_file_size, job.send_path)
+        job.send_path = await self.gemini.prepare_media_file(job.send_path, self.media_type)
+        inline_part = await self.gemini.inline_media_part(job.send_path)
+        if inline_part is not None:
+            job.media = inline_part
+            return "generate"
+        job.cache_key, job.media = await self.gemini.lookup_uploaded_file(job.send_path)
+        if job.media is not None:
+            job.reused = True
+            return "generate"
+        return "upload"
+
+    async def _upload(self, job: MediaJob) -> Optional[str]:
+        """Files API へアップロードする"""
+        logger.info(f"⬆️ [パイプライン] Uploading {self.label}: {job.send_path}")
+        job.uploaded = await self.gemini.upload_file_async(job.send_path)
+        return "wait"
+
+    async def _wait(self, job: MediaJob) -> Optional[str]:
+        """アップロードしたファイルが ACTIVE になるまで待つ（処理に失敗したファイルは再利用キャッシュから外し、後片付けへ回す）"""
+        if not await self.gemini.wait_for_processing_async(job.uploaded):
+            await self.gemini.forget_uploaded_file(job.cache_key)
+            raise GeminiAPIError(f"{self.label}ファイルの処理が完了しませんでした")
+        await self._remember(job)
+        job.media = job.uploaded
+        return "generate"
+
+    async def _generate(self, job: MediaJob) -> Optional[str]:
+        """モデルで解析する（再利用したファイルが消えていた場合はその場で再アップロード）"""
+        prompt = segment_prompt(self.prompt, job.segment, job.segment_count)
+        try:
+            response = await self.gemini.generate_from_media_async(prompt, job.media, self.analysis_config,
+                                                             self.response_schema, self.cache_prefix)
+        except Exception as e:
+            if not job.reused or not is_missing_file_error(e):
+                raise
+            logger.warning(f"Cached upload is no longer available, re-uploading {job.file_path}: {e}")
+            await self.gemini.forget_uploaded_file(job.cache_key)
+            job.reused = False
+            job.uploaded = await self.gemini.upload_and_wait_async(job.send_path, self.label)
+            await self._remember(job)
+            job.media = job.uploaded
+            response = await self.gemini.generate_from_media_async(prompt, job.media, self.analysis_config,
+                                                             self.response_schema, self.cache_prefix)
+        job.text = response.text
+        return None
+
+    async def _cleanup(self, job: MediaJob) -> Optional[str]:
+        """再利用キャッシュに登録していないアップロード済みファイルを削除する"""
+        try:
+            await self.gemini.delete_file_async(job.uploaded.name)
+            job.cleaned = True
+            logger.debug(f"🗑️ [パイプライン] Temporary {self.label} file deleted: {job.uploaded.name}")
+        except Exception as e:
+            logger.warning(f"⚠️ [パイプライン] Failed to delete temporary file: {e}")
+        return None
+
+    async def _remember(self, job: MediaJob) -> None:
+        """ACTIVE になったアップロードを再利用キャッシュに登録する"""
+        await self.gemini.remember_uploaded_file(job.cache_key, job.uploaded)
+        job.kept = self.gemini.upload_cache is not None
+
+    async def _cleanup_abandoned(self) -> None:
+        """中止で後片付けまで進まなかったアップロード済みファイルを削除する（再利用キャッシュに登録済みのものは残す）"""
+        abandoned = [job for jobs in self._row_jobs.values() for job in jobs
+                     if job.uploaded is not None and not job.kept and not job.cleaned]
+        if not abandoned:
+            return
+        logger.info(f"MediaPipeline: 処理が完了しなかったアップロード済みファイルを{len(abandoned)}件削除します")
+        await asyncio.gather(*(self._cleanup(job) for job in abandoned))
+
+    def _finish(self, job: MediaJob) -> None:
+        """ジョブの結果を確定し、要素の全区間がそろったら通知する。必要なら後片付けへ回す"""
+        job.finished = True
+        row_jobs = self._row_jobs.get(job.index, [job])
+        if all(j.finished for j in row_jobs) and job.index not in self._delivered:
+            self._delivered.add(job.index)
+            try:
+                self._on_done(row_jobs)
+            except Exception as e:
+                logger.error(f"MediaPipeline: 結果の通知に失敗しました: {e}")
+        if job.uploaded is not None and not job.kept:
+            # 再利用キャッシュに登録していないアップロード（再利用しない設定・処理に失敗したもの）は削除する
+            self._queues["cleanup"].put_nowait(job)
+        else:
+            self._job_done()
+
+    def _job_done(self) -> None:
+        self._remaining -= 1
+        if self._remaining <= 0 and self._fed:
+            self._all_done.set()
+
+    def _wrap_error(self, error: Exception) -> Exception:
+        """analyze_* と同じ形式のエラーメッセージに揃える"""
+        if isinstance(error, FileNotFoundError):
+            return GeminiAPIError(f"{self.label}ファイルが見つかりません: {error}")
+        if isinstance(error, VideoFileTooLargeError):
+            return GeminiAPIError(f"{self.label}ファイルサイズエラー: {error}")
+        if isinstance(error, GeminiAPIError):
+            return error
+        return GeminiAPIError(f"{self.label}解析に失敗しました: {error}")
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Gemini API 呼び出し用のレート制限（トークンバケット + AIMD並列数制御）
+複数スレッド・イベントループから共有されるため、状態は threading.Lock で保護する
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from utils.config import config_manager
+
+logger = logging.getLogger(__name__)
+
+# レート制限設定のデフォルト値（config.json の rate_limits で上書き可能）
+DEFAULT_RATE_LIMIT_CONFIG = {
+    "rpm": 60,              # 1分あたりの最大リクエスト数
+    "max_concurrency": 8,   # 同時実行数の上限
+    "min_concurrency": 1,   # 429発生時に絞る同時実行数の下限
+}
+
+_POLL_INTERVAL = 0.05   # 空き待ちのポーリング間隔（秒）
+_DECREASE_COOLDOWN = 1.0  # 連続した429で何度も半減しないための間隔（秒）
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """429 / RESOURCE_EXHAUSTED によるエラーかどうかを判定"""
+    if getattr(error, 'code', None) == 429:
+        return True
+    text = str(error).upper()
+    return "429" in text or "RESOURCE_EXHAUSTED" in text or "RATE LIMIT" in text
+
+
+class TokenBucket:
+    """スレッドセーフなトークンバケット（待ち時間を予約方式で返す）"""
+
+    def __init__(self, rate_per_sec: float, capacity: float):
+        self.rate = max(rate_per_sec, 1e-6)
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """トークンを1つ予約し、実行まで待つべき秒数を返す"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens / self.rate)
+            return max(wait, self._blocked_until - now)
+
+    def block_for(self, seconds: float) -> None:
+        """指定秒数の間、新規リクエストを止める（蓄積済みトークンも破棄）"""
+        with self._lock:
+            now = time.monotonic()
+            self._blocked_until = max(self._blocked_until, now + seconds)
+            self._tokens = min(self._tokens, 0.0)
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD方式の同時実行数制御（成功で加算的に増やし、429で半減）"""
+
+    def __init__(self, max_concurrency: int, min_concurrency: int = 1):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.min_concurrency = max(1, min(int(min_concurrency), self.max_concurrency))
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        """空きがあれば枠を確保してTrueを返す"""
+        with self._lock:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def release(self, throttled: bool = False) -> None:
+        """枠を返却し、結果に応じて上限を調整する"""
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            now = time.monotonic()
+            if throttled:
+                if now - self._last_decrease >= _DECREASE_COOLDOWN:
+                    self.limit = max(float(self.min_concurrency), self.limit / 2)
+                    self._last_decrease = now
+                    logger.warning(f"Rate limited: concurrency limit decreased to {int(self.limit)}")
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1.0 / max(self.limit, 1.0))
+
+    def cancel(self) -> None:
+        """枠を返却する（キャンセルされた呼び出し用。上限は調整しない）"""
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+
+class ModelRateLimiter:
+    """1モデル分のレート制限（トークンバケットとAIMD並列数制御の組み合わせ）"""
+
+    def __init__(self, model: str, rpm: float, max_concurrency: int, min_concurrency: int = 1):
+        self.model = model
+        self.bucket = TokenBucket(rate_per_sec=rpm / 60.0, capacity=min(rpm, max_concurrency))
+        self.concurrency = AdaptiveConcurrencyLimiter(max_concurrency, min_concurrency)
+
+    async def acquire(self) -> None:
+        """リクエスト送信枠を非同期に確保する"""
+        while not self.concurrency.try_acquire():
+            await asyncio.sleep(_POLL_INTERVAL)
+        wait = self.bucket.reserve()
+        if wait > 0:
+            logger.debug(f"Rate limiter[{self.model}] waiting {wait:.2f}s")
+            try:
+                await asyncio.sleep(wait)
+            except BaseException:
+                # 送信前にキャンセルされた場合は確保した枠を返す
+                self.concurrency.cancel()
+                raise
+
+    def acquire_sync(self) -> None:
+        """リクエスト送信枠を同期的に確保する（同期API用）"""
+        while not self.concurrency.try_acquire():
+            time.sleep(_POLL_INTERVAL)
+        wait = self.bucket.reserve()
+        if wait > 0:
+            logger.debug(f"Rate limiter[{self.model}] waiting {wait:.2f}s")
+            try:
+                time.sleep(wait)
+            except BaseException:
+                self.concurrency.cancel()
+                raise
+
+    def release(self, throttled: bool = False, retry_after: Optional[float] = None) -> None:
+        """送信枠を返却する。429の場合は retry_after 秒（省略時は1秒）新規送信を止める"""
+        self.concurrency.release(throttled=throttled)
+        if throttled:
+            self.bucket.block_for(retry_after if retry_after is not None else 1.0)
+
+    def cancel(self) -> None:
+        """キャンセルされた呼び出しの送信枠を返却する（429扱いにせず、上限も調整しない）"""
+        self.concurrency.cancel()
+
+
+_limiters: Dict[str, ModelRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _rate_limit_config(model: str) -> Dict[str, Any]:
+    """モデル別のレート制限設定を返す（モデル名 → default → 組み込み既定値の順で適用）"""
+    rate_limits = config_manager.get_config().get('rate_limits', {})
+    return {**DEFAULT_RATE_LIMIT_CONFIG, **rate_limits.get('default', {}), **rate_limits.get(model, {})}
+
+
+def get_rate_limiter(model: str) -> ModelRateLimiter:
+    """モデル名に対応する共有レートリミッタを返す"""
+    with _limiters_lock:
+        limiter = _limiters.get(model)
+        if limiter is None:
+            cfg = _rate_limit_config(model)
+            limiter = ModelRateLimiter(
+                model,
+                rpm=float(cfg['rpm']),
+                max_concurrency=int(cfg['max_concurrency']),
+                min_concurrency=int(cfg['min_concurrency'])
+            )
+            _limiters[model] = limiter
+            logger.info(f"Rate limiter created for {model}: {cfg}")
+        return limiter
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+apply_rule の構造化出力用レスポンススキーマ
+ルールの出力ヘッダーから JSON スキーマを組み立て、generate_content の response_schema に渡す
+（モデル側で出力形式が保証されるため、前後の説明文や壊れたJSONによるエラーがなくなる）
+"""
+
+from typing import Any, Dict, List, Optional
+
+# 構造化出力の設定（config.json の structured_output で上書き可能）
+DEFAULT_STRUCTURED_OUTPUT_CONFIG = {
+    "enabled": True,
+}
+
+# バッチ処理で元の値の番号を入れるキー（出力ヘッダーと重なる場合は先頭に "_" を足して避ける）
+BATCH_INDEX_KEY = "__row_index"
+
+
+def _field_properties(headers: List[str], descriptions: Optional[Dict[str, str]]) -> Dict[str, Dict[str, Any]]:
+    descriptions = descriptions or {}
+    properties: Dict[str, Dict[str, Any]] = {}
+    for header in headers:
+        prop: Dict[str, Any] = {"type": "STRING"}
+        if descriptions.get(header):
+            prop["description"] = descriptions[header]
+        properties[header] = prop
+    return properties
+
+
+def build_row_schema(headers: List[str], descriptions: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """1行分の出力（各出力ヘッダーを文字列で持つオブジェクト）のスキーマ"""
+    headers = list(dict.fromkeys(headers))
+    return {
+        "type": "OBJECT",
+        "properties": _field_properties(headers, descriptions),
+        "required": headers,
+        "property_ordering": headers,
+    }
+
+
+def batch_index_key(headers: List[str]) -> str:
+    """出力ヘッダーのどれとも重ならない、元の値の番号用のキー"""
+    key = BATCH_INDEX_KEY
+    while key in headers:
+        key = f"_{key}"
+    return key
+
+
+def build_batch_schema(headers: List[str], descriptions: Optional[Dict[str, str]] = None,
+                       index_key: Optional[str] = None) -> Dict[str, Any]:
+    """バッチ処理の出力（元の値の番号と各出力ヘッダーを持つオブジェクトの配列）のスキーマ"""
+    headers = list(dict.fromkeys(headers))
+    index_key = index_key or batch_index_key(headers)
+    properties = {index_key: {"type": "INTEGER"}, **_field_properties(headers, descriptions)}
+    return {
+        "type": "ARRAY",
+        "items": {
+            "type": "OBJECT",
+            "properties": properties,
+            "required": [index_key] + headers,
+            "property_ordering": [index_key] + headers,
+        },
+    }
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+ルール適用結果の永続キャッシュ（SQLite単一ファイル）
+同じファイルを使うキャッシュ（結果・アップロード・ルール生成）は1つの接続を共有する
+イベントループ上からは a* メソッドで別スレッドから読み書きする
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_FILE_NAME = 'result_cache.sqlite3'
+
+# キャッシュ設定のデフォルト値（config.json の result_cache で上書き可能）
+DEFAULT_RESULT_CACHE_CONFIG = {
+    "enabled": True,
+    "max_entries": 100000,  # 保持する最大件数（超過分は最終利用が古い順に削除）
+    "max_age_days": 90,     # この日数より前に作成されたエントリは削除
+}
+
+# SQLiteファイルのパス → (共有接続, 接続を保護するロック)
+_connections: Dict[str, Tuple[sqlite3.Connection, threading.Lock]] = {}
+_connections_lock = threading.Lock()
+
+
+def _shared_connection(db_path: str) -> Tuple[sqlite3.Connection, threading.Lock]:
+    """SQLiteファイルごとの共有接続を返す（初回のみ接続する）"""
+    path = os.path.abspath(db_path)
+    with _connections_lock:
+        shared = _connections.get(path)
+        if shared is None:
+            shared = (sqlite3.connect(path, check_same_thread=False), threading.Lock())
+            _connections[path] = shared
+        return shared
+
+
+class ResultCache:
+    """キー文字列 → JSON値 を保存するSQLiteキャッシュ（サイズ・期限による削除付き）"""
+
+    def __init__(self, db_path: str, max_entries: int = DEFAULT_RESULT_CACHE_CONFIG["max_entries"],
+                 max_age_days: float = DEFAULT_RESULT_CACHE_CONFIG["max_age_days"], table: str = "results"):
+        """
+        Args:
+            db_path: SQLiteファイルのパス
+            max_entries: 保持する最大件数
+            max_age_days: エントリの有効日数
+            table: 使用するテーブル名
+        """
+        self.db_path = db_path
+        self.max_entries = int(max_entries)
+        self.max_age_days = float(max_age_days)
+        self.table = table
+        self._conn, self._lock = _shared_connection(db_path)
+        with self._lock:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_last_used ON {self.table}(last_used)")
+            self._conn.commit()
+        logger.debug(f"ResultCache opened: {db_path} table={table}")
+        self.evict()
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """任意の値の組からキャッシュキー（SHA-256）を生成"""
+        raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """キャッシュを参照し、期限内ならその値を返す（なければNone）"""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """複数のキーをまとめて参照し、期限内のものを {キー: 値} で返す
+        ヒットしたエントリの最終利用時刻は1回の更新・コミットでまとめて記録する
+        """
+        now = time.time()
+        found: Dict[str, Any] = {}
+        corrupted: List[str] = []
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                row = self._conn.execute(
+                    f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None or now - row[1] > self.max_age_days * 86400:
+                    continue
+                try:
+                    found[key] = json.loads(row[0])
+                except json.JSONDecodeError:
+                    logger.warning(f"Corrupted cache entry removed: {key}")
+                    corrupted.append(key)
+            if found or corrupted:
+                self._conn.executemany(f"UPDATE {self.table} SET last_used = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+                self._conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", [(key,) for key in corrupted])
+                self._conn.commit()
+        return found
+
+    def put(self, key: str, value: Any) -> None:
+        """値をキャッシュに保存する"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        """指定キーのエントリを削除する"""
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def evict(self) -> int:
+        """期限切れエントリと上限超過分を削除し、削除件数を返す"""
+        cutoff = time.time() - self.max_age_days * 86400
+        with self._lock:
+            removed = self._conn.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (cutoff,)).rowcount
+            count = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+            if count > self.max_entries:
+                removed += self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN "
+                    f"(SELECT key FROM {self.table} ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                ).rowcount
+            self._conn.commit()
+        if removed:
+            logger.info(f"ResultCache evicted {removed} entries from {self.table}")
+        return removed
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """get を別スレッドで実行する（イベントループを塞がない）"""
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, value: Any) -> None:
+        """put を別スレッドで実行する"""
+        await asyncio.to_thread(self.put, key, value)
+
+    async def adelete(self, key: str) -> None:
+        """delete を別スレッドで実行する"""
+        await asyncio.to_thread(self.delete, key)
+
+    async def aevict(self) -> int:
+        """evict を別スレッドで実行する"""
+        return await asyncio.to_thread(self.evict)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Gemini API 呼び出しの共通リトライポリシー
+エラーを再試行可能/致命的に分類し、指数バックオフ＋ジッター、サーバー指定の待機時間、
+行ごとのリトライ予算を適用する
+"""
+
+import contextlib
+import contextvars
+import logging
+import random
+import re
+from typing import Any, Dict, Iterator, Optional
+
+from utils.config import config_manager
+
+logger = logging.getLogger(__name__)
+
+# リトライ設定のデフォルト値（config.json の retry で上書き可能）
+DEFAULT_RETRY_CONFIG = {
+    "max_attempts": 4,       # 1回の呼び出しあたりの最大試行回数
+    "base_delay": 1.0,       # バックオフの初期待機時間（秒）
+    "max_delay": 60.0,       # バックオフの最大待機時間（秒）
+    "row_retry_budget": 8,   # 1行の処理全体で許容する再試行回数
+}
+
+# 再試行するHTTPステータスコード
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# 再試行するエラーの状態名
+RETRYABLE_STATUS_NAMES = {"RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED", "INTERNAL", "ABORTED"}
+
+
+class RetryPolicy:
+    """指数バックオフ＋ジッターによる再試行ポリシー"""
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float):
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = max(0.0, float(base_delay))
+        self.max_delay = max(self.base_delay, float(max_delay))
+
+    @classmethod
+    def from_config(cls) -> 'RetryPolicy':
+        """config.json の retry 設定からポリシーを生成"""
+        cfg = {**DEFAULT_RETRY_CONFIG, **config_manager.get_config().get('retry', {})}
+        return cls(cfg['max_attempts'], cfg['base_delay'], cfg['max_delay'])
+
+    def compute_delay(self, attempt: int, error: Optional[Exception] = None) -> float:
+        """
+        attempt 回目（1始まり）の失敗後に待つ秒数を返す
+        サーバーが待機時間を指定している場合はそれを優先する
+        """
+        server_delay = server_retry_delay(error) if error is not None else None
+        if server_delay is not None:
+            return min(server_delay, self.max_delay * 5)
+        cap = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        # equal jitter: 待機時間の半分は固定、残り半分をランダムにする
+        return cap / 2 + random.uniform(0, cap / 2)
+
+
+class RetryBudget:
+    """1行の処理全体で共有する再試行予算と試行回数"""
+
+    def __init__(self, max_retries: int):
+        self.max_retries = max(0, int(max_retries))
+        self.retries = 0
+        self.attempts = 0
+
+    def record_attempt(self) -> None:
+        """API呼び出しを1回行ったことを記録"""
+        self.attempts += 1
+
+    def try_consume(self) -> bool:
+        """再試行を1回分消費できればTrueを返す"""
+        if self.retries >= self.max_retries:
+            return False
+        self.retries += 1
+        return True
+
+
+_current_budget: contextvars.ContextVar[Optional[RetryBudget]] = contextvars.ContextVar('retry_budget', default=None)
+
+
+@contextlib.contextmanager
+def retry_budget(max_retries: Optional[int] = None) -> Iterator[RetryBudget]:
+    """
+    この with ブロック内の API 呼び出しで共有する再試行予算を設定する
+    contextvars で伝播するため、ブロック内で生成したタスクやスレッドにも引き継がれる
+    """
+    budget = new_retry_budget() if max_retries is None else RetryBudget(max_retries)
+    with use_retry_budget(budget):
+        yield budget
+
+
+@contextlib.contextmanager
+def use_retry_budget(budget: RetryBudget) -> Iterator[RetryBudget]:
+    """既存の再試行予算をこの with ブロック内で有効にする（複数の段階に分かれた処理で1行の予算を共有する場合）"""
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
+
+
+def new_retry_budget() -> RetryBudget:
+    """config.json の row_retry_budget に従った新しい再試行予算を返す"""
+    cfg = {**DEFAULT_RETRY_CONFIG, **config_manager.get_config().get('retry', {})}
+    return RetryBudget(cfg['row_retry_budget'])
+
+
+def current_budget() -> Optional[RetryBudget]:
+    """現在のコンテキストの再試行予算を返す（未設定ならNone）"""
+    return _current_budget.get()
+
+
+def _error_status(error: Exception) -> Dict[str, Any]:
+    """例外からHTTPステータスコードと状態名を取り出す"""
+    code = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+    status = getattr(error, 'status', None)
+    response = getattr(error, 'response', None)
+    if code is None and response is not None:
+        code = getattr(response, 'status_code', None)
+    return {"code": code if isinstance(code, int) else None, "status": str(status or "").upper()}
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """再試行で回復し得るエラーかどうかを判定する"""
+    if isinstance(error, (FileNotFoundError, PermissionError, ValueError, TypeError, NotImplementedError)):
+        return False
+    info = _error_status(error)
+    if info["code"] is not None:
+        return info["code"] in RETRYABLE_STATUS_CODES
+    if info["status"] in RETRYABLE_STATUS_NAMES:
+        return True
+    # ネットワーク系の例外はクラス名で判定（httpx / requests / 標準ライブラリ）
+    name = type(error).__name__
+    if any(k in name for k in ("Timeout", "Connect", "Network", "RemoteProtocol", "ReadError")):
+        return True
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    text = str(error).upper()
+    return any(s in text for s in RETRYABLE_STATUS_NAMES) or "429" in text or "503" in text
+
+
+def _parse_duration(value: Any) -> Optional[float]:
+    """'17s' / '1.5s' / 数値 形式の待機時間を秒に変換"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.match(r"^\s*([0-9]+(?:\.[0-9]+)?)\s*s?\s*$", str(value))
+    return float(match.group(1)) if match else None
+
+
+def server_retry_delay(error: Exception) -> Optional[float]:
+    """エラーレスポンスの RetryInfo.retryDelay または Retry-After ヘッダーから待機秒数を取り出す"""
+    details = getattr(error, 'details', None)
+    if isinstance(details, dict):
+        items = details.get('error', {}).get('details', []) or []
+        for item in items:
+            if isinstance(item, dict) and 'RetryInfo' in str(item.get('@type', '')):
+                delay = _parse_duration(item.get('retryDelay'))
+                if delay is not None:
+                    return delay
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers is not None:
+        try:
+            return _parse_duration(headers.get('retry-after') or headers.get('Retry-After'))
+        except Exception:
+            return None
+    return None
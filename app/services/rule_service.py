@@ -2,19 +2,50 @@ import os
 import json
 import logging
 import re
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
 from datetime import datetime
 import sys
 import shutil
 from pathlib import Path
 import time
 import asyncio
+import hashlib
 
 from utils.config import config_manager
-from .gemini_api import GeminiAPI, GeminiAPIError
+from utils.file_hash import file_content_hash
+from .gemini_api import GeminiAPI, GeminiAPIError, DEFAULT_UPLOAD_CACHE_CONFIG
+from .scheduler import RowScheduler, RunControl, DEFAULT_MAX_CONCURRENCY
+from .media_pipeline import MediaPipeline, MediaJob, DEFAULT_MEDIA_PIPELINE_CONFIG
+from .image_preprocess import ImagePreprocessor, IMAGE_CACHE_DIR_NAME
+from .video_segmenter import VideoSegmenter, VIDEO_SEGMENT_DIR_NAME
+from .audio_preprocess import AudioPreprocessor, AUDIO_CACHE_DIR_NAME
+from .retry_policy import retry_budget
+from .context_cache import CachePrefix, ContextCacheManager, estimate_tokens
+from .fewshot_index import FewShotIndex, load_fewshot_config
+from .response_schema import build_row_schema, build_batch_schema, batch_index_key, DEFAULT_STRUCTURED_OUTPUT_CONFIG
+from .result_cache import ResultCache, RESULT_CACHE_FILE_NAME, DEFAULT_RESULT_CACHE_CONFIG
 
 logger = logging.getLogger(__name__)
 
+# テキストモードのバッチ処理設定のデフォルト値（config.json の text_batch で上書き可能）
+DEFAULT_TEXT_BATCH_CONFIG = {
+    "enabled": True,
+    "max_rows": 20,        # 1リクエストにまとめる最大行数
+    "token_budget": 4000,  # 1リクエストあたりの入力トークン概算上限
+}
+
+# ルール生成の方式（combined: プロンプト・タイトル・項目説明を1回の呼び出しで生成する）
+DEFAULT_RULE_SYNTHESIS_CONFIG = {
+    "combined": True,
+}
+
+# ルール生成の各段階（プロンプト・タイトル・サンプル解析）のメモ化設定（config.json の rule_cache で上書き可能）
+DEFAULT_RULE_CACHE_CONFIG = {
+    "enabled": True,
+    "max_entries": 5000,
+    "max_age_days": 30,
+}
+
 class ProcessMode:
     """処理モード定義"""
     NORMAL = "normal"      # テキスト処理
@@ -51,6 +82,96 @@ class RuleService:
             self.rules_path = rules_path or default_path
         self._load_rules()
         self.gemini = GeminiAPI()
+        self.result_cache = self._open_result_cache()
+        self.gemini.upload_cache = self._open_upload_cache()
+        # ルール生成の段階ごとの結果と、メディアサンプルの解析結果（ファイル内容ハッシュ単位）
+        self.rule_cache = self._open_rule_cache("rule_phases")
+        self.sample_cache = self._open_rule_cache("sample_descriptions")
+        self.gemini.image_preprocessor = ImagePreprocessor.from_config(
+            os.path.join(os.path.dirname(os.path.abspath(self.rules_path)), IMAGE_CACHE_DIR_NAME)
+        )
+        self.gemini.video_segmenter = VideoSegmenter.from_config(
+            os.path.join(os.path.dirname(os.path.abspath(self.rules_path)), VIDEO_SEGMENT_DIR_NAME)
+        )
+        self.gemini.audio_preprocessor = AudioPreprocessor.from_config(
+            os.path.join(os.path.dirname(os.path.abspath(self.rules_path)), AUDIO_CACHE_DIR_NAME)
+        )
+        # ルールプレフィックスのコンテキストキャッシュ（update/regenerate/delete で破棄）
+        self.gemini.context_cache = ContextCacheManager.from_config(self.gemini)
+        # ルールID → サンプル照合用インデックス（update/regenerate/delete で破棄）
+        self._sample_indexes: Dict[int, Dict[str, Dict[str, List[str]]]] = {}
+        # ルールID → few-shot 例を選ぶための類似度インデックス（サンプル照合用インデックスと同時に破棄）
+        self._fewshot_indexes: Dict[int, Optional[Dict[str, Any]]] = {}
+
+    def _open_result_cache(self) -> Optional[ResultCache]:
+        """ルール適用結果の永続キャッシュを開く（無効設定・失敗時はNone）"""
+        cache_config = {**DEFAULT_RESULT_CACHE_CONFIG, **config_manager.get_config().get('result_cache', {})}
+        if not cache_config.get('enabled'):
+            logger.info("Result cache is disabled by config.")
+            return None
+        cache_path = os.path.join(os.path.dirname(os.path.abspath(self.rules_path)), RESULT_CACHE_FILE_NAME)
+        try:
+            return ResultCache(
+                cache_path,
+                max_entries=cache_config.get('max_entries'),
+                max_age_days=cache_config.get('max_age_days')
+            )
+        except Exception as e:
+            logger.error(f"Failed to open result cache {cache_path}: {e}")
+            return None
+
+    def _open_upload_cache(self) -> Optional[ResultCache]:
+        """アップロード済みメディアファイルの再利用キャッシュを開く（無効設定・失敗時はNone）"""
+        cache_config = {**DEFAULT_UPLOAD_CACHE_CONFIG, **config_manager.get_config().get('upload_cache', {})}
+        if not cache_config.get('enabled'):
+            logger.info("Upload cache is disabled by config.")
+            return None
+        cache_path = os.path.join(os.path.dirname(os.path.abspath(self.rules_path)), RESULT_CACHE_FILE_NAME)
+        try:
+            return ResultCache(
+                cache_path,
+                max_entries=cache_config.get('max_entries'),
+                max_age_days=float(cache_config.get('ttl_hours')) / 24,
+                table="uploads"
+            )
+        except Exception as e:
+            logger.error(f"Failed to open upload cache {cache_path}: {e}")
+            return None
+
+    def _open_rule_cache(self, table: str) -> Optional[ResultCache]:
+        """ルール生成のメモ化キャッシュを開く（無効設定・失敗時はNone）"""
+        cache_config = {**DEFAULT_RULE_CACHE_CONFIG, **config_manager.get_config().get('rule_cache', {})}
+        if not cache_config.get('enabled'):
+            logger.info(f"Rule cache ({table}) is disabled by config.")
+            return None
+        cache_path = os.path.join(os.path.dirname(os.path.abspath(self.rules_path)), RESULT_CACHE_FILE_NAME)
+        try:
+            return ResultCache(
+                cache_path,
+                max_entries=cache_config.get('max_entries'),
+                max_age_days=cache_config.get('max_age_days'),
+                table=table
+            )
+        except Exception as e:
+            logger.error(f"Failed to open rule cache {cache_path} ({table}): {e}")
+            return None
+
+    async def _memoized_phase(self, cache: Optional[ResultCache], phase: str, parts: List[Any],
+                              compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        ルール生成の1段階を入力のハッシュでメモ化して実行する
+        入力（parts）が同じなら前回の結果を返し、空の結果（失敗）は保存しない
+        """
+        key = cache.make_key(phase, *parts) if cache is not None else None
+        if key is not None:
+            cached = await cache.aget(key)
+            if cached is not None:
+                logger.info(f"♻️ ルール生成キャッシュを使用: {phase}")
+                return cached
+        value = await compute()
+        if key is not None and value:
+            await cache.aput(key, value)
+        return value
 
     def _load_rules(self) -> None:
         """ローカルストレージからルール一覧を読み込む"""
@@ -132,8 +253,8 @@ class RuleService:
         example_map = {header: "" for header in output_headers}
         return example_map
 
-    def _generate_text_rule_prompt(self, samples: List[Dict[str, Any]], fields: List[str]) -> str:
-        """テキストモード用のルールプロンプト生成"""
+    def _text_rule_instructions(self, samples: List[Dict[str, Any]], fields: List[str]) -> List[str]:
+        """テキストモード用のルール生成指示（返答形式の指定を除く）"""
         prompt_instructions = []
         # ヘッダー説明
         field_list = "、".join(fields)
@@ -155,104 +276,78 @@ class RuleService:
         prompt_instructions.append("\n生成するプロンプトの要件:")
         prompt_instructions.append("* 提示された例だけでなく、他の同様の入力に対しても適用できるような、汎用的な指示にしてください。")
         prompt_instructions.append("* プロンプトは、AIに対する指示として機能する、端的で短い文章にまとめること。返答例は別途添付するためここでは端的な表現を心がけること")
-        # JSON形式で出力させ、promptキーの値を取得する指示を追加
-        prompt_instructions.append("返答はJSON形式で {\"prompt\": \"<プロンプト>\"} のみを返し、他の文言を含めないでください。")
-        # AIに送信するプロンプト全文をログ出力する
-        prompt_content = "\n".join(prompt_instructions)
-        logger.info(f"★aiに送った全文だよ★\n{prompt_content}")
+        return prompt_instructions
+
+    async def _analyze_media_sample(self, idx: int, total: int, sample: Dict[str, Any],
+                                    analysis_prompt: str, mode: str) -> Dict[str, Any]:
+        """ルール生成用にサンプルのメディアファイル1件を解析する（失敗時はファイル名のみの例を返す）"""
+        file_path = sample.get('input', '')
+        expected_outputs = sample.get('output', {})
+        
+        logger.info(f"🔍 Analyzing sample {idx+1}/{total}: {file_path}")
         
         try:
-            logger.info("Generating rule prompt via Gemini API (JSON format)...")
-            resp1 = self.gemini.client.models.generate_content(
-                model=self.gemini.transcription_model,
-                contents=prompt_content
+            # ファイルパスの検証
+            file_path_obj = Path(file_path)
+            if not file_path_obj.exists():
+                logger.warning(f"⚠️ Sample file not found: {file_path}, using filename only")
+                return {
+                    'input_description': f"ファイル名: {file_path}",
+                    'outputs': expected_outputs
+                }
+            
+            # ファイルサイズ情報をログに出力
+            file_size = file_path_obj.stat().st_size / (1024 * 1024)  # MB
+            logger.info(f"📁 File size: {file_size:.2f} MB")
+            logger.info(f"🚀 Starting {mode} analysis via Gemini API...")
+            
+            # モードに応じて解析APIを呼び出し（非同期）。同じ内容のファイルは前回の解析結果を再利用する
+            analysis_start_time = time.time()
+            content_hash = await asyncio.to_thread(file_content_hash, file_path)
+            parts = [mode, self.gemini.transcription_model, content_hash or file_path, analysis_prompt]
+            analysis_result = await self._memoized_phase(
+                self.sample_cache if content_hash else None, "sample_description", parts,
+                lambda: self.gemini.analyze_media(file_path, analysis_prompt, mode)
             )
-            text = resp1.text.strip()
-            # コードブロックや余分な記号を除去
-            if text.startswith("```"):
-                text = re.sub(r"```(?:json)?\\n?", "", text)
-                text = text.rstrip("`\\n ")
-            # JSON部分を抽出してパース
-            start = text.find("{")
-            end = text.rfind("}")
-            json_str = text[start:end+1] if start != -1 and end != -1 else text
-            try:
-                data = json.loads(json_str)
-                rule_prompt = data.get("prompt", "").strip()
-                logger.info(f"Parsed rule prompt from JSON: {rule_prompt}")
-                return rule_prompt
-            except Exception as e:
-                logger.error(f"プロンプトJSONパースエラー: {e}, raw text: '{text}'")
-                return ""
+            
+            analysis_time = time.time() - analysis_start_time
+            logger.info(f"✅ Analysis of sample {idx+1} completed in {analysis_time:.2f} seconds")
+            logger.debug(f"📝 Analysis result for {file_path}: {analysis_result[:100]}...")
+            
+            return {
+                'input_description': f"ファイル内容: {analysis_result[:200]}..." if len(analysis_result) > 200 else f"ファイル内容: {analysis_result}",
+                'outputs': expected_outputs
+            }
+            
         except Exception as e:
-            logger.error(f"プロンプト生成エラー: {e}")
-            return ""
+            logger.error(f"❌ Failed to analyze media file {file_path}: {e}")
+            # エラーの場合はファイル名のみを使用
+            return {
+                'input_description': f"ファイル名: {file_path} (解析エラー: {e})",
+                'outputs': expected_outputs
+            }
 
-    async def _generate_media_rule_prompt(self, samples: List[Dict[str, Any]], fields: List[str], mode: str) -> str:
-        """画像・動画モード用のルールプロンプト生成（非同期版）"""
+    async def _media_rule_instructions(self, samples: List[Dict[str, Any]], fields: List[str], mode: str) -> List[str]:
+        """画像・動画・音声モード用のルール生成指示（サンプルを解析して作成。返答形式の指定を除く）"""
         logger.info(f"🎬 Starting media rule prompt generation for mode: {mode}")
         logger.info(f"📊 Input samples count: {len(samples)}, Fields: {fields}")
         
         # フィールドリストを作成
         field_list = "、".join(fields)
         
-        # 実際のメディアファイル解析結果を含む例を生成
-        analyzed_examples = []
-        
-        for idx, sample in enumerate(samples):
-            file_path = sample.get('input', '')
-            expected_outputs = sample.get('output', {})
-            
-            logger.info(f"🔍 Analyzing sample {idx+1}/{len(samples)}: {file_path}")
-            
-            try:
-                # ファイルパスの検証
-                file_path_obj = Path(file_path)
-                if not file_path_obj.exists():
-                    logger.warning(f"⚠️ Sample file not found: {file_path}, using filename only")
-                    analyzed_examples.append({
-                        'input_description': f"ファイル名: {file_path}",
-                        'outputs': expected_outputs
-                    })
-                    continue
-                
-                # ファイルサイズ情報をログに出力
-                file_size = file_path_obj.stat().st_size / (1024 * 1024)  # MB
-                logger.info(f"📁 File size: {file_size:.2f} MB")
-                
-                # メディアファイルを解析
-                analysis_prompt = f"このファイルの内容を詳しく説明してください。特に以下の観点から分析してください：\n"
-                for field in fields:
-                    analysis_prompt += f"- {field}に関連する要素\n"
-                
-                logger.debug(f"🤖 Media analysis prompt: {analysis_prompt}")
-                logger.info(f"🚀 Starting {mode} analysis via Gemini API...")
-                
-                # モードに応じて解析APIを呼び出し（非同期）
-                analysis_start_time = time.time()
-                if mode == ProcessMode.IMAGE:
-                    analysis_result = await self.gemini.analyze_image(file_path, analysis_prompt)
-                elif mode == ProcessMode.VIDEO:
-                    analysis_result = await self.gemini.analyze_video(file_path, analysis_prompt)
-                else:  # AUDIO
-                    analysis_result = await self.gemini.analyze_audio(file_path, analysis_prompt)
-                
-                analysis_time = time.time() - analysis_start_time
-                logger.info(f"✅ Analysis completed in {analysis_time:.2f} seconds")
-                logger.debug(f"📝 Analysis result for {file_path}: {analysis_result[:100]}...")
-                
-                analyzed_examples.append({
-                    'input_description': f"ファイル内容: {analysis_result[:200]}..." if len(analysis_result) > 200 else f"ファイル内容: {analysis_result}",
-                    'outputs': expected_outputs
-                })
-                
-            except Exception as e:
-                logger.error(f"❌ Failed to analyze media file {file_path}: {e}")
-                # エラーの場合はファイル名のみを使用
-                analyzed_examples.append({
-                    'input_description': f"ファイル名: {file_path} (解析エラー: {e})",
-                    'outputs': expected_outputs
-                })
+        # 実際のメディアファイル解析結果を含む例を生成（各サンプルは max_concurrency を上限に並列解析）
+        analysis_prompt = "このファイルの内容を詳しく説明してください。特に以下の観点から分析してください：\n"
+        for field in fields:
+            analysis_prompt += f"- {field}に関連する要素\n"
+        logger.debug(f"🤖 Media analysis prompt: {analysis_prompt}")
+
+        async def _analyze(idx: int, sample: Dict[str, Any]) -> Dict[str, Any]:
+            return await self._analyze_media_sample(idx, len(samples), sample, analysis_prompt, mode)
+
+        scheduler = RowScheduler(config_manager.get_config().get('max_concurrency', DEFAULT_MAX_CONCURRENCY))
+        samples_start_time = time.time()
+        analyzed_examples = await scheduler.run(samples, _analyze)
+        logger.info(f"⏱️ Sample analysis completed in {time.time() - samples_start_time:.2f} seconds")
         
         logger.info(f"📋 Successfully analyzed {len([ex for ex in analyzed_examples if '解析エラー' not in ex['input_description']])}/{len(samples)} samples")
         
@@ -260,12 +355,7 @@ class RuleService:
         prompt_instructions = []
         
         # ヘッダー説明（メディアファイル用）
-        if mode == ProcessMode.IMAGE:
-            media_type_name = "画像"
-        elif mode == ProcessMode.VIDEO:
-            media_type_name = "動画"
-        else:  # AUDIO
-            media_type_name = "音声"
+        media_type_name = self._media_type_name(mode)
         prompt_instructions.append(
             f"以下に示すのは、{media_type_name}ファイルの解析内容（「元の値」）と、それに対して特定の処理を行った結果得られた複数の出力項目（{field_list}）の具体例です。\n"
         )
@@ -290,84 +380,100 @@ class RuleService:
         prompt_instructions.append(f"* {media_type_name}ファイルの内容を解析して指定された項目を抽出する汎用的な指示にしてください。")
         prompt_instructions.append("* プロンプトは、AIに対する指示として機能する、端的で短い文章にまとめること。")
         prompt_instructions.append(f"* {media_type_name}解析に特化した指示内容にしてください。")
-        
-        # JSON形式で出力させる指示
-        prompt_instructions.append("返答はJSON形式で {\"prompt\": \"<プロンプト>\"} のみを返し、他の文言を含めないでください。")
-        
-        # AIに送信するプロンプト全文をログ出力
-        prompt_content = "\n".join(prompt_instructions)
-        logger.info(f"★{media_type_name}モード用aiに送った全文だよ★\n{prompt_content}")
-        
+        return prompt_instructions
+
+    @staticmethod
+    def _media_type_name(mode: str) -> str:
+        """ログ・指示文に使うモードの表示名"""
+        if mode == ProcessMode.IMAGE:
+            return "画像"
+        if mode == ProcessMode.VIDEO:
+            return "動画"
+        if mode == ProcessMode.AUDIO:
+            return "音声"
+        return "テキスト"
+
+    async def _generate_rule_prompt(self, instructions: List[str], mode: str) -> str:
+        """ルール生成指示からプロンプトだけをAIに生成させる（入力が同じなら前回の結果を再利用）"""
+        # JSON形式で出力させ、promptキーの値を取得する指示を追加
+        prompt_content = "\n".join(instructions + [
+            "返答はJSON形式で {\"prompt\": \"<プロンプト>\"} のみを返し、他の文言を含めないでください。"
+        ])
+        # AIに送信するプロンプト全文をログ出力する
+        logger.info(f"★{self._media_type_name(mode)}モード用aiに送った全文だよ★\n{prompt_content}")
+        return await self._memoized_phase(
+            self.rule_cache, "rule_prompt", [self.gemini.transcription_model, prompt_content],
+            lambda: self._request_rule_prompt(prompt_content, self._media_type_name(mode))
+        )
+
+    async def _request_rule_prompt(self, prompt_content: str, mode_name: str) -> str:
+        """ルールプロンプトをAIに生成させる（失敗時は空文字）"""
         try:
-            logger.info(f"🤖 Generating {media_type_name} rule prompt via Gemini API...")
+            logger.info(f"🤖 Generating {mode_name} rule prompt via Gemini API...")
             rule_generation_start = time.time()
-            resp = self.gemini.client.models.generate_content(
+            resp = await self.gemini.generate_content_async(
                 model=self.gemini.transcription_model,
                 contents=prompt_content
             )
             rule_generation_time = time.time() - rule_generation_start
             logger.info(f"⏱️ Rule prompt generation completed in {rule_generation_time:.2f} seconds")
             
-            text = resp.text.strip()
-            logger.debug(f"📄 Raw response: {text[:100]}...")
-            
-            # コードブロック除去とJSON解析
-            if text.startswith("```"):
-                text = re.sub(r"```(?:json)?\\n?", "", text)
-                text = text.rstrip("`\\n ")
-            
-            start = text.find("{")
-            end = text.rfind("}")
-            json_str = text[start:end+1] if start != -1 and end != -1 else text
-            
-            try:
-                data = json.loads(json_str)
-                rule_prompt = data.get("prompt", "").strip()
-                logger.info(f"✅ Generated {media_type_name} rule prompt: {rule_prompt}")
-                return rule_prompt
-            except Exception as e:
-                logger.error(f"❌ {media_type_name}プロンプトJSONパースエラー: {e}, raw text: '{text}'")
-                return ""
-                
+            data = self._parse_json_response(resp.text)
+            rule_prompt = str(data.get("prompt", "")).strip()
+            logger.info(f"✅ Generated {mode_name} rule prompt: {rule_prompt}")
+            return rule_prompt
         except Exception as e:
-            logger.error(f"❌ {media_type_name}プロンプト生成エラー: {e}")
+            logger.error(f"❌ {mode_name}プロンプト生成エラー: {e}")
             return ""
 
-    async def create_rule(self, samples: List[Dict[str, Any]], mode: str = ProcessMode.NORMAL) -> Dict[str, Any]:
+    async def _synthesize_rule(self, instructions: List[str], fields: List[str], mode: str) -> Dict[str, Any]:
         """
-        新規ルールをAIに生成させ、ローカルに保存 (3ステップ：prompt/json例/title)
-        引数 samples: [{"input": str, "output": Dict[str,str], "fields": List[str]}]
-        引数 mode: 処理モード（ProcessMode定数）
-        戻り値: metadata dict (rule_name, etc.)
+        ルール生成指示から、プロンプト・ルール名・項目ごとの説明を1回の呼び出しでAIに生成させる
+        入力が同じなら前回の結果を再利用する。失敗時・プロンプトが空の場合は空dictを返す
         """
-        # --- 入力サンプルをテーブル形式で構築 ---
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        # fields に空文字が含まれている場合は除外する
-        fields = [f for f in samples[0].get('fields', []) if f] if samples else []
-        headers_init = ["AIの進捗", "元の値"] + fields
-        # AIの進捗欄は空文字とし、上部パネルでは値を表示しない
-        rows_init = [["", s.get('input','')] + [s.get('output',{}).get(f,'') for f in fields] for s in samples]
-        sample_data = {"headers": headers_init, "rows": rows_init}
-        logger.debug(f"Generated sample_data: {sample_data}")
-
-        # --- Phase1: 動的プロンプト生成（モード別対応） ---
-        logger.info(f"Starting rule creation for mode: {mode}")
-        
-        if mode in [ProcessMode.IMAGE, ProcessMode.VIDEO, ProcessMode.AUDIO]:
-            # 画像・動画・音声モードの場合：実際のファイル内容を解析してプロンプト生成
-            logger.info(f"Processing {mode} mode rule creation with file analysis")
-            rule_prompt = await self._generate_media_rule_prompt(samples, fields, mode)
-        else:
-            # テキストモードの場合：従来の処理
-            logger.info("Processing normal mode rule creation")
-            rule_prompt = self._generate_text_rule_prompt(samples, fields)
+        field_example = ", ".join(f"\"{field}\": \"<{field}に出力する内容の短い説明>\"" for field in fields)
+        prompt_content = "\n".join(instructions + [
+            "* あわせて、作成したプロンプトにふさわしい短いルール名（日本語）と、各出力項目に何を出力するかの短い説明も作成してください。",
+            "返答は次のJSON形式のみとし、他の文言を含めないでください。",
+            f"{{\"prompt\": \"<プロンプト>\", \"rule_name\": \"<ルール名>\", \"field_descriptions\": {{{field_example}}}}}"
+        ])
+        logger.info(f"★{self._media_type_name(mode)}モード用aiに送った全文だよ（一括生成）★\n{prompt_content}")
+        return await self._memoized_phase(
+            self.rule_cache, "rule_synthesis", [self.gemini.transcription_model, prompt_content],
+            lambda: self._request_rule_synthesis(prompt_content, fields)
+        )
 
-        # --- Phase2: JSONフォーマット例生成 (Pythonで実装) ---
-        logger.info("Generating json_format_example using _generate_json_example...")
-        json_format_example = self._generate_json_example(sample_data)
-        logger.debug(f"Generated json_format_example: {json_format_example}")
+    async def _request_rule_synthesis(self, prompt_content: str, fields: List[str]) -> Dict[str, Any]:
+        """一括生成の呼び出しと応答の検証（失敗時は空dict）"""
+        try:
+            logger.info("🤖 Synthesizing rule prompt, title and field descriptions via Gemini API...")
+            synthesis_start = time.time()
+            resp = await self.gemini.generate_content_async(
+                model=self.gemini.transcription_model,
+                contents=prompt_content,
+                config={"response_mime_type": "application/json"}
+            )
+            logger.info(f"⏱️ Rule synthesis completed in {time.time() - synthesis_start:.2f} seconds")
+            data = self._parse_json_response(resp.text)
+            rule_prompt = str(data.get("prompt", "")).strip()
+            if not rule_prompt:
+                logger.warning("一括生成の応答にプロンプトが含まれていません")
+                return {}
+            descriptions = data.get("field_descriptions")
+            descriptions = descriptions if isinstance(descriptions, dict) else {}
+            return {
+                "prompt": rule_prompt,
+                "rule_name": str(data.get("rule_name", "")).strip(),
+                "field_descriptions": {
+                    field: str(descriptions.get(field, "")).strip() for field in fields if descriptions.get(field)
+                },
+            }
+        except Exception as e:
+            logger.error(f"❌ ルール一括生成エラー: {e}")
+            return {}
 
-        # --- Phase3: タイトル生成 ---
+    async def _generate_rule_title(self, rule_prompt: str) -> str:
+        """ルールのプロンプトから短いルール名をAIに生成させる（解析失敗時は空文字）"""
         title_instructions = [
             "次の命令文にふさわしい短いルール名を日本語で返してください。",
             "返答は {\"rule_name\": \"<ルール名>\"} の形式で JSON のみを返し、他の文言を含めないでください。",
@@ -377,7 +483,7 @@ class RuleService:
         title_content = "\n".join(title_instructions)
         logger.info(f"★aiに送った全文だよ★\n{title_content}")
         logger.info("Generating rule title via Gemini API...")
-        resp3 = self.gemini.client.models.generate_content(
+        resp3 = await self.gemini.generate_content_async(
             model=self.gemini.title_model,
             contents=title_content
         )
@@ -394,14 +500,63 @@ class RuleService:
         json_str = text[start:end+1] if start != -1 and end != -1 else text
         try:
             data = json.loads(json_str)
-            rule_name = data.get("rule_name", "").strip()
+            return data.get("rule_name", "").strip()
         except json.JSONDecodeError:
             logger.warning("ルール名生成レスポンスのJSON解析に失敗")
-            rule_name = f"ルール_{now}"
+            return ""
+
+    async def create_rule(self, samples: List[Dict[str, Any]], mode: str = ProcessMode.NORMAL) -> Dict[str, Any]:
+        """
+        新規ルールをAIに生成させ、ローカルに保存 (prompt・title・項目説明は一括生成、失敗時は prompt→title の2段階)
+        引数 samples: [{"input": str, "output": Dict[str,str], "fields": List[str]}]
+        引数 mode: 処理モード（ProcessMode定数）
+        戻り値: metadata dict (rule_name, etc.)
+        """
+        # --- 入力サンプルをテーブル形式で構築 ---
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # fields に空文字が含まれている場合は除外する
+        fields = [f for f in samples[0].get('fields', []) if f] if samples else []
+        headers_init = ["AIの進捗", "元の値"] + fields
+        # AIの進捗欄は空文字とし、上部パネルでは値を表示しない
+        rows_init = [["", s.get('input','')] + [s.get('output',{}).get(f,'') for f in fields] for s in samples]
+        sample_data = {"headers": headers_init, "rows": rows_init}
+        logger.debug(f"Generated sample_data: {sample_data}")
+
+        # --- Phase1: ルール生成指示の作成（モード別対応） ---
+        logger.info(f"Starting rule creation for mode: {mode}")
+        
+        if mode in [ProcessMode.IMAGE, ProcessMode.VIDEO, ProcessMode.AUDIO]:
+            # 画像・動画・音声モードの場合：実際のファイル内容を解析してプロンプト生成
+            logger.info(f"Processing {mode} mode rule creation with file analysis")
+            instructions = await self._media_rule_instructions(samples, fields, mode)
+        else:
+            # テキストモードの場合：従来の処理
+            logger.info("Processing normal mode rule creation")
+            instructions = self._text_rule_instructions(samples, fields)
+
+        # --- Phase2: プロンプト・タイトル・項目説明の生成 ---
+        # 一括生成が有効なら1回の呼び出しで生成し、失敗時はプロンプト→タイトルの2段階で生成する
+        synthesis_config = {**DEFAULT_RULE_SYNTHESIS_CONFIG, **config_manager.get_config().get('rule_synthesis', {})}
+        synthesized = await self._synthesize_rule(instructions, fields, mode) if synthesis_config.get('combined') else {}
+        field_descriptions = synthesized.get("field_descriptions", {})
+        rule_prompt = synthesized.get("prompt") or await self._generate_rule_prompt(instructions, mode)
+        if synthesized.get("rule_name"):
+            rule_name = synthesized["rule_name"]
+        else:
+            # 同じプロンプトなら前回のタイトルを再利用
+            rule_name = await self._memoized_phase(
+                self.rule_cache, "title", [self.gemini.title_model, rule_prompt],
+                lambda: self._generate_rule_title(rule_prompt)
+            )
         if not rule_name:
             rule_name = f"ルール_{now}"
         logger.info(f"Generated rule title: {rule_name}")
 
+        # --- Phase3: JSONフォーマット例生成 (Pythonで実装) ---
+        logger.info("Generating json_format_example using _generate_json_example...")
+        json_format_example = self._generate_json_example(sample_data)
+        logger.debug(f"Generated json_format_example: {json_format_example}")
+
         # --- 新規ルールを保存 ---
         # 新しいIDを生成（既存の最大値+1）
         max_id = max([r.get("id", 0) for r in self._rules], default=0)
@@ -413,6 +568,7 @@ class RuleService:
             "json_format_example": json_format_example,
             "sample_data": sample_data,
             "mode": mode,
+            "field_descriptions": field_descriptions,
             "id": new_id,
             "rule_name": rule_name  # UI側の互換性のため
         }
@@ -448,6 +604,8 @@ class RuleService:
         # 新しいサンプルデータでルールを作成 (create_ruleを呼び出す)
         try:
             new_rule_metadata = await self.create_rule(samples, mode)
+            self._invalidate_sample_index(rule_id)
+            self._invalidate_context_cache(rule_id)
             # 追加: create_rule後のデバッグログ
             logger.debug(f"After create_rule: metadata returned={new_rule_metadata}")
             logger.debug(f"Current rule IDs after create: {[r.get('id') for r in self._rules]}")
@@ -499,6 +657,8 @@ class RuleService:
         """
         initial_length = len(self._rules)
         self._rules = [r for r in self._rules if r.get("id") != rule_id]
+        self._invalidate_sample_index(rule_id)
+        self._invalidate_context_cache(rule_id)
         if len(self._rules) < initial_length:
             self._save_rules()
             logger.info(f"Rule id={rule_id} deleted successfully.")
@@ -508,10 +668,61 @@ class RuleService:
             return False
 
 
-    async def apply_rule(self, rule_id: int, inputs: List[str]) -> List[Dict[str, Any]]:
+    async def apply_rule(self, rule_id: int, inputs: List[str],
+                         on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+                         control: Optional[RunControl] = None) -> List[Dict[str, Any]]:
+        """
+        指定したルールを入力リストに適用し、結果を入力順のリストで返却
+        on_result を指定すると、各行の処理が完了した時点で on_result(index, result) を呼び出す
+        control を指定すると一時停止・中止できる（中止された行は status="cancelled"）
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(inputs)
+
+        def _emit(index: int, result: Dict[str, Any]) -> None:
+            results[index] = result
+            if on_result is not None:
+                on_result(index, result)
+
+        await self._run_rule(rule_id, inputs, _emit, control)
+        return results
+
+    async def apply_rule_stream(self, rule_id: int, inputs: List[str],
+                                control: Optional[RunControl] = None) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
         """
-        指定したルールを入力リストに適用し、結果を返却
-        (注: 現在の実装はサンプルデータとの完全一致のみ。将来的にはAI適用が必要)
+        指定したルールを入力リストに適用し、完了した行から順に (index, result) を返す非同期イテレータ
+        全結果をリストに保持しないため、大量行の処理でもメモリ使用量が増えない
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        async def _run() -> None:
+            try:
+                await self._run_rule(rule_id, inputs, lambda index, result: queue.put_nowait((index, result)), control)
+            finally:
+                queue.put_nowait(done)
+
+        task = asyncio.create_task(_run())
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                yield item
+            # 実行中の例外を呼び出し元へ伝える
+            await task
+        finally:
+            if not task.done():
+                task.cancel()
+
+    async def _run_rule(self, rule_id: int, inputs: List[str], emit: Callable[[int, Dict[str, Any]], None],
+                        control: Optional[RunControl] = None) -> None:
+        """
+        apply_rule の実行エンジン。各行の結果は確定した時点で emit(index, result) に渡す
+        サンプル一致しない入力はAIで処理する。各行は RowScheduler により
+        config.json の max_concurrency を上限に並列処理される
+        テキストモードでは config.json の text_batch 設定に従い複数行を1リクエストにまとめる
+        メディアモードでは MediaPipeline によりアップロード・ACTIVE待ち・生成を段階ごとに並列化する
+        同一の入力値は1回だけ処理し、結果を該当する全行に展開する
         """
         # ルールを検索
         rule = next((r for r in self._rules if r.get("id") == rule_id), None)
@@ -521,13 +732,14 @@ class RuleService:
         sample_data = rule.get('sample_data', {})
         headers = sample_data.get('headers', [])
         rows = sample_data.get('rows', [])
-        results = []
         rule_mode = rule.get('mode', ProcessMode.NORMAL)  # ルールのモードを取得
 
         if not headers or not rows:
              logger.warning(f"Rule id={rule_id} has empty sample_data. Cannot apply rule based on samples.")
              # サンプルがない場合、全入力に対してエラーを返す
-             return [{"input": inp, "output": {}, "status": "error", "error_msg": "ルールにサンプルデータがありません"} for inp in inputs]
+             for i, inp in enumerate(inputs):
+                 emit(i, {"input": inp, "output": {}, "status": "error", "error_msg": "ルールにサンプルデータがありません"})
+             return
 
         # 出力ヘッダーのインデックスを取得 (3列目以降)
         output_indices = [idx for idx, h in enumerate(headers, start=1) if idx >= 3 and h.strip()]
@@ -535,119 +747,603 @@ class RuleService:
         # ログ: 処理開始
         logger.info(f"apply_rule 開始: rule_id={rule_id} mode={rule_mode} 対象行数={len(inputs)}件")
 
-        logger.info(f"Applying rule id={rule_id} based on sample matching...")
-        for inp in inputs:
-            # マッチするサンプル行を検索 (2列目が入力値と一致するか)
-            match = next((row for row in rows if len(row) > 1 and row[1] == inp), None)
-            if match:
-                try:
-                    # 出力フィールド生成
-                    out = {}
-                    for idx, key in zip(output_indices, output_headers):
-                         if idx -1 < len(match): # 行の長さチェック
-                             out[key] = match[idx - 1]
-                         else:
-                             logger.warning(f"Index {idx-1} out of bounds for matched row in rule id={rule_id} for input '{inp}'. Header: '{key}'")
-                             out[key] = "" # インデックス外の場合は空文字
-
-                    results.append({"input": inp, "output": out, "status": "success"})
-                    logger.debug(f"Input '{inp}' matched sample. Output: {out}")
-                except Exception as e:
-                     logger.error(f"Error processing matched row for input '{inp}' in rule id={rule_id}: {e}")
-                     results.append({"input": inp, "output": {}, "status": "error", "error_msg": f"サンプル処理中にエラー発生: {e}"})
+        config = config_manager.get_config()
+        max_concurrency = config.get('max_concurrency', DEFAULT_MAX_CONCURRENCY)
+        scheduler = RowScheduler(max_concurrency)
+        counts = {"success": 0, "error": 0, "cancelled": 0}
+
+        def _count(result: Dict[str, Any]) -> None:
+            status = result.get("status")
+            counts[status if status in counts else "error"] += 1
+
+        # サンプル一致する入力はその場で確定し、残りをAI処理対象とする
+        def _match_all() -> Tuple[List[Tuple[int, Dict[str, Any]]], List[int]]:
+            sample_index = self._get_sample_index(rule)
+            matched_rows: List[Tuple[int, Dict[str, Any]]] = []
+            unmatched: List[int] = []
+            for i, inp in enumerate(inputs):
+                matched = self._match_sample(rule, sample_index, output_indices, output_headers, inp)
+                if matched is not None:
+                    matched_rows.append((i, matched))
+                else:
+                    unmatched.append(i)
+            return matched_rows, unmatched
 
+        if rule_mode in [ProcessMode.IMAGE, ProcessMode.VIDEO, ProcessMode.AUDIO]:
+            # メディアはファイルハッシュ計算を伴うためイベントループを塞がないよう別スレッドで照合
+            matched_rows, pending = await asyncio.to_thread(_match_all)
+        else:
+            matched_rows, pending = _match_all()
+        logger.info(f"サンプル一致={len(matched_rows)}件 AI処理対象={len(pending)}件")
+        for i, matched in matched_rows:
+            _count(matched)
+            emit(i, matched)
+
+        # 同一入力は代表行のみ処理し、完了後に同じ結果（エラー含む）を複製する
+        duplicates: Dict[int, List[int]] = {}
+        first_index: Dict[str, int] = {}
+        unique_pending: List[int] = []
+        for i in pending:
+            rep = first_index.get(inputs[i])
+            if rep is None:
+                first_index[inputs[i]] = i
+                unique_pending.append(i)
             else:
-                logger.debug(f"Input '{inp}' did not match any sample in rule id={rule_id}, calling AI.")
-                # サンプル一致しない場合はAIを呼び出して処理
-                try:
-                    # モードに応じて処理方法を変更
-                    if rule_mode in [ProcessMode.IMAGE, ProcessMode.VIDEO, ProcessMode.AUDIO]:
-                        # 画像・動画・音声の場合はメディア解析APIを使用
-                        logger.info(f"Processing {rule_mode} file: {inp}")
-                        
-                        # ファイルパスの検証
-                        file_path = Path(inp)
-                        if not file_path.exists():
-                            raise FileNotFoundError(f"ファイルが見つかりません: {inp}")
-                        
-                        # プロンプトの組み立て
-                        media_prompt = f"{rule.get('prompt', '')}\n\n以下の項目について回答してください:\n"
-                        for header in output_headers:
-                            media_prompt += f"- {header}\n"
-                        media_prompt += f"\n回答は以下のJSONフォーマットで返してください:\n"
-                        media_prompt += json.dumps(rule.get("json_format_example", {}), ensure_ascii=False, indent=2)
-                        
-                        # 画像・動画・音声解析APIを呼び出し（非同期）
-                        logger.debug(f"メディア解析プロンプト:\n{media_prompt}")
-                        if rule_mode == ProcessMode.IMAGE:
-                            ai_response = await self.gemini.analyze_image(inp, media_prompt)
-                        elif rule_mode == ProcessMode.VIDEO:
-                            ai_response = await self.gemini.analyze_video(inp, media_prompt)
-                        else:  # AUDIO
-                            ai_response = await self.gemini.analyze_audio(inp, media_prompt)
-                        
-                        # レスポンスをJSON解析
-                        text = ai_response.strip()
-                        # コードブロックマーカー除去
-                        if text.startswith("```"):
-                            text = re.sub(r"```(?:json)?\n?", "", text)
-                            text = text.rstrip("`\n ")
-                        # JSON部分抽出
-                        start = text.find("{")
-                        end = text.rfind("}")
-                        json_str = text[start:end+1] if start != -1 and end != -1 else text
-                        data = json.loads(json_str)
-                        out = {key: data.get(key, "") for key in output_headers}
-                        
-                        results.append({"input": inp, "output": out, "status": "success"})
-                        logger.debug(f"Media analysis output for input '{inp}': {out}")
-                        
-                    else:
-                        # テキストモードの場合は従来の処理
-                        # プロンプトの組み立て
-                        lines = [
-                            rule.get("prompt", ""),
-                            "次のようなJSONフォーマットで返答してください。",
-                            json.dumps(rule.get("json_format_example", {}), ensure_ascii=False, indent=2),
-                            f"元の値: {inp}"
-                        ]
-                        combined_prompt = "\n".join(lines)
-                        # 送信プロンプトをログに出力
-                        logger.debug(f"送信プロンプト内容:\n{combined_prompt}")
-                        logger.info(f"リアルデータ変換用モデル: {self.gemini.minutes_model} を使用してAI呼び出しを実行")
-                        resp = self.gemini.client.models.generate_content(
-                            model=self.gemini.minutes_model,
-                            contents=combined_prompt
-                        )
-                        text = resp.text.strip()
-                        # コードブロックマーカー除去
-                        if text.startswith("```"):
-                            text = re.sub(r"```(?:json)?\n?", "", text)
-                            text = text.rstrip("`\n ")
-                        # JSON部分抽出
-                        start = text.find("{")
-                        end = text.rfind("}")
-                        json_str = text[start:end+1] if start != -1 and end != -1 else text
-                        data = json.loads(json_str)
-                        out = {key: data.get(key, "") for key in output_headers}
-                        results.append({"input": inp, "output": out, "status": "success"})
-                        logger.debug(f"AI output for input '{inp}': {out}")
-                        
-                except Exception as e:
-                    logger.error(f"AI処理エラー for input '{inp}': {e}")
-                    results.append({"input": inp, "output": {}, "status": "error", "error_msg": str(e)})
+                duplicates.setdefault(rep, []).append(i)
+        if len(unique_pending) < len(pending):
+            logger.info(f"重複入力を集約: {len(pending)}件 → {len(unique_pending)}件")
+        pending = unique_pending
+
+        cache_keys: Dict[int, str] = {}
+        # 結果キャッシュへの保存（別スレッドで実行し、終了前にまとめて待つ）
+        cache_writes: List[asyncio.Future] = []
+
+        def _complete(i: int, result: Dict[str, Any]) -> None:
+            """代表行の結果を確定し、キャッシュ保存と重複行への展開を行う"""
+            key = cache_keys.pop(i, None)
+            if key and result.get("status") == "success":
+                cache_writes.append(asyncio.ensure_future(self.result_cache.aput(key, result.get("output", {}))))
+            for index in [i] + duplicates.pop(i, []):
+                row_result = result if index == i else {**result, "input": inputs[index], "output": dict(result.get("output", {}))}
+                _count(row_result)
+                emit(index, row_result)
+
+        def _cancelled(i: int) -> None:
+            _complete(i, {"input": inputs[i], "output": {}, "status": "cancelled", "error_msg": "処理が中止されました"})
+
+        # 永続キャッシュにヒットした入力はAI呼び出しを省略
+        cache_hits = 0
+        if self.result_cache is not None and pending:
+            def _lookup_all() -> List[Tuple[int, Optional[str], Optional[Any]]]:
+                # キー生成（メディアはファイルの stat）と SQLite の参照をまとめて別スレッドで行う
+                keys = [(i, self._result_cache_key(rule, output_headers, inputs[i])) for i in pending]
+                hits = self.result_cache.get_many([key for _, key in keys if key])
+                return [(i, key, hits.get(key) if key else None) for i, key in keys]
+
+            misses: List[int] = []
+            for i, key, cached in await asyncio.to_thread(_lookup_all):
+                if cached is not None:
+                    cache_hits += 1
+                    _complete(i, {"input": inputs[i], "output": cached, "status": "success", "cached": True})
+                    continue
+                if key:
+                    cache_keys[i] = key
+                misses.append(i)
+            pending = misses
+        logger.info(f"結果キャッシュ: hit={cache_hits}件 miss={len(pending)}件")
+
+        batch_config = {**DEFAULT_TEXT_BATCH_CONFIG, **config.get('text_batch', {})}
+        pipeline_config = {**DEFAULT_MEDIA_PIPELINE_CONFIG, **config.get('media_pipeline', {})}
+        if rule_mode in [ProcessMode.IMAGE, ProcessMode.VIDEO, ProcessMode.AUDIO] and pipeline_config.get('enabled') and pending:
+            # メディアモード: アップロード・ACTIVE待ち・生成を段階ごとに並列化したパイプラインで処理
+            media_prompt = self._build_media_prompt(rule, output_headers)
+            pipeline = MediaPipeline(self.gemini, rule_mode, media_prompt, pipeline_config,
+                                     response_schema=self._response_schema(rule, output_headers),
+                                     cache_prefix=self._cache_prefix(rule, media_prompt))
+
+            def _on_media_done(jobs: List[MediaJob]) -> None:
+                index = jobs[0].index
+                _complete(index, self._media_job_result(jobs, rule_mode, output_headers, inputs[index]))
+
+            await pipeline.run([(i, inputs[i]) for i in pending], _on_media_done, control=control,
+                               on_skipped=lambda i, _path: _cancelled(i))
+        elif rule_mode == ProcessMode.NORMAL and batch_config.get('enabled') and len(pending) > 1:
+            # テキストモード: 複数行を1リクエストにまとめて処理
+            batches = self._make_text_batches(rule, output_headers, [inputs[i] for i in pending], pending, batch_config)
+            logger.info(f"バッチ処理: {len(pending)}件を{len(batches)}リクエストに分割")
+
+            async def _process_batch(_idx: int, batch: List[int]) -> None:
+                batch_result = await self._apply_ai_to_batch(rule, output_headers, [inputs[i] for i in batch])
+                for i, result in zip(batch, batch_result):
+                    _complete(i, result)
+
+            await scheduler.run(batches, _process_batch, collect=False, control=control,
+                                on_skipped=lambda _idx, batch: [_cancelled(i) for i in batch])
+        else:
+            async def _process(_idx: int, i: int) -> None:
+                _complete(i, await self._apply_ai_to_input(rule, output_headers, inputs[i]))
+
+            await scheduler.run(pending, _process, collect=False, control=control,
+                                on_skipped=lambda _idx, i: _cancelled(i))
+
+        if self.result_cache is not None:
+            await asyncio.gather(*cache_writes, return_exceptions=True)
+            await self.result_cache.aevict()
 
         # ログ: 処理完了
-        success_count = sum(1 for r in results if r.get("status") == "success")
-        error_count = len(results) - success_count
-        logger.info(f"apply_rule 完了: success={success_count}件 error={error_count}件")
+        logger.info(f"apply_rule 完了: success={counts['success']}件 error={counts['error']}件 cancelled={counts['cancelled']}件")
+
+    def _result_cache_key(self, rule: Dict[str, Any], output_headers: List[str], inp: str) -> Optional[str]:
+        """プロンプトのハッシュ・出力ヘッダー・モデル名・入力値から結果キャッシュのキーを生成"""
+        rule_mode = rule.get('mode', ProcessMode.NORMAL)
+        prompt_hash = hashlib.sha256(rule.get('prompt', '').encode('utf-8')).hexdigest()
+        if rule.get('field_descriptions'):
+            # 項目説明もプロンプトの一部として送るためハッシュに含める
+            prompt_hash = ResultCache.make_key(prompt_hash, rule['field_descriptions'])
+        fewshot = self._get_fewshot_index(rule)
+        if fewshot is not None:
+            # 似たサンプルを例としてプロンプトに入れるため、サンプルと例の選び方もハッシュに含める
+            fewshot_config = load_fewshot_config()
+            prompt_hash = ResultCache.make_key(prompt_hash, fewshot["signature"], fewshot_config['k'],
+                                               fewshot_config['min_similarity'], fewshot_config['max_example_chars'])
+        if rule_mode in [ProcessMode.IMAGE, ProcessMode.VIDEO, ProcessMode.AUDIO]:
+            # メディアはファイルの更新を検知できるようサイズと更新時刻もキーに含める
+            try:
+                stat = Path(inp).stat()
+            except OSError:
+                return None
+            return ResultCache.make_key(prompt_hash, output_headers, self.gemini.transcription_model,
+                                        rule_mode, inp, stat.st_size, stat.st_mtime_ns)
+        return ResultCache.make_key(prompt_hash, output_headers, self.gemini.minutes_model, rule_mode, inp)
+
+    def _get_sample_index(self, rule: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        サンプル入力値 → サンプル行 の照合用インデックスを返す（ルールごとに1回だけ構築）
+        メディアルールではファイル内容のハッシュ → サンプル行 のインデックスと、サンプルのファイルサイズの集合も持つ
+        """
+        rule_id = rule.get("id")
+        index = self._sample_indexes.get(rule_id)
+        if index is not None:
+            return index
+
+        rows = rule.get('sample_data', {}).get('rows', [])
+        by_input: Dict[str, List[str]] = {}
+        by_hash: Dict[str, List[str]] = {}
+        sizes: Set[int] = set()
+        is_media = rule.get('mode', ProcessMode.NORMAL) in [ProcessMode.IMAGE, ProcessMode.VIDEO, ProcessMode.AUDIO]
+        for row in rows:
+            if len(row) <= 1:
+                continue
+            # 同じ入力が複数ある場合は先頭の行を優先
+            by_input.setdefault(row[1], row)
+            if is_media:
+                content_hash = file_content_hash(row[1])
+                if content_hash:
+                    by_hash.setdefault(content_hash, row)
+                    size = self._file_size(row[1])
+                    if size is not None:
+                        sizes.add(size)
+        index = {"by_input": by_input, "by_hash": by_hash, "sizes": sizes}
+        self._sample_indexes[rule_id] = index
+        logger.debug(f"Built sample index for rule id={rule_id}: inputs={len(by_input)} hashes={len(by_hash)}")
+        return index
+
+    def _invalidate_sample_index(self, rule_id: int) -> None:
+        """指定ルールのサンプル照合用インデックスと few-shot 用の類似度インデックスを破棄する"""
+        self._fewshot_indexes.pop(rule_id, None)
+        if self._sample_indexes.pop(rule_id, None) is not None:
+            logger.debug(f"Invalidated sample index for rule id={rule_id}")
+
+    def _get_fewshot_index(self, rule: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        サンプル入力の類似度インデックスを返す（ルールごとに1回だけ構築）
+        テキストモード以外・無効設定・サンプルがない場合はNone
+        """
+        rule_id = rule.get("id")
+        if rule_id in self._fewshot_indexes:
+            return self._fewshot_indexes[rule_id]
+        fewshot_config = load_fewshot_config()
+        if not fewshot_config.get('enabled') or rule.get('mode', ProcessMode.NORMAL) != ProcessMode.NORMAL:
+            return None
+
+        rows = [row for row in rule.get('sample_data', {}).get('rows', []) if len(row) > 1 and str(row[1]).strip()]
+        entry = None
+        if rows:
+            start_time = time.time()
+            entry = {
+                "index": FewShotIndex([str(row[1]) for row in rows],
+                                      fewshot_config['ngram_min'], fewshot_config['ngram_max']),
+                "rows": rows,
+                "signature": ResultCache.make_key(rows),
+            }
+            logger.debug(f"Built few-shot index for rule id={rule_id}: samples={len(rows)} "
+                         f"({time.time() - start_time:.3f}秒)")
+        self._fewshot_indexes[rule_id] = entry
+        return entry
+
+    def _fewshot_examples(self, rule: Dict[str, Any], inputs: List[str]) -> List[List[str]]:
+        """
+        入力に似たサンプル行を few-shot 例として選ぶ
+        1件なら類似度の上位 k 件、複数件なら各入力の上位から順に batch_max_examples 件まで選ぶ
+        """
+        fewshot = self._get_fewshot_index(rule)
+        if fewshot is None or not inputs:
+            return []
+        fewshot_config = load_fewshot_config()
+        k = int(fewshot_config['k'])
+        limit = k if len(inputs) == 1 else int(fewshot_config['batch_max_examples'])
+        rankings = [
+            [doc for doc, _ in fewshot["index"].query(inp, k, float(fewshot_config['min_similarity']))]
+            for inp in dict.fromkeys(inputs)
+        ]
+        chosen: List[int] = []
+        for rank in range(k):
+            for ranking in rankings:
+                if rank < len(ranking) and ranking[rank] not in chosen and len(chosen) < limit:
+                    chosen.append(ranking[rank])
+        return [fewshot["rows"][doc] for doc in chosen]
+
+    def _fewshot_lines(self, rule: Dict[str, Any], examples: List[List[str]]) -> List[str]:
+        """few-shot 例をプロンプト用の行にする（例がなければ空）"""
+        if not examples:
+            return []
+        max_chars = int(load_fewshot_config()['max_example_chars'])
+
+        def _clip(value: Any) -> str:
+            text = str(value)
+            return text if len(text) <= max_chars else text[:max_chars] + "…"
+
+        headers = rule.get('sample_data', {}).get('headers', [])
+        output_indices = [idx for idx, h in enumerate(headers, start=1) if idx >= 3 and h.strip()]
+        lines = ["参考例（入力に近いサンプルとその出力）:"]
+        for row in examples:
+            out = {headers[idx - 1]: _clip(row[idx - 1]) if idx - 1 < len(row) else "" for idx in output_indices}
+            lines.append(f"例の元の値: {_clip(row[1])}")
+            lines.append(f"例の出力: {json.dumps(out, ensure_ascii=False)}")
+        return lines
+
+    def _invalidate_context_cache(self, rule_id: int) -> None:
+        """指定ルールのコンテキストキャッシュのハンドルを破棄する"""
+        if self.gemini.context_cache is not None:
+            self.gemini.context_cache.invalidate(rule_id)
+
+    def _cache_prefix(self, rule: Dict[str, Any], text: str) -> Optional[CachePrefix]:
+        """行ごとのリクエストに共通するプロンプト部分をコンテキストキャッシュの対象にする（無効時はNone）"""
+        if self.gemini.context_cache is None:
+            return None
+        return CachePrefix(rule.get("id"), text)
+
+    @staticmethod
+    def _file_size(file_path: str) -> Optional[int]:
+        """ファイルサイズ（存在しない・読めない場合はNone）"""
+        try:
+            return os.path.getsize(file_path)
+        except OSError:
+            return None
+
+    def _match_sample(self, rule: Dict[str, Any], sample_index: Dict[str, Any], output_indices: List[int],
+                      output_headers: List[str], inp: str) -> Optional[Dict[str, Any]]:
+        """サンプル行と一致する入力なら結果dictを返し、一致しなければNoneを返す"""
+        rule_id = rule.get("id")
+        # マッチするサンプル行を検索 (2列目が入力値と一致するか)
+        match = sample_index["by_input"].get(inp)
+        if not match and sample_index["by_hash"] and self._file_size(inp) in sample_index["sizes"]:
+            # メディアはファイル名・場所が変わっても内容が同じなら一致とみなす
+            # （ハッシュ計算はサイズが一致するサンプルがある入力だけに限る）
+            content_hash = file_content_hash(inp)
+            match = sample_index["by_hash"].get(content_hash) if content_hash else None
+        if not match:
+            logger.debug(f"Input '{inp}' did not match any sample in rule id={rule_id}, calling AI.")
+            return None
+        try:
+            # 出力フィールド生成
+            out = {}
+            for idx, key in zip(output_indices, output_headers):
+                 if idx -1 < len(match): # 行の長さチェック
+                     out[key] = match[idx - 1]
+                 else:
+                     logger.warning(f"Index {idx-1} out of bounds for matched row in rule id={rule_id} for input '{inp}'. Header: '{key}'")
+                     out[key] = "" # インデックス外の場合は空文字
+
+            logger.debug(f"Input '{inp}' matched sample. Output: {out}")
+            return {"input": inp, "output": out, "status": "success"}
+        except Exception as e:
+             logger.error(f"Error processing matched row for input '{inp}' in rule id={rule_id}: {e}")
+             return {"input": inp, "output": {}, "status": "error", "error_msg": f"サンプル処理中にエラー発生: {e}"}
+
+    async def _apply_ai_to_input(self, rule: Dict[str, Any], output_headers: List[str], inp: str) -> Dict[str, Any]:
+        """
+        1件の入力をAIで処理する（例外は送出せず結果dictで返す）
+        行内のAPI呼び出しは1つの再試行予算を共有し、試行回数を結果の attempts に記録する
+        """
+        with retry_budget() as budget:
+            try:
+                out = await self._call_ai_for_input(rule, output_headers, inp)
+                return {"input": inp, "output": out, "status": "success", "attempts": budget.attempts}
+            except Exception as e:
+                logger.error(f"AI処理エラー for input '{inp}': {e}")
+                return {"input": inp, "output": {}, "status": "error", "error_msg": str(e), "attempts": budget.attempts}
+
+    def _media_job_result(self, jobs: List[MediaJob], rule_mode: str, output_headers: List[str], inp: str) -> Dict[str, Any]:
+        """
+        メディアパイプラインの処理結果を apply_rule の結果dictに変換する
+        区間に分割した動画・音声は区間ごとの出力を設定された統合方法でまとめる（1区間でも失敗すればエラー）
+        """
+        attempts = sum(job.budget.attempts for job in jobs)
+        error = next((job.error for job in jobs if job.error is not None), None)
+        if error is None:
+            try:
+                outputs = [self._media_output(job.text, output_headers) for job in jobs]
+                out = self.gemini.merge_split_outputs(rule_mode, outputs, output_headers)
+                logger.debug(f"Media analysis output for input '{inp}': {out}")
+                return {"input": inp, "output": out, "status": "success", "attempts": attempts}
+            except Exception as e:
+                error = e
+        failed = next((job for job in jobs if job.error is not None), None)
+        if failed is not None and failed.segment_count > 1:
+            error = f"区間{failed.segment + 1}/{failed.segment_count}: {error}"
+        logger.error(f"AI処理エラー for input '{inp}': {error}")
+        return {"input": inp, "output": {}, "status": "error", "error_msg": str(error), "attempts": attempts}
+
+    def _media_output(self, raw_text: str, output_headers: List[str]) -> Dict[str, str]:
+        """メディア解析の応答JSONから出力項目のdictを取り出す"""
+        data = self._parse_json_response(raw_text)
+        return {key: data.get(key, "") for key in output_headers}
+
+    async def _call_ai_for_input(self, rule: Dict[str, Any], output_headers: List[str], inp: str) -> Dict[str, str]:
+        """1件の入力をAIで処理し、出力項目のdictを返す（失敗時は例外を送出）"""
+        rule_mode = rule.get('mode', ProcessMode.NORMAL)
+        # モードに応じて処理方法を変更
+        if rule_mode in [ProcessMode.IMAGE, ProcessMode.VIDEO, ProcessMode.AUDIO]:
+            # 画像・動画・音声の場合はメディア解析APIを使用
+            logger.info(f"Processing {rule_mode} file: {inp}")
+
+            # ファイルパスの検証
+            file_path = Path(inp)
+            if not file_path.exists():
+                raise FileNotFoundError(f"ファイルが見つかりません: {inp}")
+
+            # プロンプトの組み立て
+            media_prompt = self._build_media_prompt(rule, output_headers)
+
+            # 画像・動画・音声解析APIを呼び出し（非同期）
+            logger.debug(f"メディア解析プロンプト:\n{media_prompt}")
+            response_schema = self._response_schema(rule, output_headers)
+            cache_prefix = self._cache_prefix(rule, media_prompt)
+            if rule_mode == ProcessMode.IMAGE:
+                ai_response = await self.gemini.analyze_image(inp, media_prompt, response_schema, cache_prefix)
+                out = self._media_output(ai_response, output_headers)
+            else:
+                # 動画・音声は長いものを区間ごとに並列解析し、区間ごとの出力を統合する
+                segment_responses = await self.gemini.analyze_media_segments(inp, media_prompt, rule_mode, response_schema,
+                                                                             cache_prefix)
+                outputs = [self._media_output(text, output_headers) for text in segment_responses]
+                out = self.gemini.merge_split_outputs(rule_mode, outputs, output_headers)
+            logger.debug(f"Media analysis output for input '{inp}': {out}")
+            return out
+
+        # テキストモードの場合
+        combined_prompt = self._build_text_prompt(rule, inp)
+        # 送信プロンプトをログに出力
+        logger.debug(f"送信プロンプト内容:\n{combined_prompt}")
+        logger.info(f"リアルデータ変換用モデル: {self.gemini.minutes_model} を使用してAI呼び出しを実行")
+        resp = await self.gemini.generate_json_async(
+            model=self.gemini.minutes_model,
+            contents=combined_prompt,
+            response_schema=self._response_schema(rule, output_headers),
+            cache_prefix=self._cache_prefix(rule, self._text_prompt_prefix(rule))
+        )
+        data = self._parse_json_response(resp.text)
+        out = {key: data.get(key, "") for key in output_headers}
+        logger.debug(f"AI output for input '{inp}': {out}")
+        return out
+
+    def _estimate_tokens(self, text: str) -> int:
+        """トークン数の概算（ASCIIは約4文字/トークン、それ以外は1文字/トークン）"""
+        return estimate_tokens(text)
+
+    def _make_text_batches(self, rule: Dict[str, Any], output_headers: List[str], batch_inputs: List[str],
+                           indices: List[int], batch_config: Dict[str, Any]) -> List[List[int]]:
+        """トークン予算と最大行数に収まるように入力をバッチに分割する"""
+        max_rows = max(1, int(batch_config.get('max_rows', DEFAULT_TEXT_BATCH_CONFIG['max_rows'])))
+        token_budget = int(batch_config.get('token_budget', DEFAULT_TEXT_BATCH_CONFIG['token_budget']))
+        prefix_tokens = self._estimate_tokens(self._build_text_batch_prompt(rule, output_headers, []))
+        fewshot = self._get_fewshot_index(rule)
+        if fewshot is not None:
+            # 入力に応じて入る few-shot 例の分（最も長い例が上限件数入る場合）を見込む
+            max_examples = int(load_fewshot_config()['batch_max_examples'])
+            example_tokens = max(self._estimate_tokens("\n".join(self._fewshot_lines(rule, [row])))
+                                 for row in fewshot["rows"])
+            prefix_tokens += example_tokens * max_examples
+
+        batches: List[List[int]] = []
+        current: List[int] = []
+        current_tokens = prefix_tokens
+        for i, inp in zip(indices, batch_inputs):
+            # 行番号・ラベル分のオーバーヘッドを加味
+            row_tokens = self._estimate_tokens(inp) + 8
+            if current and (len(current) >= max_rows or current_tokens + row_tokens > token_budget):
+                batches.append(current)
+                current = []
+                current_tokens = prefix_tokens
+            current.append(i)
+            current_tokens += row_tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _batch_index_key(self, rule: Dict[str, Any], output_headers: List[str]) -> str:
+        """バッチ返答で元の値の番号を入れるキー（出力ヘッダー・JSON例のキーと重ならないもの）"""
+        return batch_index_key([*output_headers, *rule.get("json_format_example", {})])
+
+    def _build_text_batch_prompt(self, rule: Dict[str, Any], output_headers: List[str],
+                                 batch_inputs: List[str]) -> str:
+        """複数行をまとめて処理するためのプロンプトを組み立てる"""
+        index_key = self._batch_index_key(rule, output_headers)
+        example = {index_key: 0, **rule.get("json_format_example", {})}
+        lines = [
+            rule.get("prompt", ""),
+            *self._field_description_lines(rule),
+            "以下の各「元の値」それぞれに対して上記の処理を行ってください。",
+            f"返答は元の値ごとに1要素のJSON配列とし、各要素の\"{index_key}\"には元の値の番号を入れ、次のJSONフォーマットで返答してください。",
+            json.dumps([example], ensure_ascii=False, indent=2),
+            *self._fewshot_lines(rule, self._fewshot_examples(rule, batch_inputs)),
+        ]
+        for idx, inp in enumerate(batch_inputs):
+            lines.append(f"[{idx}] 元の値: {inp}")
+        return "\n".join(lines)
+
+    async def _apply_ai_to_batch(self, rule: Dict[str, Any], output_headers: List[str],
+                                 batch_inputs: List[str]) -> List[Dict[str, Any]]:
+        """
+        複数行を1リクエストで処理する
+        返答が壊れている場合はバッチを分割して再試行し、欠けた行のみを再処理する
+        API呼び出し自体の失敗は分割せず、バッチ全行をエラーとして返す
+        """
+        if len(batch_inputs) == 1:
+            return [await self._apply_ai_to_input(rule, output_headers, batch_inputs[0])]
+
+        batch_prompt = self._build_text_batch_prompt(rule, output_headers, batch_inputs)
+        logger.debug(f"バッチ送信プロンプト内容:\n{batch_prompt}")
+        logger.info(f"バッチAI呼び出し: {len(batch_inputs)}件 model={self.gemini.minutes_model}")
+        with retry_budget() as budget:
+            try:
+                resp = await self.gemini.generate_json_async(
+                    model=self.gemini.minutes_model,
+                    contents=batch_prompt,
+                    response_schema=self._response_schema(rule, output_headers, batch=True),
+                    cache_prefix=self._cache_prefix(rule, self._build_text_batch_prompt(rule, output_headers, []))
+                )
+            except Exception as e:
+                # API呼び出しの失敗（再試行済み・再試行不能）は分割しても回復しないため、全行をエラーとする
+                logger.error(f"バッチAI呼び出しエラー ({len(batch_inputs)}件): {e}")
+                return [{"input": inp, "output": {}, "status": "error", "error_msg": str(e), "attempts": budget.attempts}
+                        for inp in batch_inputs]
+        try:
+            items = self._parse_json_array_response(resp.text)
+        except (TypeError, ValueError) as e:
+            # 返答が解析できない場合は半分に分割して再試行
+            logger.warning(f"バッチ返答の解析失敗 ({len(batch_inputs)}件)、分割して再試行します: {e}")
+            mid = len(batch_inputs) // 2
+            first = await self._apply_ai_to_batch(rule, output_headers, batch_inputs[:mid])
+            second = await self._apply_ai_to_batch(rule, output_headers, batch_inputs[mid:])
+            return first + second
+
+        index_key = self._batch_index_key(rule, output_headers)
+        by_index: Dict[int, Dict[str, Any]] = {}
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            try:
+                by_index[int(item.get(index_key))] = item
+            except (TypeError, ValueError):
+                continue
+
+        results: List[Optional[Dict[str, Any]]] = [None] * len(batch_inputs)
+        missing: List[int] = []
+        for idx, inp in enumerate(batch_inputs):
+            item = by_index.get(idx)
+            if item is None:
+                missing.append(idx)
+                continue
+            out = {key: item.get(key, "") for key in output_headers}
+            results[idx] = {"input": inp, "output": out, "status": "success", "attempts": budget.attempts}
+
+        if missing:
+            logger.warning(f"バッチ返答に{len(missing)}/{len(batch_inputs)}件の欠落、欠落行のみ再試行します")
+            if len(missing) == len(batch_inputs):
+                # 1件も対応付けできない場合は分割して無限再試行を避ける
+                mid = len(batch_inputs) // 2
+                return (await self._apply_ai_to_batch(rule, output_headers, batch_inputs[:mid])
+                        + await self._apply_ai_to_batch(rule, output_headers, batch_inputs[mid:]))
+            retried = await self._apply_ai_to_batch(rule, output_headers, [batch_inputs[i] for i in missing])
+            for idx, result in zip(missing, retried):
+                results[idx] = result
         return results
 
+    def _response_schema(self, rule: Dict[str, Any], output_headers: List[str],
+                         batch: bool = False) -> Optional[Dict[str, Any]]:
+        """出力ヘッダーから応答のスキーマを組み立てる（structured_output が無効ならNone）"""
+        structured_config = {**DEFAULT_STRUCTURED_OUTPUT_CONFIG, **config_manager.get_config().get('structured_output', {})}
+        if not structured_config.get('enabled') or not output_headers:
+            return None
+        descriptions = rule.get("field_descriptions") or {}
+        if batch:
+            return build_batch_schema(output_headers, descriptions, self._batch_index_key(rule, output_headers))
+        return build_row_schema(output_headers, descriptions)
+
+    def _build_media_prompt(self, rule: Dict[str, Any], output_headers: List[str]) -> str:
+        """メディアモード用の行処理プロンプトを組み立てる"""
+        media_prompt = f"{rule.get('prompt', '')}\n\n以下の項目について回答してください:\n"
+        descriptions = rule.get("field_descriptions") or {}
+        for header in output_headers:
+            media_prompt += f"- {header}: {descriptions[header]}\n" if descriptions.get(header) else f"- {header}\n"
+        media_prompt += "\n回答は以下のJSONフォーマットで返してください:\n"
+        media_prompt += json.dumps(rule.get("json_format_example", {}), ensure_ascii=False, indent=2)
+        return media_prompt
+
+    def _field_description_lines(self, rule: Dict[str, Any]) -> List[str]:
+        """ルール生成時に作成した項目ごとの説明をプロンプト用の行にする（説明がなければ空）"""
+        descriptions = {k: v for k, v in (rule.get("field_descriptions") or {}).items() if v}
+        if not descriptions:
+            return []
+        return ["各項目の説明:"] + [f"- {field}: {text}" for field, text in descriptions.items()]
+
+    def _text_prompt_prefix(self, rule: Dict[str, Any]) -> str:
+        """テキストモード用の行処理プロンプトのうち、全行で共通の部分（入力値より前）"""
+        lines = [
+            rule.get("prompt", ""),
+            *self._field_description_lines(rule),
+            "次のようなJSONフォーマットで返答してください。",
+            json.dumps(rule.get("json_format_example", {}), ensure_ascii=False, indent=2),
+        ]
+        return "\n".join(lines)
+
+    def _build_text_prompt(self, rule: Dict[str, Any], inp: str) -> str:
+        """テキストモード用の行処理プロンプトを組み立てる（入力に似たサンプルを例として含める）"""
+        lines = [
+            self._text_prompt_prefix(rule),
+            *self._fewshot_lines(rule, self._fewshot_examples(rule, [inp])),
+            f"元の値: {inp}"
+        ]
+        return "\n".join(lines)
+
+    def _parse_json_response(self, raw_text: str) -> Any:
+        """AIの返答からコードブロックを除去し、JSON部分を抽出してパースする"""
+        text = (raw_text or "").strip()
+        # コードブロックマーカー除去
+        if text.startswith("```"):
+            text = re.sub(r"```(?:json)?\n?", "", text)
+            text = text.rstrip("`\n ")
+        # JSON部分抽出
+        start = text.find("{")
+        end = text.rfind("}")
+        json_str = text[start:end+1] if start != -1 and end != -1 else text
+        return json.loads(json_str)
+
+    def _parse_json_array_response(self, raw_text: str) -> List[Any]:
+        """AIの返答からJSON配列部分を抽出してパースする"""
+        text = (raw_text or "").strip()
+        # コードブロックマーカー除去
+        if text.startswith("```"):
+            text = re.sub(r"```(?:json)?\n?", "", text)
+            text = text.rstrip("`\n ")
+        # JSON配列部分抽出
+        start = text.find("[")
+        end = text.rfind("]")
+        json_str = text[start:end+1] if start != -1 and end != -1 else text
+        data = json.loads(json_str)
+        if not isinstance(data, list):
+            raise ValueError("バッチ返答がJSON配列ではありません")
+        return data
+
     def update_rule(self, rule_id: int, new_data: Dict[str, Any]) -> bool:
         """既存ルールのtitle、prompt、modeを更新し保存する"""
         logger.info(f"Updating rule id={rule_id} with data={new_data}")
         for r in self._rules:
             if r.get("id") == rule_id:
+                self._invalidate_sample_index(rule_id)
+                self._invalidate_context_cache(rule_id)
                 r["title"] = new_data.get("title", r["title"])
                 r["prompt"] = new_data.get("prompt", r["prompt"])
                 if "mode" in new_data:
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+ルール適用処理の実行ジャーナル（追記専用JSONL）
+完了した行を1行ずつ記録し、アプリが異常終了しても途中から再開できるようにする
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+RUN_JOURNAL_DIR_NAME = 'run_journal'
+_JOURNAL_SUFFIX = '.jsonl'
+_SNAPSHOT_SUFFIX = '.csv'
+# fsync の間隔（各行は書き込みスレッドが都度 flush してOSに渡すため、アプリの異常終了では失われない。
+# 電源断などで失われ得るのは直近の間隔分だけになる）
+SYNC_INTERVAL_SECONDS = 1.0
+SYNC_EVERY_ROWS = 50
+
+
+class RunJournal:
+    """
+    1回の処理実行分のジャーナル
+    1行目に実行情報（start）、以降に完了行（row）、正常終了時に end を追記する
+    end まで書かれたジャーナルは不要になるため削除する
+    完了行の書き込みと fsync は専用の書き込みスレッドで行い、record の呼び出し元（AI処理のイベントループ）を待たせない
+    """
+
+    def __init__(self, path: str, header: Dict[str, Any]):
+        self.path = path
+        self.header = header
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        # 書き込み待ちの (レコード, 即時 fsync するか)。None は書き込みスレッドの終了指示
+        self._queue: "queue.Queue[Optional[Tuple[Dict[str, Any], bool]]]" = queue.Queue()
+        self._closed = False
+        # 終了指示の後に行が積まれないよう、record と close の投入を排他する（ファイルのロックとは別）
+        self._queue_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._write_loop, name="RunJournalWriter", daemon=True)
+        self._writer.start()
+
+    @classmethod
+    def start(cls, journal_dir: str, rule_id: int, mode: str, rows: List[int],
+              inputs: List[str]) -> 'RunJournal':
+        """
+        新しい実行のジャーナルを作成する
+        Args:
+            journal_dir: ジャーナルを置くディレクトリ
+            rule_id: 適用するルールのID
+            mode: ルールの処理モード
+            rows: 処理対象のテーブル行番号（inputs と同じ順）
+            inputs: 処理対象の入力データリスト
+        """
+        os.makedirs(journal_dir, exist_ok=True)
+        run_id = time.strftime('%Y%m%d-%H%M%S') + '-' + uuid.uuid4().hex[:8]
+        header = {
+            "event": "start",
+            "run_id": run_id,
+            "rule_id": rule_id,
+            "mode": mode,
+            "rows": list(rows),
+            "inputs": list(inputs),
+            "started_at": time.time(),
+        }
+        journal = cls(os.path.join(journal_dir, run_id + _JOURNAL_SUFFIX), header)
+        # 実行開始前のため、開始行はその場で書いてディスクまで同期する
+        journal._write([header], sync=True)
+        logger.info(f"RunJournal 開始: {journal.path} 対象={len(rows)}件")
+        return journal
+
+    @property
+    def snapshot_path(self) -> str:
+        """実行開始時点のテーブル内容を保存するCSVのパス"""
+        return os.path.splitext(self.path)[0] + _SNAPSHOT_SUFFIX
+
+    def record(self, index: int, result: Dict[str, Any]) -> None:
+        """完了した行の結果を書き込みスレッドへ渡す（中止された行は記録しない）"""
+        if result.get("status") == "cancelled":
+            return
+        self._enqueue({
+            "event": "row",
+            "index": index,
+            "status": result.get("status"),
+            "output": result.get("output", {}),
+            "error_msg": result.get("error_msg", ""),
+        })
+
+    def flush(self) -> None:
+        """書き込み待ちの行がすべてファイルに書き出されるまで待つ（fsync は待たない）"""
+        self._queue.join()
+
+    def finish(self, summary: Dict[str, Any]) -> None:
+        """正常終了を記録し、ジャーナルとスナップショットを削除する"""
+        self._enqueue({"event": "end", "summary": summary}, sync=True)
+        self.close()
+        discard_run(self.path)
+        logger.info(f"RunJournal 終了: {self.path}")
+
+    def close(self) -> None:
+        """書き込み待ちの行と未同期の行をディスクに書き出してファイルを閉じる（ジャーナルは再開用に残す）"""
+        with self._queue_lock:
+            stopping = not self._closed
+            if stopping:
+                self._closed = True
+                self._queue.put(None)
+        if stopping:
+            self._writer.join()
+        with self._lock:
+            if not self._file.closed:
+                if self._unsynced:
+                    self._sync()
+                self._file.close()
+
+    def _enqueue(self, record: Dict[str, Any], sync: bool = False) -> None:
+        """書き込みスレッドへ1行渡す（閉じた後は何もしない）"""
+        with self._queue_lock:
+            if not self._closed:
+                self._queue.put((record, sync))
+
+    def _write_loop(self) -> None:
+        """書き込みスレッド：たまった行をまとめて追記し、一定時間・一定行数ごとに fsync する"""
+        while True:
+            try:
+                item = self._queue.get(timeout=SYNC_INTERVAL_SECONDS)
+            except queue.Empty:
+                # 行が途切れたら未同期の分を同期しておく
+                with self._lock:
+                    if self._unsynced and not self._file.closed:
+                        self._sync()
+                continue
+            items = [item]
+            while item is not None:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                items.append(item)
+            entries = [entry for entry in items if entry is not None]
+            try:
+                if entries:
+                    self._write([record for record, _ in entries], sync=any(sync for _, sync in entries))
+            except Exception as e:
+                logger.error(f"RunJournal 書き込みエラー: {self.path}: {e}")
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+            if len(entries) < len(items):
+                return
+
+    def _write(self, records: List[Dict[str, Any]], sync: bool = False) -> None:
+        """行を追記して flush する。fsync は一定時間・一定行数ごとにまとめて行う（sync=True なら即時）"""
+        text = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(text)
+            self._file.flush()
+            self._unsynced += len(records)
+            if (sync or self._unsynced >= SYNC_EVERY_ROWS
+                    or time.monotonic() - self._last_sync >= SYNC_INTERVAL_SECONDS):
+                self._sync()
+
+    def _sync(self) -> None:
+        try:
+            os.fsync(self._file.fileno())
+        except OSError as e:
+            logger.warning(f"RunJournal fsync エラー: {self.path}: {e}")
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+
+def _read_journal(path: str) -> Optional[Tuple[Dict[str, Any], Dict[int, Dict[str, Any]], bool]]:
+    """ジャーナルを読み込み (start情報, 完了行, 正常終了済みか) を返す。読めない場合はNone"""
+    header = None
+    completed: Dict[int, Dict[str, Any]] = {}
+    ended = False
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で終了した最終行は無視する
+                    logger.warning(f"RunJournal: 壊れた行を無視しました: {path}")
+                    continue
+                event = record.get("event")
+                if event == "start":
+                    header = record
+                elif event == "row" and header is not None:
+                    completed[int(record["index"])] = {
+                        "input": header["inputs"][int(record["index"])],
+                        "output": record.get("output", {}),
+                        "status": record.get("status"),
+                        "error_msg": record.get("error_msg", ""),
+                    }
+                elif event == "end":
+                    ended = True
+    except (OSError, KeyError, IndexError, ValueError) as e:
+        logger.warning(f"RunJournal 読み込みエラー: {path}: {e}")
+        return None
+    if header is None:
+        return None
+    return header, completed, ended
+
+
+def find_interrupted_run(journal_dir: str) -> Optional[Dict[str, Any]]:
+    """
+    正常終了していない直近の実行を探す
+    Returns:
+        {"path", "snapshot_path", "header", "completed": {index: result}} または None
+    """
+    if not os.path.isdir(journal_dir):
+        return None
+    paths = sorted(
+        (os.path.join(journal_dir, name) for name in os.listdir(journal_dir) if name.endswith(_JOURNAL_SUFFIX)),
+        reverse=True
+    )
+    for path in paths:
+        loaded = _read_journal(path)
+        if loaded is None:
+            continue
+        header, completed, ended = loaded
+        if ended:
+            discard_run(path)
+            continue
+        return {
+            "path": path,
+            "snapshot_path": os.path.splitext(path)[0] + _SNAPSHOT_SUFFIX,
+            "header": header,
+            "completed": completed,
+        }
+    return None
+
+
+def discard_run(path: str) -> None:
+    """ジャーナルと対応するスナップショットを削除する"""
+    for target in (path, os.path.splitext(path)[0] + _SNAPSHOT_SUFFIX):
+        try:
+            if os.path.exists(target):
+                os.remove(target)
+        except OSError as e:
+            logger.warning(f"RunJournal 削除エラー: {target}: {e}")
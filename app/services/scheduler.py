@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+apply_rule 用の並列実行スケジューラ
+"""
+
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# 同時実行数のデフォルト値（config.json の max_concurrency 未指定時）
+DEFAULT_MAX_CONCURRENCY = 5
+
+# 一時停止・中止指示を確認する間隔（秒）
+CONTROL_POLL_INTERVAL = 0.1
+
+
+class RunControl:
+    """
+    実行中の処理を外部（UIスレッド）から一時停止・再開・中止するための制御フラグ
+    別スレッドから操作されるため threading.Event で状態を持つ
+    """
+
+    def __init__(self):
+        self._paused = threading.Event()
+        self._cancelled = threading.Event()
+
+    def pause(self) -> None:
+        """新しい行の開始を止める（実行中の行は完了まで続行）"""
+        self._paused.set()
+
+    def resume(self) -> None:
+        """一時停止を解除する"""
+        self._paused.clear()
+
+    def cancel(self) -> None:
+        """未開始・実行中の行をすべて中止する"""
+        self._cancelled.set()
+        self._paused.clear()
+
+    @property
+    def is_paused(self) -> bool:
+        return self._paused.is_set()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    async def wait_if_paused(self) -> bool:
+        """一時停止中は解除まで待機する。中止された場合はFalseを返す"""
+        while self._paused.is_set() and not self._cancelled.is_set():
+            await asyncio.sleep(CONTROL_POLL_INTERVAL)
+        return not self._cancelled.is_set()
+
+
+class RowScheduler:
+    """入力行を上限付きの並列数で処理し、入力順に結果を返すスケジューラ"""
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        """
+        Args:
+            max_concurrency: 同時に処理する行数の上限
+        """
+        try:
+            self.max_concurrency = max(1, int(max_concurrency))
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid max_concurrency={max_concurrency!r}, using default {DEFAULT_MAX_CONCURRENCY}")
+            self.max_concurrency = DEFAULT_MAX_CONCURRENCY
+
+    async def run(self, items: Sequence[Any], worker: Callable[[int, Any], Awaitable[Any]],
+                  collect: bool = True, control: Optional[RunControl] = None,
+                  on_skipped: Optional[Callable[[int, Any], None]] = None) -> List[Any]:
+        """
+        items の各要素に worker(index, item) を適用し、入力順の結果リストを返す
+        worker は例外を送出せず、エラーも結果として返すこと
+        collect=False の場合は結果を保持せず空リストを返す（worker 側で逐次処理する場合）
+        control で一時停止中は新しい要素を開始せず、中止時は実行中の worker もキャンセルする
+        中止により完了しなかった要素は on_skipped(index, item) に通知する
+        """
+        results: List[Any] = [None] * len(items) if collect else []
+        if not items:
+            return results
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for idx, item in enumerate(items):
+            queue.put_nowait((idx, item))
+
+        completed = set()
+
+        async def _worker_loop(worker_no: int) -> None:
+            while True:
+                if control is not None and not await control.wait_if_paused():
+                    return
+                try:
+                    idx, item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                logger.debug(f"Scheduler worker#{worker_no} processing index={idx}")
+                result = await worker(idx, item)
+                completed.add(idx)
+                if collect:
+                    results[idx] = result
+
+        worker_count = min(self.max_concurrency, len(items))
+        logger.info(f"RowScheduler 開始: 対象={len(items)}件 並列数={worker_count}")
+        tasks = [asyncio.create_task(_worker_loop(n)) for n in range(worker_count)]
+        watcher = asyncio.create_task(self._watch_cancel(control, tasks)) if control is not None else None
+        try:
+            await asyncio.wait(tasks)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        for task in tasks:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+
+        if len(completed) < len(items):
+            logger.info(f"RowScheduler 中止: 完了={len(completed)}件 未完了={len(items) - len(completed)}件")
+            if on_skipped is not None:
+                for idx, item in enumerate(items):
+                    if idx not in completed:
+                        on_skipped(idx, item)
+        return results
+
+    async def _watch_cancel(self, control: RunControl, tasks: List[asyncio.Task]) -> None:
+        """中止指示を監視し、指示があれば実行中のタスクをキャンセルする"""
+        while not control.is_cancelled:
+            await asyncio.sleep(CONTROL_POLL_INTERVAL)
+        logger.info("RowScheduler: 中止指示を受けたため実行中の処理をキャンセルします")
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+長い動画の区間分割と、区間ごとの解析結果の統合
+ffmpeg のストリームコピーで一定時間ごとに分割し（再エンコードしないため高速）、
+分割結果は元ファイルの内容ハッシュ単位でキャッシュする。ffmpeg がない場合は分割しない
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import time
+from typing import Any, Dict, List, Optional
+
+from utils.config import config_manager
+from utils.file_hash import file_content_hash
+from .ffmpeg_tools import FFmpegError, find_ffmpeg, probe_duration, prune_cache_dir, run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+VIDEO_SEGMENT_DIR_NAME = 'video_segments'
+
+# 動画分割設定のデフォルト値（config.json の video_segmentation で上書き可能）
+DEFAULT_VIDEO_SEGMENTATION_CONFIG = {
+    "enabled": True,
+    "ffmpeg_path": "",            # 空の場合は PATH から ffmpeg を探す
+    "split_above_mb": 100,        # これより大きい動画を分割する
+    "split_above_seconds": 1200,  # これより長い動画を分割する
+    "segment_seconds": 600,       # 1区間の長さ（秒）
+    "max_segment_mb": 80,         # 1区間の目安サイズ。超えそうな場合は区間を短くする
+    "min_segment_seconds": 30,    # 区間の最短長（秒）
+    "reducer": "concat",          # 区間ごとの出力の統合方法（concat / first / last / longest）
+    "field_reducers": {},         # 出力項目ごとの統合方法（{"項目名": "first"} など）
+    "separator": "\n",            # concat で値をつなぐ区切り文字
+    "max_age_days": 7,            # 分割した区間ファイルの保持日数
+}
+
+SEGMENT_REDUCERS = ("concat", "first", "last", "longest")
+
+
+def segment_prompt(prompt: str, index: int, count: int) -> str:
+    """区間を解析するためのプロンプト（分割していない場合はそのまま）"""
+    if count <= 1:
+        return prompt
+    return (
+        f"{prompt}\n\n"
+        f"※このファイルは長い記録を時間順に{count}分割した{index + 1}番目の区間です。"
+        "この区間に含まれる内容だけを基に回答し、該当する内容がない項目は空文字にしてください。"
+    )
+
+
+def merge_segment_outputs(outputs: List[Dict[str, Any]], keys: List[str], reducer: str = "concat",
+                          field_reducers: Optional[Dict[str, str]] = None, separator: str = "\n") -> Dict[str, str]:
+    """
+    区間ごとの出力dictを1行分の出力に統合する
+    Args:
+        outputs: 区間ごとの出力（時間順）
+        keys: 出力項目名のリスト
+        reducer: 既定の統合方法（concat: 重複を除いて連結 / first: 最初の値 / last: 最後の値 / longest: 最長の値）
+        field_reducers: 項目ごとの統合方法
+        separator: concat の区切り文字
+    """
+    field_reducers = field_reducers or {}
+    merged: Dict[str, str] = {}
+    for key in keys:
+        values = [str(out.get(key, "")).strip() for out in outputs]
+        values = [value for value in values if value]
+        method = field_reducers.get(key, reducer)
+        if not values:
+            merged[key] = ""
+        elif method == "first":
+            merged[key] = values[0]
+        elif method == "last":
+            merged[key] = values[-1]
+        elif method == "longest":
+            merged[key] = max(values, key=len)
+        else:
+            if method != "concat":
+                logger.warning(f"未知の統合方法 '{method}' のため concat を使用します（項目: {key}）")
+            merged[key] = separator.join(dict.fromkeys(values))
+    return merged
+
+
+class VideoSegmenter:
+    """大きい・長い動画を区間ファイルに分割する"""
+
+    def __init__(self, ffmpeg: str, cache_dir: str, config: Dict[str, Any]):
+        """
+        Args:
+            ffmpeg: ffmpeg 実行ファイルのパス
+            cache_dir: 区間ファイルの保存先
+            config: video_segmentation 設定（デフォルト値とマージ済み）
+        """
+        self.ffmpeg = ffmpeg
+        self.cache_dir = cache_dir
+        self.split_above_bytes = float(config["split_above_mb"]) * 1024 * 1024
+        self.split_above_seconds = float(config["split_above_seconds"])
+        self.segment_seconds = float(config["segment_seconds"])
+        self.max_segment_bytes = float(config["max_segment_mb"]) * 1024 * 1024
+        self.min_segment_seconds = float(config["min_segment_seconds"])
+        self.reducer = config["reducer"]
+        self.field_reducers = dict(config.get("field_reducers") or {})
+        self.separator = config["separator"]
+        self.max_age_days = float(config["max_age_days"])
+        # 同じ動画の分割を同時に複数実行しないための実行中タスク
+        self._inflight: Dict[str, asyncio.Future] = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._prune()
+
+    @classmethod
+    def from_config(cls, cache_dir: str) -> Optional['VideoSegmenter']:
+        """config.json の video_segmentation 設定から生成する（無効・ffmpeg未検出時はNone）"""
+        cfg = load_segmentation_config()
+        if not cfg.get('enabled'):
+            logger.info("Video segmentation is disabled by config.")
+            return None
+        ffmpeg = find_ffmpeg(cfg.get('ffmpeg_path'))
+        if not ffmpeg:
+            logger.warning("ffmpeg が見つからないため動画の分割を行いません")
+            return None
+        logger.info(f"Video segmentation enabled: ffmpeg={ffmpeg}")
+        return cls(ffmpeg, cache_dir, cfg)
+
+    def _prune(self) -> None:
+        """保持日数を過ぎた区間ファイルを削除する"""
+        removed = prune_cache_dir(self.cache_dir, self.max_age_days)
+        if removed:
+            logger.info(f"VideoSegmenter: 古い区間ファイルを{removed}件削除しました")
+
+    def merge(self, outputs: List[Dict[str, Any]], keys: List[str]) -> Dict[str, str]:
+        """区間ごとの出力を設定された統合方法でまとめる"""
+        return merge_segment_outputs(outputs, keys, self.reducer, self.field_reducers, self.separator)
+
+    def _segment_length(self, size: float, duration: float) -> float:
+        """1区間の長さ（秒）を決める（平均ビットレートから区間サイズが上限を超えないようにする）"""
+        seconds = self.segment_seconds
+        if size > 0 and duration > 0:
+            seconds = min(seconds, duration * self.max_segment_bytes / size)
+        return max(self.min_segment_seconds, int(seconds))
+
+    async def split(self, file_path: str) -> List[str]:
+        """
+        動画を区間ファイルに分割し、時間順のパスのリストを返す
+        分割不要・分割できない場合は元のパスだけを返す
+        Raises:
+            FileNotFoundError: ファイルが存在しない場合
+        """
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"ファイルが見つかりません: {file_path}")
+        size = os.path.getsize(file_path)
+        duration = await probe_duration(self.ffmpeg, file_path)
+        if duration is None:
+            return [file_path]
+        if size <= self.split_above_bytes and duration <= self.split_above_seconds:
+            return [file_path]
+        seconds = self._segment_length(size, duration)
+        if duration <= seconds:
+            return [file_path]
+        content_hash = await asyncio.to_thread(file_content_hash, file_path)
+        if not content_hash:
+            return [file_path]
+
+        key = f"{content_hash}_{seconds:.0f}s"
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._split_to_cache(file_path, key, seconds))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        try:
+            # 待機側がキャンセルされても、同じ動画を待つ他の呼び出しのために分割は続ける
+            return list(await asyncio.shield(task))
+        except (FFmpegError, OSError) as e:
+            logger.warning(f"VideoSegmenter: 分割に失敗したため動画をそのまま送ります {file_path}: {e}")
+            return [file_path]
+
+    async def _split_to_cache(self, file_path: str, key: str, seconds: float) -> List[str]:
+        """ストリームコピーで区間ファイルを作成する（作成済みならそれを返す）"""
+        out_dir = os.path.join(self.cache_dir, key)
+        if os.path.isdir(out_dir):
+            segments = self._list_segments(out_dir)
+            if segments:
+                logger.debug(f"VideoSegmenter: キャッシュ済みの区間ファイルを使用 {os.path.basename(file_path)}")
+                return segments
+
+        tmp_dir = f"{out_dir}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        start_time = time.time()
+        try:
+            await run_ffmpeg(self.ffmpeg, [
+                "-loglevel", "error", "-y",
+                "-i", file_path,
+                "-map", "0:v:0", "-map", "0:a?",
+                "-c", "copy",
+                "-f", "segment",
+                "-segment_time", f"{seconds:.0f}",
+                "-reset_timestamps", "1",
+                os.path.join(tmp_dir, "segment_%03d.mp4"),
+            ])
+            if not self._list_segments(tmp_dir):
+                raise FileNotFoundError(f"区間ファイルが作成されませんでした: {file_path}")
+            shutil.rmtree(out_dir, ignore_errors=True)
+            os.replace(tmp_dir, out_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        segments = self._list_segments(out_dir)
+        logger.info(f"✂️ 動画を分割: {os.path.basename(file_path)} → {len(segments)}区間 "
+                    f"({seconds:.0f}秒ごと, {time.time() - start_time:.1f}秒)")
+        return segments
+
+    @staticmethod
+    def _list_segments(directory: str) -> List[str]:
+        return sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.startswith("segment_") and name.endswith(".mp4")
+        )
+
+
+def load_segmentation_config() -> Dict[str, Any]:
+    """video_segmentation 設定をデフォルト値とマージして返す"""
+    return {**DEFAULT_VIDEO_SEGMENTATION_CONFIG, **config_manager.get_config().get('video_segmentation', {})}
+
+
+def video_segmentation_available() -> bool:
+    """動画の分割が使える（有効設定かつ ffmpeg がある）かどうか"""
+    cfg = load_segmentation_config()
+    return bool(cfg.get('enabled')) and find_ffmpeg(cfg.get('ffmpeg_path')) is not None
@@ -201,6 +201,18 @@ class AIPanel(QWidget):
         process_layout.addWidget(self.process_selected_btn)
         process_layout.addWidget(self.process_all_btn)
         
+        # 実行中の一時停止・中止ボタン（処理中のみ表示）
+        run_control_layout = QHBoxLayout()
+        self.pause_btn = QPushButton("一時停止")
+        self.stop_btn = QPushButton("中止")
+        self.pause_btn.setStyleSheet("padding: 8px; background-color: #3A506B; color: white; border-radius: 3px; font-weight: bold;")
+        self.stop_btn.setStyleSheet("padding: 8px; background-color: #C0504D; color: white; border-radius: 3px; font-weight: bold;")
+        run_control_layout.addWidget(self.pause_btn)
+        run_control_layout.addWidget(self.stop_btn)
+        process_layout.addLayout(run_control_layout)
+        self.pause_btn.hide()
+        self.stop_btn.hide()
+        
         ai_layout.addWidget(process_frame)
         
         # 下部の余白を追加
@@ -336,6 +348,13 @@ class AIPanel(QWidget):
             self.process_all_btn.setStyleSheet(all_button_style)
             logger.debug("処理ボタンを有効化しました")
 
+    def set_run_controls_visible(self, running: bool):
+        """処理実行中の一時停止・中止ボタンの表示を切り替える"""
+        for btn in (self.pause_btn, self.stop_btn):
+            btn.setVisible(running)
+            btn.setEnabled(running)
+        self.pause_btn.setText("一時停止")
+
     def apply_history_rule(self, rule_id: int):
         """履歴から選択したルールを適用"""
         title = self.rule_map.get(rule_id, {}).get('title', '')
@@ -12,6 +12,8 @@ logger = logging.getLogger(__name__)
 
 # ProcessModeクラスをインポート
 from app.services.rule_service import ProcessMode
+from app.services.video_segmenter import video_segmentation_available
+from app.services.audio_preprocess import audio_preprocessing_available
 
 class CustomTableWidget(QTableWidget):
     def __init__(self, rows, cols, parent=None):
@@ -463,6 +465,9 @@ class DropAreaLabel(QLabel):
         file_paths = []
         invalid_files = []
         large_files = []
+        # ffmpeg で分割・変換できる場合、動画・音声はサイズ制限の対象外（区間ごとに解析する）
+        can_split_video = video_segmentation_available()
+        can_split_audio = audio_preprocessing_available()
         
         for url in urls:
             file_path = url.toLocalFile()
@@ -476,7 +481,10 @@ class DropAreaLabel(QLabel):
             # ファイルサイズチェック
             try:
                 file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
-                if file_size_mb > 100:  # 100MB制限
+                is_video = file_path.lower().endswith('.mp4')
+                is_audio = file_path.lower().endswith('.mp3')
+                splittable = (is_video and can_split_video) or (is_audio and can_split_audio)
+                if file_size_mb > 100 and not splittable:  # 100MB制限
                     large_files.append(f"{os.path.basename(file_path)} ({file_size_mb:.1f}MB)")
                     continue
             except Exception as e:
@@ -501,6 +509,8 @@ class DropAreaLabel(QLabel):
                 self.parent_panel, 
                 "ファイル処理エラー", 
                 "\n".join(error_messages) + "\n\n対応形式: JPG, PNG, MP4, MP3\n最大サイズ: 100MB"
+                + ("（動画・音声は ffmpeg で分割するため制限なし）" if can_split_video or can_split_audio
+                   else "（ffmpeg を導入すると大きな動画・音声も処理できます）")
             )
         
         # 有効なファイルがある場合は処理を実行
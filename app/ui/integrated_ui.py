@@ -14,14 +14,15 @@ logger = logging.getLogger(__name__)
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QHBoxLayout, QSplitter, 
                               QMessageBox, QVBoxLayout, QRadioButton, QButtonGroup, QLabel, QFrame,
                               QSizePolicy)
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QTimer
 from PySide6.QtGui import QFont
 
 from app.ui.excel_panel import ExcelPanel
 from app.ui.ai_panel import AIPanel
 from app.ui.config_dialog import ConfigDialog
 from app.ui.help_dialog import HelpDialog
-from app.workers import AIWorker
+from app.workers import AIWorker, get_ai_service
+from app.services.run_journal import RunJournal, RUN_JOURNAL_DIR_NAME, find_interrupted_run, discard_run
 
 BACKUP_CSV_NAME = 'last_processed.csv'
 
@@ -171,6 +172,9 @@ class IntegratedExcelUI(QMainWindow):
         
         # ワーカースレッド用変数の初期化
         self.ai_worker = None
+        
+        # 前回中断された処理があれば再開を確認（ウィンドウ表示後に実行）
+        QTimer.singleShot(0, self.check_interrupted_run)
     
     def create_mode_selection_ui(self, parent_layout):
         """モード選択UIを作成"""
@@ -265,7 +269,105 @@ class IntegratedExcelUI(QMainWindow):
         # 処理ボタンのイベント接続
         self.ai_panel.process_selected_btn.clicked.connect(self.process_selected)
         self.ai_panel.process_all_btn.clicked.connect(self.process_all)
+        # 実行中の一時停止・中止ボタン
+        self.ai_panel.pause_btn.clicked.connect(self.toggle_pause)
+        self.ai_panel.stop_btn.clicked.connect(self.stop_processing)
+
+    def toggle_pause(self):
+        """実行中の処理を一時停止・再開する"""
+        if self.ai_worker is None or not self.ai_worker.isRunning():
+            return
+        if self.ai_worker.is_paused():
+            self.ai_worker.resume()
+            self.ai_panel.pause_btn.setText("一時停止")
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+        else:
+            # 実行中の行は完了まで続き、新しい行は開始しない
+            self.ai_worker.pause()
+            self.ai_panel.pause_btn.setText("再開")
+            QApplication.restoreOverrideCursor()
+
+    def stop_processing(self):
+        """実行中の処理を中止する（完了済みの行はそのまま残る）"""
+        if self.ai_worker is None or not self.ai_worker.isRunning():
+            return
+        if self.ai_worker.is_paused():
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+        self.ai_worker.stop()
+        self.ai_panel.pause_btn.setEnabled(False)
+        self.ai_panel.stop_btn.setEnabled(False)
     
+    def _journal_dir(self):
+        """実行ジャーナルの保存ディレクトリ（バックアップCSVと同じ場所）"""
+        base_dir = os.path.dirname(sys.executable) if getattr(sys, 'frozen', False) else os.path.dirname(os.path.abspath(sys.argv[0]))
+        return os.path.join(base_dir, RUN_JOURNAL_DIR_NAME)
+
+    def _start_journal(self, rule_id, rule_mode, rows, inputs):
+        """実行ジャーナルと開始時点のテーブルのスナップショットを作成する（失敗時はNone）"""
+        journal = None
+        try:
+            journal = RunJournal.start(self._journal_dir(), rule_id, rule_mode, rows, inputs)
+            self.excel_panel.save_csv(journal.snapshot_path)
+            return journal
+        except Exception as e:
+            logger.error(f"実行ジャーナル作成エラー: {e}")
+            if journal is not None:
+                # 書き込みスレッドを止めてファイルを閉じる
+                journal.close()
+            return None
+
+    def check_interrupted_run(self):
+        """前回中断された処理があれば、再開するかを確認する"""
+        interrupted = find_interrupted_run(self._journal_dir())
+        if interrupted is None:
+            return
+        header = interrupted['header']
+        rule_id = header.get('rule_id')
+        total = len(header.get('rows', []))
+        done = len(interrupted['completed'])
+        if rule_id not in self.ai_panel.rule_map or not os.path.exists(interrupted['snapshot_path']):
+            logger.warning(f"中断された処理を再開できないため破棄します: {interrupted['path']}")
+            discard_run(interrupted['path'])
+            return
+        title = self.ai_panel.rule_map[rule_id].get('title', str(rule_id))
+        answer = QMessageBox.question(
+            self, "中断された処理",
+            f"前回の処理が中断されています。\nルール「{title}」: {done}/{total}件 完了\n\n残りの行から再開しますか？",
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if answer == QMessageBox.Yes:
+            self.resume_interrupted_run(interrupted)
+        else:
+            logger.info(f"中断された処理を破棄: {interrupted['path']}")
+            discard_run(interrupted['path'])
+
+    def resume_interrupted_run(self, interrupted):
+        """ジャーナルからテーブルと完了行を復元し、残りの行を処理する"""
+        from PySide6.QtWidgets import QTableWidgetItem
+        header = interrupted['header']
+        rule_id = header['rule_id']
+        rows = header['rows']
+        logger.info(f"中断された処理を再開: {interrupted['path']} 完了={len(interrupted['completed'])}/{len(rows)}件")
+        # ルールのモードとテンプレートを復元
+        mode_buttons = {ProcessMode.NORMAL: self.normal_radio, ProcessMode.IMAGE: self.image_radio,
+                        ProcessMode.VIDEO: self.video_radio, ProcessMode.AUDIO: self.audio_radio}
+        button = mode_buttons.get(header.get('mode'), self.normal_radio)
+        button.setChecked(True)
+        self.on_mode_changed(button)
+        self.ai_panel.apply_history_rule(rule_id)
+        # 開始時点のテーブルを読み込み、完了済みの行の結果を反映
+        tbl = self.excel_panel.data_table
+        self.excel_panel.load_csv(interrupted['snapshot_path'])
+        self._on_rows_ready(list(interrupted['completed'].items()), rows, tbl)
+        remaining = [row for index, row in enumerate(rows) if index not in interrupted['completed']]
+        for row in remaining:
+            item = QTableWidgetItem("未処理")
+            item.setTextAlignment(Qt.AlignCenter)
+            tbl.setItem(row, 0, item)
+        discard_run(interrupted['path'])
+        if remaining:
+            self._run_data_rows(rule_id, remaining)
+
     def process_selected(self):
         """選択行のみ処理する"""
         # 現在のルールチェック
@@ -324,44 +426,29 @@ class IntegratedExcelUI(QMainWindow):
         # UIロック表示
         self.ai_panel.process_selected_btn.setEnabled(False)
         self.ai_panel.process_all_btn.setEnabled(False)
+        self.ai_panel.set_run_controls_visible(True)
         QApplication.setOverrideCursor(Qt.WaitCursor)
         
         # ワーカースレッドでAI処理を実行
         logger.info(f"process_selected 開始: rule_id={rule_id} mode={rule_mode} 対象行数={len(inputs)}件")
-        self.ai_worker = AIWorker(self.ai_panel.rule_service, rule_id, inputs)
+        # 実データテーブルの処理は再開できるようジャーナルに記録
+        journal = self._start_journal(rule_id, rule_mode, rows, inputs) if active_table is self.excel_panel.data_table else None
+        self.ai_worker = AIWorker(self.ai_panel.rule_service, rule_id, inputs, journal)
         
-        # 処理完了とエラーハンドリングのシグナル接続
-        self.ai_worker.finished.connect(lambda results: self._on_process_selected_finished(results, rows, active_table))
+        # 行単位の結果反映・処理完了・エラーハンドリングのシグナル接続
+        self.ai_worker.rows_ready.connect(lambda batch: self._on_rows_ready(batch, rows, active_table))
+        self.ai_worker.finished.connect(lambda summary: self._on_process_selected_finished(summary, rows, active_table))
         self.ai_worker.error_occurred.connect(self._on_process_selected_error)
         
         # ワーカースレッド開始
         self.ai_worker.start()
     
-    def _on_process_selected_finished(self, results, rows, active_table):
-        """process_selected処理完了時のコールバック"""
+    def _on_process_selected_finished(self, summary, rows, active_table):
+        """process_selected処理完了時のコールバック（各行の結果は _on_rows_ready で反映済み）"""
         try:
-            from PySide6.QtWidgets import QTableWidgetItem
-            for row, result in zip(rows, results):
-                status = result.get('status')
-                text = "完了" if status == 'success' else "エラー"
-                check_item = QTableWidgetItem(text)
-                check_item.setTextAlignment(Qt.AlignCenter)
-                if status != 'success':
-                    check_item.setToolTip(result.get('error_msg', ''))
-                active_table.setItem(row, 0, check_item)
-                # 出力フィールド更新
-                output = result.get('output', {})
-                for header, val in output.items():
-                    for c in range(active_table.columnCount()):
-                        hdr = active_table.item(0, c)
-                        if hdr and hdr.text() == header:
-                            active_table.setItem(row, c, QTableWidgetItem(val))
-                            break
-            
             # 処理完了ログ
-            success_count = sum(1 for r in results if r.get('status') == 'success')
-            error_count = len(results) - success_count
-            logger.info(f"apply_rule 完了: success={success_count}件 error={error_count}件")
+            logger.info(f"apply_rule 完了: success={summary.get('success', 0)}件 error={summary.get('error', 0)}件 "
+                        f"cancelled={summary.get('cancelled', 0)}件 (結果キャッシュ利用={summary.get('cached', 0)}件)")
             
             # バックアップCSVを保存
             try:
@@ -376,6 +463,7 @@ class IntegratedExcelUI(QMainWindow):
             # UIロック解除
             self.ai_panel.process_selected_btn.setEnabled(True)
             self.ai_panel.process_all_btn.setEnabled(True)
+            self.ai_panel.set_run_controls_visible(False)
             QApplication.restoreOverrideCursor()
             
     def _on_process_selected_error(self, error_msg):
@@ -394,8 +482,40 @@ class IntegratedExcelUI(QMainWindow):
         # UIロック解除
         self.ai_panel.process_selected_btn.setEnabled(True)
         self.ai_panel.process_all_btn.setEnabled(True)
+        self.ai_panel.set_run_controls_visible(False)
         QApplication.restoreOverrideCursor()
     
+    def _on_rows_ready(self, batch, rows, table):
+        """AIWorker.rows_ready で届いた行結果をテーブルへ逐次反映する"""
+        from PySide6.QtWidgets import QTableWidgetItem
+        # ヘッダー名 → 列番号（同名の列がある場合は左側を優先）
+        header_cols = {}
+        for c in range(table.columnCount()):
+            hdr = table.item(0, c)
+            if hdr and hdr.text() and hdr.text() not in header_cols:
+                header_cols[hdr.text()] = c
+        for index, result in batch:
+            row = rows[index]
+            status = result.get('status')
+            if status == 'cancelled':
+                # 中止された行は未処理に戻し、次回の一括処理の対象にする
+                check_item = QTableWidgetItem("未処理")
+                check_item.setTextAlignment(Qt.AlignCenter)
+                table.setItem(row, 0, check_item)
+                continue
+            text = "完了" if status == 'success' else "エラー"
+            check_item = QTableWidgetItem(text)
+            check_item.setTextAlignment(Qt.AlignCenter)
+            if status != 'success':
+                check_item.setToolTip(result.get('error_msg', ''))
+            table.setItem(row, 0, check_item)
+            # 出力フィールド更新
+            output = result.get('output', {})
+            for header, val in output.items():
+                c = header_cols.get(header)
+                if c is not None:
+                    table.setItem(row, c, QTableWidgetItem(val))
+
     def process_all(self):
         """すべての行を処理する"""
         rule_id = self.ai_panel.current_rule_id
@@ -423,6 +543,11 @@ class IntegratedExcelUI(QMainWindow):
                 rows.append(row)
         if not rows:
             return
+        self._run_data_rows(rule_id, rows)
+
+    def _run_data_rows(self, rule_id, rows):
+        """実データテーブルの指定行にルールを適用する（process_all・中断再開で共用）"""
+        tbl = self.excel_panel.data_table
         # 処理前に進捗を「処理中」に設定
         from PySide6.QtWidgets import QTableWidgetItem
         for row in rows:
@@ -438,44 +563,30 @@ class IntegratedExcelUI(QMainWindow):
         # UIロック表示
         self.ai_panel.process_selected_btn.setEnabled(False)
         self.ai_panel.process_all_btn.setEnabled(False)
+        self.ai_panel.set_run_controls_visible(True)
         QApplication.setOverrideCursor(Qt.WaitCursor)
         
         # ワーカースレッドでAI処理を実行
         logger.info(f"process_all 開始: rule_id={rule_id} 対象行数={len(inputs)}件")
-        self.ai_worker = AIWorker(self.ai_panel.rule_service, rule_id, inputs)
+        selected_rule = next((r for r in self.ai_panel.rule_service.get_rules() if r.get('id') == rule_id), None)
+        rule_mode = selected_rule.get('mode', 'normal') if selected_rule else 'normal'
+        journal = self._start_journal(rule_id, rule_mode, rows, inputs)
+        self.ai_worker = AIWorker(self.ai_panel.rule_service, rule_id, inputs, journal)
         
-        # 処理完了とエラーハンドリングのシグナル接続
-        self.ai_worker.finished.connect(lambda results: self._on_process_all_finished(results, rows, tbl))
+        # 行単位の結果反映・処理完了・エラーハンドリングのシグナル接続
+        self.ai_worker.rows_ready.connect(lambda batch: self._on_rows_ready(batch, rows, tbl))
+        self.ai_worker.finished.connect(lambda summary: self._on_process_all_finished(summary, rows, tbl))
         self.ai_worker.error_occurred.connect(self._on_process_all_error)
         
         # ワーカースレッド開始
         self.ai_worker.start()
 
-    def _on_process_all_finished(self, results, rows, tbl):
-        """process_all処理完了時のコールバック"""
+    def _on_process_all_finished(self, summary, rows, tbl):
+        """process_all処理完了時のコールバック（各行の結果は _on_rows_ready で反映済み）"""
         try:
-            from PySide6.QtWidgets import QTableWidgetItem
-            for row, result in zip(rows, results):
-                status = result.get('status')
-                text = "完了" if status == 'success' else "エラー"
-                check_item = QTableWidgetItem(text)
-                check_item.setTextAlignment(Qt.AlignCenter)
-                if status != 'success':
-                    check_item.setToolTip(result.get('error_msg', ''))
-                tbl.setItem(row, 0, check_item)
-                # 出力フィールド更新
-                output = result.get('output', {})
-                for header, val in output.items():
-                    for c in range(tbl.columnCount()):
-                        hdr = tbl.item(0, c)
-                        if hdr and hdr.text() == header:
-                            tbl.setItem(row, c, QTableWidgetItem(val))
-                            break
-            
             # 処理完了ログ
-            success_count = sum(1 for r in results if r.get('status') == 'success')
-            error_count = len(results) - success_count
-            logger.info(f"apply_rule 完了: success={success_count}件 error={error_count}件")
+            logger.info(f"apply_rule 完了: success={summary.get('success', 0)}件 error={summary.get('error', 0)}件 "
+                        f"cancelled={summary.get('cancelled', 0)}件 (結果キャッシュ利用={summary.get('cached', 0)}件)")
             
             # バックアップCSVを保存
             try:
@@ -490,6 +601,7 @@ class IntegratedExcelUI(QMainWindow):
             # UIロック解除
             self.ai_panel.process_selected_btn.setEnabled(True)
             self.ai_panel.process_all_btn.setEnabled(True)
+            self.ai_panel.set_run_controls_visible(False)
             QApplication.restoreOverrideCursor()
             
     def _on_process_all_error(self, error_msg):
@@ -508,6 +620,7 @@ class IntegratedExcelUI(QMainWindow):
         # UIロック解除
         self.ai_panel.process_selected_btn.setEnabled(True)
         self.ai_panel.process_all_btn.setEnabled(True)
+        self.ai_panel.set_run_controls_visible(False)
         QApplication.restoreOverrideCursor()
 
     def load_csv(self):
@@ -540,6 +653,16 @@ class IntegratedExcelUI(QMainWindow):
         dialog = HelpDialog(self)
         dialog.exec()
 
+    def closeEvent(self, event):
+        """終了時に常駐AIサービスを停止する（処理中の実行はジャーナルから再開可能）"""
+        get_ai_service().shutdown()
+        image_preprocessor = self.ai_panel.rule_service.gemini.image_preprocessor
+        if image_preprocessor is not None:
+            image_preprocessor.shutdown()
+        if self.ai_worker is not None:
+            self.ai_worker.wait(5000)
+        super().closeEvent(event)
+
     # バックアップCSVを開く
     def open_backup(self):
         """最後に処理したCSVバックアップファイルを開く"""
@@ -4,5 +4,6 @@
 """
 
 from .ai_worker import AIWorker
+from .ai_service import AIService, get_ai_service
 
-__all__ = ['AIWorker'] 
\ No newline at end of file
+__all__ = ['AIWorker', 'AIService', 'get_ai_service'] 
\ No newline at end of file
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+AI処理用の常駐サービススレッド
+1つのイベントループを保持し続け、UIから投入された非同期ジョブを順次受け付けて実行する
+（処理のたびにイベントループ・スレッドプール・HTTP接続を作り直さないようにする）
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from typing import Any, Coroutine, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AIService:
+    """専用スレッドで常駐するイベントループにジョブを投入するサービス"""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """サービススレッドを起動する（起動済みなら何もしない）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._ready.clear()
+            self._thread = threading.Thread(target=self._run_loop, name="AIServiceLoop", daemon=True)
+            self._thread.start()
+        self._ready.wait()
+
+    def _run_loop(self) -> None:
+        """サービススレッド本体：イベントループを停止指示まで回し続ける"""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        logger.info("AIService: イベントループ開始")
+        self._ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            # 残っているタスクを片付けてからループを閉じる
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.run_until_complete(loop.shutdown_default_executor())
+            loop.close()
+            self._loop = None
+            logger.info("AIService: イベントループ終了")
+
+    def submit(self, coro: Coroutine[Any, Any, Any]) -> concurrent.futures.Future:
+        """コルーチンをサービスのイベントループに投入し、完了を待てる Future を返す"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro: Coroutine[Any, Any, Any]) -> Any:
+        """コルーチンを投入して完了まで待ち、結果を返す（例外はそのまま送出）"""
+        return self.submit(coro).result()
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """イベントループを停止し、サービススレッドの終了を待つ"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._thread = None
+        if loop is None or thread is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+
+
+_service: Optional[AIService] = None
+_service_lock = threading.Lock()
+
+
+def get_ai_service() -> AIService:
+    """アプリ全体で共有する AIService を返す"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = AIService()
+        return _service
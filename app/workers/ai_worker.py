@@ -6,48 +6,118 @@ AI処理用ワーカースレッド
 import logging
 import asyncio
 from PySide6.QtCore import QThread, Signal
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
+
+from app.services.scheduler import RunControl
+from .ai_service import get_ai_service
 
 logger = logging.getLogger(__name__)
 
+# 行結果をUIへまとめて送る間隔（秒）
+ROWS_FLUSH_INTERVAL = 0.1
+
 
 class AIWorker(QThread):
     """AI処理を別スレッドで実行するワーカークラス"""
     
     # シグナル定義
-    finished = Signal(list)      # 処理完了時に結果リストを送信
+    rows_ready = Signal(list)    # 完了した行の [(index, result), ...] をまとめて送信
+    finished = Signal(dict)      # 処理完了時に集計 {"total", "success", "error", "cancelled"} を送信
     error_occurred = Signal(str) # エラー発生時にエラーメッセージを送信
     
-    def __init__(self, rule_service, rule_id: int, inputs: List[str]):
+    def __init__(self, rule_service, rule_id: int, inputs: List[str], journal=None):
         """
         Args:
             rule_service: RuleServiceのインスタンス
             rule_id: 適用するルールのID
             inputs: 処理対象の入力データリスト
+            journal: 完了行を記録する RunJournal（省略時は記録しない）
         """
         super().__init__()
         self.rule_service = rule_service
         self.rule_id = rule_id
         self.inputs = inputs
+        self.journal = journal
+        self.control = RunControl()
+        self._buffer: List[Tuple[int, Dict[str, Any]]] = []
+
+    def stop(self):
+        """処理を中止する（完了済みの行の結果は保持される）"""
+        logger.info("AIWorker: 中止を要求")
+        self.control.cancel()
+
+    def pause(self):
+        """実行中の行の完了を待って、新しい行の開始を止める"""
+        logger.info("AIWorker: 一時停止を要求")
+        self.control.pause()
+
+    def resume(self):
+        """一時停止を解除する"""
+        logger.info("AIWorker: 再開を要求")
+        self.control.resume()
+
+    def is_paused(self) -> bool:
+        return self.control.is_paused
         
     def run(self):
         """別スレッドで実行されるメイン処理"""
         try:
             logger.info(f"AIWorker開始: rule_id={self.rule_id}, 対象行数={len(self.inputs)}件")
             
-            # AI処理実行（非同期メソッドをasyncio.run()で呼び出し）
-            results = asyncio.run(self.rule_service.apply_rule(self.rule_id, self.inputs))
+            # AI処理実行（常駐サービスのイベントループで実行し、完了を待つ）
+            summary = get_ai_service().run(self._run_stream())
             
-            logger.info(f"AIWorker完了: 結果件数={len(results)}件")
+            logger.info(f"AIWorker完了: 結果件数={summary['total']}件")
+            if self.journal is not None:
+                self.journal.finish(summary)
             
             # 成功時のシグナル送信
-            self.finished.emit(results)
+            self.finished.emit(summary)
             
         except Exception as e:
             logger.error(f"AIWorker エラー: {e}")
+            if self.journal is not None:
+                # 途中までの結果から再開できるようジャーナルは残す
+                self.journal.close()
             # エラー時のシグナル送信
             self.error_occurred.emit(str(e))
 
+    async def _run_stream(self) -> Dict[str, int]:
+        """完了した行を受け取り、ROWS_FLUSH_INTERVAL 秒ごとにまとめて rows_ready で送信する"""
+        summary = {"total": 0, "success": 0, "error": 0, "cancelled": 0, "cached": 0}
+        stop = asyncio.Event()
+
+        async def _flush_loop():
+            while not stop.is_set():
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=ROWS_FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._flush()
+
+        flusher = asyncio.create_task(_flush_loop())
+        try:
+            async for index, result in self.rule_service.apply_rule_stream(self.rule_id, self.inputs, self.control):
+                if self.journal is not None:
+                    self.journal.record(index, result)
+                self._buffer.append((index, result))
+                summary["total"] += 1
+                status = result.get("status")
+                summary[status if status in summary else "error"] += 1
+                if result.get("cached"):
+                    summary["cached"] += 1
+        finally:
+            stop.set()
+            await flusher
+            self._flush()
+        return summary
+
+    def _flush(self):
+        """バッファ済みの行結果を送信する"""
+        if self._buffer:
+            batch, self._buffer = self._buffer, []
+            self.rows_ready.emit(batch)
+
 
 class RuleCreationWorker(QThread):
     """ルール作成・再生成を別スレッドで実行するワーカークラス"""
@@ -76,11 +146,11 @@ class RuleCreationWorker(QThread):
             if self.rule_id is None:
                 logger.info(f"RuleCreationWorker開始: 新規作成 mode={self.mode}, サンプル数={len(self.samples)}件")
                 # 新規作成
-                result = asyncio.run(self.rule_service.create_rule(self.samples, self.mode))
+                result = get_ai_service().run(self.rule_service.create_rule(self.samples, self.mode))
             else:
                 logger.info(f"RuleCreationWorker開始: 再生成 rule_id={self.rule_id}, mode={self.mode}, サンプル数={len(self.samples)}件")
                 # 再生成
-                result = asyncio.run(self.rule_service.regenerate_rule(self.rule_id, self.samples, self.mode))
+                result = get_ai_service().run(self.rule_service.regenerate_rule(self.rule_id, self.samples, self.mode))
             
             logger.info(f"RuleCreationWorker完了: result={result}")
             
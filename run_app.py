@@ -4,6 +4,7 @@
 
 import sys
 import logging
+import multiprocessing
 from PySide6.QtWidgets import QApplication
 from app.ui.integrated_ui import IntegratedExcelUI
 
@@ -32,4 +33,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # 画像縮小用のプロセスプールを exe 化した環境でも使えるようにする
+    multiprocessing.freeze_support()
     main() 
\ No newline at end of file
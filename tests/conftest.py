@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+# リポジトリ直下（app / utils パッケージ）を import できるようにする
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""AudioPreprocessor のチャンク区切りの確認"""
+
+from app.services.audio_preprocess import DEFAULT_AUDIO_PREPROCESS_CONFIG, AudioPreprocessor
+
+
+def _preprocessor(tmp_path, **overrides):
+    config = {**DEFAULT_AUDIO_PREPROCESS_CONFIG, "chunk_seconds": 600, "boundary_search_seconds": 30, **overrides}
+    return AudioPreprocessor("ffmpeg", str(tmp_path), config)
+
+
+def test_chunks_do_not_overlap_and_cut_at_nearby_silence(tmp_path):
+    preprocessor = _preprocessor(tmp_path)
+    silences = [(100.0, 101.0), (585.0, 587.0), (611.0, 612.0), (1300.0, 1302.0)]
+    bounds = preprocessor._chunk_bounds(1500.0, silences)
+    # 600秒付近では最も近い無音（611.5）、1211.5秒付近には範囲内の無音がないのでその位置で区切る
+    assert bounds == [(0.0, 611.5), (611.5, 1211.5), (1211.5, None)]
+    for (_, end), (start, _) in zip(bounds, bounds[1:]):
+        assert end == start
+
+
+def test_short_recording_is_one_chunk(tmp_path):
+    assert _preprocessor(tmp_path)._chunk_bounds(500.0, []) == [(0.0, None)]
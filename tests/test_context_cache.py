@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""ContextCacheManager のハンドルの作成・再利用・破棄の確認（LocalContextCacheBackend を使用）"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("google.genai")
+
+from app.services.context_cache import (
+    DEFAULT_CONTEXT_CACHE_CONFIG, CachePrefix, ContextCacheManager, LocalContextCacheBackend
+)
+
+LONG_TEXT = "ルール" * 100
+
+
+def _manager(backend=None, **overrides):
+    config = {**DEFAULT_CONTEXT_CACHE_CONFIG, "min_tokens": 100, **overrides}
+    return ContextCacheManager(backend or LocalContextCacheBackend(), config)
+
+
+def test_short_prefix_is_not_cached():
+    manager = _manager()
+    assert asyncio.run(manager.acquire("m", CachePrefix(1, "短い"))) is None
+    assert manager.backend.created == 0
+    assert manager.stats["skipped"] == 1
+
+
+def test_model_threshold_overrides_default():
+    manager = _manager(model_min_tokens={"small": 10000})
+    assert manager.threshold("small") == 10000
+    assert manager.threshold("other") == 100
+    assert asyncio.run(manager.acquire("small", CachePrefix(1, LONG_TEXT))) is None
+
+
+def test_handle_is_reused_and_shared_between_concurrent_rows():
+    manager = _manager()
+
+    async def scenario():
+        first = await asyncio.gather(*[manager.acquire("m", CachePrefix(1, LONG_TEXT)) for _ in range(5)])
+        again = await manager.acquire("m", CachePrefix(1, LONG_TEXT))
+        other_model = await manager.acquire("m2", CachePrefix(1, LONG_TEXT))
+        return first, again, other_model
+
+    first, again, other_model = asyncio.run(scenario())
+    assert len({handle.name for handle in first}) == 1
+    assert again is first[0]
+    assert again.inline
+    assert other_model.name != again.name
+    assert manager.backend.created == 2
+
+
+def test_invalidate_deletes_handles_of_the_rule():
+    manager = _manager()
+
+    async def scenario():
+        old = await manager.acquire("m", CachePrefix(1, LONG_TEXT))
+        kept = await manager.acquire("m", CachePrefix(2, LONG_TEXT))
+        manager.invalidate(1)
+        new = await manager.acquire("m", CachePrefix(1, LONG_TEXT))
+        return old, kept, new
+
+    old, kept, new = asyncio.run(scenario())
+    assert new.name != old.name
+    assert old.name not in manager.backend.entries
+    assert kept.name in manager.backend.entries
+    assert manager.backend.deleted == 1
+
+
+def test_handle_created_during_invalidate_is_not_reused():
+    class SlowBackend(LocalContextCacheBackend):
+        async def create(self, model, text, ttl_seconds, display_name):
+            manager.invalidate(1)
+            return await super().create(model, text, ttl_seconds, display_name)
+
+    manager = _manager(SlowBackend())
+
+    async def scenario():
+        stale = await manager.acquire("m", CachePrefix(1, LONG_TEXT))
+        fresh = await manager.acquire("m", CachePrefix(1, LONG_TEXT))
+        return stale, fresh
+
+    stale, fresh = asyncio.run(scenario())
+    # 作成中に破棄された分はそのリクエストだけで使い、次の acquire で削除して作り直す
+    assert stale is not None and fresh.name != stale.name
+    assert stale.name not in manager.backend.entries
+
+
+def test_failed_create_backs_off():
+    class FailingBackend(LocalContextCacheBackend):
+        async def create(self, model, text, ttl_seconds, display_name):
+            self.created += 1
+            raise RuntimeError("400 INVALID_ARGUMENT")
+
+    manager = _manager(FailingBackend())
+
+    async def scenario():
+        return [await manager.acquire("m", CachePrefix(1, LONG_TEXT)) for _ in range(3)]
+
+    assert asyncio.run(scenario()) == [None, None, None]
+    assert manager.backend.created == 1
+    assert manager.stats["failed"] == 1
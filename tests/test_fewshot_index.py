@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""FewShotIndex の類似度計算の確認"""
+
+import pytest
+
+from app.services import fewshot_index
+from app.services.fewshot_index import FewShotIndex
+
+SAMPLES = ["東京都港区", "大阪府大阪市", "北海道札幌市"]
+
+
+@pytest.fixture(params=[True, False], ids=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param and not fewshot_index.NUMPY_AVAILABLE:
+        pytest.skip("numpy is not installed")
+    monkeypatch.setattr(fewshot_index, "NUMPY_AVAILABLE", request.param)
+
+
+def test_exact_sample_scores_one(backend):
+    index = FewShotIndex(SAMPLES)
+    doc, score = index.query("東京都港区", k=1)[0]
+    assert doc == 0 and score == pytest.approx(1.0, abs=1e-5)
+
+
+def test_unknown_ngrams_lower_the_similarity(backend):
+    index = FewShotIndex(SAMPLES)
+    # サンプルを含むだけの長い入力は、語彙にない n-gram の分だけ類似度が下がる（1.0 にはならない）
+    doc, score = index.query("東京都港区 株式会社サンプル商事 第二営業部", k=1)[0]
+    assert doc == 0 and score < 0.5
+    assert index.query("港区の青山一丁目ビル", k=1, min_similarity=0.2) == []
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""file_content_hash のメモの確認"""
+
+import hashlib
+import os
+
+from utils import file_hash
+from utils.file_hash import file_content_hash
+
+
+def test_hash_is_memoized_until_file_changes(tmp_path):
+    path = tmp_path / "a.bin"
+    path.write_bytes(b"first")
+    file_hash._hash_for_signature.cache_clear()
+    assert file_content_hash(str(path)) == hashlib.sha256(b"first").hexdigest()
+    assert file_content_hash(str(path)) == hashlib.sha256(b"first").hexdigest()
+    assert file_hash._hash_for_signature.cache_info().hits == 1
+
+    path.write_bytes(b"second!")
+    os.utime(path, ns=(0, 10**9))
+    assert file_content_hash(str(path)) == hashlib.sha256(b"second!").hexdigest()
+
+
+def test_memo_is_bounded_and_skips_failures(tmp_path):
+    assert file_hash._hash_for_signature.cache_info().maxsize == file_hash._HASH_MEMO_SIZE
+    assert file_content_hash(str(tmp_path / "missing.bin")) is None
+    unreadable = tmp_path / "dir"
+    unreadable.mkdir()
+    file_hash._hash_for_signature.cache_clear()
+    assert file_content_hash(str(unreadable)) is None
+    assert file_hash._hash_for_signature.cache_info().currsize == 0
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""GeminiAPI._call_async がキャンセル時にモデル別の送信枠を返却することの確認"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("google.genai")
+
+from app.services import gemini_api
+from app.services.rate_limiter import ModelRateLimiter
+
+
+def _api():
+    # クライアント生成（APIキーの確認）を通さず、_call_async だけを使う
+    return gemini_api.GeminiAPI.__new__(gemini_api.GeminiAPI)
+
+
+def test_call_async_returns_slot_on_cancel(monkeypatch):
+    limiter = ModelRateLimiter("test-model", rpm=6000, max_concurrency=1)
+    monkeypatch.setattr(gemini_api, "get_rate_limiter", lambda model: limiter)
+    api = _api()
+
+    async def scenario():
+        task = asyncio.ensure_future(api._call_async(lambda: asyncio.sleep(10), model="test-model"))
+        await asyncio.sleep(0.05)
+        assert limiter.concurrency.in_flight == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert limiter.concurrency.in_flight == 0
+    assert limiter.concurrency.limit == 1.0
+
+
+def test_call_async_returns_slot_on_success(monkeypatch):
+    limiter = ModelRateLimiter("test-model", rpm=6000, max_concurrency=2)
+    monkeypatch.setattr(gemini_api, "get_rate_limiter", lambda model: limiter)
+    api = _api()
+
+    async def call():
+        return "ok"
+
+    assert asyncio.run(api._call_async(call, model="test-model")) == "ok"
+    assert limiter.concurrency.in_flight == 0
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""MediaPipeline の分割段階と、中止時・処理失敗時のアップロード済みファイルの削除の確認"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("google.genai")
+
+from app.services.media_pipeline import MediaPipeline
+from app.services.scheduler import RunControl
+
+
+class _File:
+    def __init__(self, name):
+        self.name = name
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGemini:
+    """パイプラインが使う GeminiAPI のメソッドだけを持つ代替"""
+
+    def __init__(self):
+        self.upload_cache = None
+        self.split_gate = {}
+        self.processing_gate = None
+        self.deleted = []
+        self.uploaded = []
+        self.failed = set()
+        self.forgotten = []
+
+    def media_analysis_settings(self, media_type):
+        return "動画", {}
+
+    async def split_media_file(self, file_path, media_type):
+        gate = self.split_gate.get(file_path)
+        if gate is not None:
+            await gate.wait()
+        return [file_path]
+
+    def _check_file_size(self, file_path):
+        pass
+
+    async def prepare_media_file(self, file_path, media_type):
+        return file_path
+
+    async def inline_media_part(self, file_path):
+        return None
+
+    async def lookup_uploaded_file(self, file_path):
+        return f"key:{file_path}", None
+
+    async def upload_file_async(self, file_path):
+        uploaded = _File(f"files/{file_path}")
+        self.uploaded.append(uploaded.name)
+        return uploaded
+
+    async def wait_for_processing_async(self, uploaded):
+        if self.processing_gate is not None:
+            await self.processing_gate.wait()
+        return uploaded.name not in self.failed
+
+    async def remember_uploaded_file(self, cache_key, uploaded):
+        pass
+
+    async def forget_uploaded_file(self, cache_key):
+        self.forgotten.append(cache_key)
+
+    async def generate_from_media_async(self, prompt, media, analysis_config, response_schema=None, cache_prefix=None):
+        return _Response(f"ok:{media.name}")
+
+    async def delete_file_async(self, name):
+        self.deleted.append(name)
+
+
+def test_slow_split_does_not_block_other_files():
+    gemini = FakeGemini()
+    done = []
+
+    async def scenario():
+        gemini.split_gate["big.mp4"] = asyncio.Event()
+        pipeline = MediaPipeline(gemini, "video", "P")
+
+        def on_done(jobs):
+            done.append(jobs[0].file_path)
+            if jobs[0].file_path == "small.mp4":
+                # 大きいファイルの分割中に、後ろのファイルが先に完了している
+                gemini.split_gate["big.mp4"].set()
+
+        await asyncio.wait_for(pipeline.run([(0, "big.mp4"), (1, "small.mp4")], on_done), timeout=5)
+
+    asyncio.run(scenario())
+    assert done == ["small.mp4", "big.mp4"]
+    assert sorted(gemini.deleted) == ["files/big.mp4", "files/small.mp4"]
+
+
+def test_cancel_deletes_uploaded_files():
+    gemini = FakeGemini()
+    skipped = []
+
+    async def scenario():
+        gemini.processing_gate = asyncio.Event()
+        control = RunControl()
+        pipeline = MediaPipeline(gemini, "video", "P")
+        run = asyncio.ensure_future(pipeline.run([(0, "a.mp4"), (1, "b.mp4")], lambda jobs: None,
+                                                 control=control, on_skipped=lambda i, path: skipped.append(i)))
+        while len(gemini.uploaded) < 2:
+            await asyncio.sleep(0.01)
+        control.cancel()
+        await asyncio.wait_for(run, timeout=5)
+
+    asyncio.run(scenario())
+    assert sorted(skipped) == [0, 1]
+    assert sorted(gemini.deleted) == ["files/a.mp4", "files/b.mp4"]
+
+
+def test_failed_upload_is_deleted_and_forgotten_when_reuse_is_enabled():
+    gemini = FakeGemini()
+    gemini.upload_cache = object()
+    gemini.failed.add("files/a.mp4")
+    done = {}
+
+    async def scenario():
+        pipeline = MediaPipeline(gemini, "video", "P")
+        await asyncio.wait_for(pipeline.run([(0, "a.mp4"), (1, "b.mp4")],
+                                            lambda jobs: done.update({jobs[0].index: jobs[0]})), timeout=5)
+
+    asyncio.run(scenario())
+    assert done[0].error is not None and done[1].error is None
+    # 再利用キャッシュに登録した b.mp4 は残し、処理に失敗した a.mp4 だけを削除する
+    assert gemini.deleted == ["files/a.mp4"]
+    assert gemini.forgotten == ["key:a.mp4"]
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""レートリミッタの送信枠がキャンセル時にも返却されることの確認"""
+
+import asyncio
+
+import pytest
+
+from app.services.rate_limiter import ModelRateLimiter
+
+
+def test_cancel_during_bucket_wait_returns_slot():
+    limiter = ModelRateLimiter("test-model", rpm=60, max_concurrency=2)
+    # 蓄積済みトークンを使い切り、次の acquire がバケット待ちになるようにする
+    limiter.bucket.reserve()
+    limiter.bucket.reserve()
+
+    async def scenario():
+        task = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0.05)
+        assert limiter.concurrency.in_flight == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_cancel_does_not_change_limit():
+    limiter = ModelRateLimiter("test-model", rpm=600, max_concurrency=4)
+    limiter.concurrency.limit = 2.0
+    assert limiter.concurrency.try_acquire()
+    limiter.cancel()
+    assert limiter.concurrency.in_flight == 0
+    assert limiter.concurrency.limit == 2.0
+
+
+def test_repeated_cancellation_keeps_capacity():
+    limiter = ModelRateLimiter("test-model", rpm=6000, max_concurrency=1)
+
+    async def hung_call():
+        await limiter.acquire()
+        try:
+            await asyncio.sleep(10)
+        except BaseException:
+            limiter.cancel()
+            raise
+
+    async def scenario():
+        for _ in range(3):
+            task = asyncio.ensure_future(hung_call())
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        # 枠が漏れていなければ次の acquire はすぐに完了する
+        await asyncio.wait_for(limiter.acquire(), timeout=1.0)
+
+    asyncio.run(scenario())
+    assert limiter.concurrency.in_flight == 1
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""構造化出力のスキーマの確認"""
+
+from app.services.response_schema import BATCH_INDEX_KEY, batch_index_key, build_batch_schema
+
+
+def test_batch_schema_keeps_all_output_headers():
+    schema = build_batch_schema(["index", "a"])
+    items = schema["items"]
+    assert items["required"] == [BATCH_INDEX_KEY, "index", "a"]
+    assert items["properties"]["index"] == {"type": "STRING"}
+    assert items["properties"][BATCH_INDEX_KEY] == {"type": "INTEGER"}
+
+
+def test_index_key_avoids_colliding_header():
+    key = batch_index_key([BATCH_INDEX_KEY, "a"])
+    assert key != BATCH_INDEX_KEY
+    assert build_batch_schema([BATCH_INDEX_KEY, "a"])["items"]["required"] == [key, BATCH_INDEX_KEY, "a"]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""ResultCache の接続共有と非同期の読み書きの確認"""
+
+import asyncio
+
+from app.services.result_cache import ResultCache
+
+
+def test_tables_in_one_file_share_a_connection(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    results = ResultCache(path)
+    uploads = ResultCache(path, table="uploads")
+    assert results._conn is uploads._conn
+    assert results._lock is uploads._lock
+
+    results.put("k", {"a": "1"})
+    uploads.put("k", {"name": "files/x"})
+    assert results.get("k") == {"a": "1"}
+    assert uploads.get("k") == {"name": "files/x"}
+
+
+def test_async_methods_round_trip(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache.sqlite3"))
+
+    async def scenario():
+        assert await cache.aget("missing") is None
+        await cache.aput("k", ["x", 1])
+        assert await cache.aget("k") == ["x", 1]
+        await cache.adelete("k")
+        assert await cache.aget("k") is None
+        await cache.aevict()
+
+    asyncio.run(scenario())
+
+
+def test_get_many_touches_hits_with_one_commit(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache.sqlite3"))
+    for i in range(5):
+        cache.put(f"k{i}", i)
+    cache._conn.execute("UPDATE results SET last_used = 0")
+    cache._conn.commit()
+
+    statements = []
+    cache._conn.set_trace_callback(statements.append)
+    found = cache.get_many(["k0", "k3", "missing", "k3"])
+    cache._conn.set_trace_callback(None)
+
+    assert found == {"k0": 0, "k3": 3}
+    assert sum(1 for sql in statements if sql == "COMMIT") == 1
+    used = dict(cache._conn.execute("SELECT key, last_used FROM results").fetchall())
+    assert used["k0"] > 0 and used["k3"] > 0 and used["k1"] == 0
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""apply_rule の結果キャッシュのキーがプロンプトに影響する要素で変わることの確認"""
+
+import pytest
+
+pytest.importorskip("google.genai")
+
+from app.services.rule_service import RuleService
+
+HEADERS = ["AIの進捗", "元の値", "a"]
+
+
+class FakeGemini:
+    minutes_model = "text-model"
+    transcription_model = "media-model"
+    context_cache = None
+
+
+def _service():
+    service = RuleService.__new__(RuleService)
+    service.gemini = FakeGemini()
+    service._fewshot_indexes = {}
+    return service
+
+
+def _rule(**overrides):
+    rule = {"id": 1, "prompt": "P", "mode": "normal", "json_format_example": {"a": ""},
+            "sample_data": {"headers": HEADERS, "rows": [["", "りんご", "果物"]]}}
+    rule.update(overrides)
+    return rule
+
+
+def _key(rule, inp="みかん", headers=("a",), service=None):
+    return (service or _service())._result_cache_key(rule, list(headers), inp)
+
+
+def test_same_request_gives_same_key():
+    assert _key(_rule()) == _key(_rule())
+
+
+def test_key_changes_with_what_is_sent():
+    base = _key(_rule())
+    assert _key(_rule(prompt="Q")) != base
+    assert _key(_rule(field_descriptions={"a": "分類"})) != base
+    assert _key(_rule(), inp="ぶどう") != base
+    assert _key(_rule(), headers=("a", "b")) != base
+
+    service = _service()
+    service.gemini.minutes_model = "other-model"
+    assert _key(_rule(), service=service) != base
+
+
+def test_key_changes_with_fewshot_samples():
+    other_samples = _rule(id=2, sample_data={"headers": HEADERS, "rows": [["", "りんご", "赤い果物"]]})
+    assert _key(_rule()) != _key(other_samples)
+
+
+def test_media_key_tracks_file_changes(tmp_path):
+    path = tmp_path / "a.png"
+    path.write_bytes(b"1")
+    rule = _rule(mode="image", sample_data={"headers": HEADERS, "rows": []})
+    first = _key(rule, inp=str(path))
+    path.write_bytes(b"22")
+    assert _key(rule, inp=str(path)) != first
+    assert _key(rule, inp=str(tmp_path / "missing.png")) is None
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""テキストバッチ処理の分割・エラー時の挙動の確認"""
+
+import asyncio
+import json
+import re
+
+import pytest
+
+pytest.importorskip("google.genai")
+
+from app.services.rule_service import RuleService
+
+HEADERS = ["AIの進捗", "元の値", "a"]
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGemini:
+    """generate_json_async の呼び出しを記録し、respond(contents) の戻り値を返す"""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.calls = []
+        self.minutes_model = "test-model"
+        self.context_cache = None
+
+    async def generate_json_async(self, model, contents, response_schema, config_params=None, cache_prefix=None):
+        self.calls.append(contents)
+        result = self.respond(contents)
+        if isinstance(result, Exception):
+            raise result
+        return _Response(result)
+
+
+def _service(respond):
+    service = RuleService.__new__(RuleService)
+    service.gemini = FakeGemini(respond)
+    service._fewshot_indexes = {}
+    return service
+
+
+def _rule():
+    return {"id": 1, "prompt": "P", "mode": "normal", "json_format_example": {"a": ""},
+            "sample_data": {"headers": HEADERS, "rows": []}}
+
+
+def _batch_answer(contents, header="a"):
+    """バッチプロンプト内の「[i] 元の値: x」に対して header=x を返す（1行用プロンプトならオブジェクトで返す）"""
+    rows = re.findall(r"^\[(\d+)\] 元の値: (.*)$", contents, re.M)
+    if not rows:
+        return json.dumps({header: re.search(r"^元の値: (.*)$", contents, re.M).group(1)})
+    index_key = re.search(r'各要素の"([^"]+)"には', contents).group(1)
+    return json.dumps([{index_key: int(i), header: value} for i, value in rows])
+
+
+def test_api_error_fails_whole_batch_without_splitting():
+    service = _service(lambda contents: PermissionError("403 PERMISSION_DENIED"))
+    results = asyncio.run(service._apply_ai_to_batch(_rule(), ["a"], ["x", "y", "z", "w"]))
+    assert len(service.gemini.calls) == 1
+    assert [r["status"] for r in results] == ["error"] * 4
+    assert [r["input"] for r in results] == ["x", "y", "z", "w"]
+    assert all("PERMISSION_DENIED" in r["error_msg"] for r in results)
+
+
+def test_unparseable_response_splits_batch():
+    answers = iter(["not json"])
+
+    def respond(contents):
+        return next(answers, None) or _batch_answer(contents)
+
+    service = _service(respond)
+    results = asyncio.run(service._apply_ai_to_batch(_rule(), ["a"], ["x", "y", "z", "w"]))
+    assert [r["status"] for r in results] == ["success"] * 4
+    assert [r["output"]["a"] for r in results] == ["x", "y", "z", "w"]
+    # 壊れた返答1回 + 半分ずつの2回
+    assert len(service.gemini.calls) == 3
+
+
+def test_missing_rows_are_retried_alone():
+    def respond(contents):
+        answer = json.loads(_batch_answer(contents))
+        if isinstance(answer, list) and len(answer) == 3:
+            answer = answer[:2]
+        return json.dumps(answer)
+
+    service = _service(respond)
+    results = asyncio.run(service._apply_ai_to_batch(_rule(), ["a"], ["x", "y", "z"]))
+    assert [r["output"]["a"] for r in results] == ["x", "y", "z"]
+    assert len(service.gemini.calls) == 2
+    assert service.gemini.calls[1].endswith("元の値: z")
+
+
+def test_output_header_named_index_is_kept():
+    rule = {**_rule(), "json_format_example": {"index": ""}}
+    service = _service(lambda contents: _batch_answer(contents, header="index"))
+    results = asyncio.run(service._apply_ai_to_batch(rule, ["index"], ["x", "y"]))
+    assert len(service.gemini.calls) == 1
+    assert [r["output"] for r in results] == [{"index": "x"}, {"index": "y"}]
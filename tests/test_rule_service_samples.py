@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""メディアルールのサンプル照合（内容ハッシュによる一致）の確認"""
+
+import pytest
+
+pytest.importorskip("google.genai")
+
+from app.services import rule_service
+from app.services.rule_service import RuleService
+
+HEADERS = ["AIの進捗", "元の値", "a"]
+
+
+def _service():
+    service = RuleService.__new__(RuleService)
+    service._sample_indexes = {}
+    return service
+
+
+def _match(service, rule, inp):
+    index = service._get_sample_index(rule)
+    return service._match_sample(rule, index, [3], ["a"], inp)
+
+
+def test_media_input_is_hashed_only_when_size_matches_a_sample(tmp_path, monkeypatch):
+    sample = tmp_path / "sample.png"
+    sample.write_bytes(b"same")
+    rule = {"id": 1, "mode": "image", "sample_data": {"headers": HEADERS, "rows": [["", str(sample), "猫"]]}}
+    service = _service()
+    service._get_sample_index(rule)
+
+    hashed = []
+    real_hash = rule_service.file_content_hash
+    monkeypatch.setattr(rule_service, "file_content_hash", lambda path: (hashed.append(path), real_hash(path))[1])
+
+    copy = tmp_path / "copy.png"
+    copy.write_bytes(b"same")
+    other = tmp_path / "other.png"
+    other.write_bytes(b"different size")
+
+    assert _match(service, rule, str(copy))["output"] == {"a": "猫"}
+    assert _match(service, rule, str(other)) is None
+    assert _match(service, rule, str(tmp_path / "missing.png")) is None
+    assert hashed == [str(copy)]
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""RunJournal の記録内容と fsync の回数、書き込みスレッドの確認"""
+
+import threading
+import time
+
+from app.services import run_journal
+from app.services.run_journal import RunJournal, find_interrupted_run
+
+
+def _count_fsync(monkeypatch, gate=None):
+    calls = []
+    real_fsync = run_journal.os.fsync
+
+    def fsync(fd):
+        if gate is not None:
+            gate.wait()
+        calls.append(fd)
+        real_fsync(fd)
+
+    monkeypatch.setattr(run_journal.os, "fsync", fsync)
+    return calls
+
+
+def test_rows_are_synced_in_batches(tmp_path, monkeypatch):
+    calls = _count_fsync(monkeypatch)
+    monkeypatch.setattr(run_journal, "SYNC_INTERVAL_SECONDS", 3600)
+    journal = RunJournal.start(str(tmp_path), 1, "normal", list(range(120)), [f"v{i}" for i in range(120)])
+    assert len(calls) == 1
+    for i in range(120):
+        journal.record(i, {"status": "success", "output": {"a": str(i)}})
+    journal.flush()
+    # 開始行 + 50行以上たまるごと（まとめて書かれた場合は1回にまとまる）
+    assert 2 <= len(calls) <= 3
+    synced = len(calls)
+    journal.close()
+    assert len(calls) <= synced + 1
+
+    interrupted = find_interrupted_run(str(tmp_path))
+    assert len(interrupted["completed"]) == 120
+    assert interrupted["completed"][119]["output"] == {"a": "119"}
+
+
+def test_record_does_not_wait_for_fsync(tmp_path, monkeypatch):
+    gate = threading.Event()
+    gate.set()
+    calls = _count_fsync(monkeypatch, gate)
+    journal = RunJournal.start(str(tmp_path), 1, "normal", list(range(60)), [f"v{i}" for i in range(60)])
+    gate.clear()
+    start = time.monotonic()
+    for i in range(60):
+        journal.record(i, {"status": "success", "output": {}})
+    # fsync が止まっていても record はすぐに戻る
+    assert time.monotonic() - start < 0.5
+    assert len(calls) == 1
+    gate.set()
+    journal.close()
+    assert len(find_interrupted_run(str(tmp_path))["completed"]) == 60
+
+
+def test_rows_are_readable_before_sync(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_journal, "SYNC_INTERVAL_SECONDS", 3600)
+    journal = RunJournal.start(str(tmp_path), 1, "normal", [0, 1], ["a", "b"])
+    journal.record(0, {"status": "success", "output": {"x": "1"}})
+    journal.record(1, {"status": "cancelled"})
+    journal.flush()
+    # fsync 前でも flush 済みのため、異常終了時と同じく別の読み込みから見える
+    interrupted = find_interrupted_run(str(tmp_path))
+    assert list(interrupted["completed"]) == [0]
+    journal.finish({"success": 1})
+    assert find_interrupted_run(str(tmp_path)) is None
+    # 閉じた後の記録は無視される
+    journal.record(1, {"status": "success", "output": {}})
+    journal.flush()
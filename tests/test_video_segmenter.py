@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""VideoSegmenter の分割失敗時の挙動の確認"""
+
+import asyncio
+
+from app.services import video_segmenter
+from app.services.ffmpeg_tools import FFmpegError
+from app.services.video_segmenter import DEFAULT_VIDEO_SEGMENTATION_CONFIG, VideoSegmenter
+
+
+def test_failed_split_falls_back_to_original_file(tmp_path, monkeypatch):
+    video = tmp_path / "long.mp4"
+    video.write_bytes(b"0" * 1024)
+
+    async def probe_duration(ffmpeg, file_path):
+        return 3600.0
+
+    async def run_ffmpeg(ffmpeg, args):
+        raise FFmpegError("segment muxer failed")
+
+    monkeypatch.setattr(video_segmenter, "probe_duration", probe_duration)
+    monkeypatch.setattr(video_segmenter, "run_ffmpeg", run_ffmpeg)
+    segmenter = VideoSegmenter("ffmpeg", str(tmp_path / "cache"), dict(DEFAULT_VIDEO_SEGMENTATION_CONFIG))
+
+    assert asyncio.run(segmenter.split(str(video))) == [str(video)]
+    assert list((tmp_path / "cache").iterdir()) == []
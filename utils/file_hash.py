@@ -0,0 +1,44 @@
+import os
+import hashlib
+import logging
+from functools import lru_cache
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_HASH_CHUNK_SIZE = 1024 * 1024  # 1MBずつ読み込む
+_HASH_MEMO_SIZE = 4096          # メモしておくファイル数の上限（古いものから捨てる）
+
+
+def file_signature(file_path: str) -> Optional[Tuple[str, int, int]]:
+    """ファイルの (絶対パス, サイズ, 更新時刻ns) を返す。存在しない場合はNone"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=_HASH_MEMO_SIZE)
+def _hash_for_signature(path: str, size: int, mtime_ns: int) -> str:
+    """(絶対パス, サイズ, 更新時刻) ごとにメモする SHA-256（読めない場合の OSError はメモされない）"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_content_hash(file_path: str) -> Optional[str]:
+    """
+    ファイル内容のSHA-256を返す。存在しない・読めない場合はNone
+    (パス, サイズ, 更新時刻) が同じ間は再計算せずメモした値を返す（最近使った順に最大 _HASH_MEMO_SIZE 件）
+    """
+    signature = file_signature(file_path)
+    if signature is None:
+        return None
+    try:
+        return _hash_for_signature(*signature)
+    except OSError as e:
+        logger.warning(f"Failed to hash file {file_path}: {e}")
+        return None